@@ -0,0 +1,73 @@
+"""
+The report path's order parsing as it was before src/order_parser.py, kept
+only as a reference for benchmarks/parsers.py.
+
+parse_whatsapp_orders() and parse_order_text() are copied unchanged from the
+old generate_report.py, apart from writing the RLM marks as escapes. They
+split on the iOS Arabic header only and read just the amount and the agent,
+which made them the fastest of the old parsers; they are not used by the app.
+"""
+import re
+
+
+def parse_whatsapp_orders(whatsapp_text):
+    """
+    Parse WhatsApp text containing multiple orders separated by timestamps and sender names
+    """
+    orders = []
+    
+    # Split by WhatsApp timestamp pattern [date, time] ~ sender:
+    # Pattern: [\u200f17\u200f/7\u200f/2025، 12:37:42 ص] ~ sender name:
+    timestamp_pattern = r'\[\u200f\d+\u200f/\d+\u200f/\d+،\s*\d+:\d+:\d+\s*[صم]\]\s*~?\s*[^:]+:'
+    
+    # Split the text by timestamps
+    order_blocks = re.split(timestamp_pattern, whatsapp_text)
+    
+    # Remove empty blocks and process each order
+    for block in order_blocks:
+        block = block.strip()
+        if block and len(block) > 50:  # Filter out very short blocks
+            # Clean up the block by removing WhatsApp editing markers
+            block = re.sub(r'\u200f<تم تعديل هذه الرسالة>', '', block)
+            orders.append(block)
+    
+    return orders
+
+
+def parse_order_text(order_text):
+    """
+    Parse individual order text to extract sales amount and agent name
+    """
+    sales_amount = 0
+    agent_name = ""
+    
+    # Extract 'المبلغ' - look for patterns like "المبلغ : 1890+ 75م.ش" or "المبلغ : 1190 + 65"
+    amount_patterns = [
+        r'المبلغ\s*:\s*([\d,\.]+)\s*\+?\s*([\d,\.]*)\s*م\.ش',  # Pattern with م.ش
+        r'المبلغ\s*:\s*([\d,\.]+)\s*\+\s*([\d,\.]+)',         # Pattern with +
+        r'المبلغ\s*:\s*([\d,\.]+)\s*\+\s*([\d,\.]+)\s*شحن',   # Pattern with شحن
+        r'المبلغ\s*:\s*([\d,\.]+)'                            # Simple pattern
+    ]
+    
+    for pattern in amount_patterns:
+        amount_match = re.search(pattern, order_text)
+        if amount_match:
+            product_price = float(amount_match.group(1).replace(',', ''))
+            sales_amount = product_price  # Sales excluding shipping
+            break
+
+    # Extract 'الايچينت' or 'الايچينت :'
+    agent_patterns = [
+        r'الايچينت\s*:\s*(.+?)(?:\n|$)',
+        r'الايچينت\s*:\s*(.+?)(?:\s|$)'
+    ]
+    
+    for pattern in agent_patterns:
+        agent_match = re.search(pattern, order_text)
+        if agent_match:
+            agent_name = agent_match.group(1).strip()
+            # Clean up agent name
+            agent_name = re.sub(r'\u200f<تم تعديل هذه الرسالة>', '', agent_name)
+            break
+        
+    return sales_amount, agent_name
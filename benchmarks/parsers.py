@@ -0,0 +1,186 @@
+"""
+Throughput, peak memory and correctness of every order parser in the repo.
+
+Each parser reads the same synthetic export (benchmarks/whatsapp_export.py)
+at each requested size:
+
+    parse_orders     src.order_parser.parse_orders on the whole text
+    order_stream     OrderStream fed in import-sized chunks
+    import_orders    the streaming import, inserting into a scratch SQLite file
+    llm_stub         LLMOrderParser with the local stub client (no network)
+    legacy           the report path's old split+search parsing (reference only)
+
+Time is the best of --repeat runs. Peak memory is measured in a separate run
+under tracemalloc, so tracing doesn't slow the timed ones. Correctness
+compares the orders found with the ones the generator wrote: recall and
+precision on (name, price, shipping), and the total sales. llm_stub only
+reports totals, so it is checked on order count and total amount.
+
+legacy is the old generate_report.py parsing, kept in
+benchmarks/legacy_parsers.py to compare speed against. It only splits on the
+iOS Arabic header and only reads the price, so its order count and sales are
+shown but never fail the run.
+
+    python -m benchmarks.parsers --messages 1000 10000 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.legacy_parsers import parse_order_text, parse_whatsapp_orders
+from benchmarks.whatsapp_export import generate_export
+from src.db import ConnectionManager
+from src.order_import import CHUNK_SIZE, import_orders, iter_string_chunks
+from src.order_llm import LLMOrderParser, StubLLMClient
+from src.order_parser import OrderStream, parse_orders
+
+
+def _orders_result(orders):
+    return {'orders': [(order.name, order.price, order.shipping) for order in orders]}
+
+
+def run_parse_orders(text):
+    return _orders_result(parse_orders(text))
+
+
+def run_order_stream(text):
+    stream = OrderStream()
+    orders = []
+    for chunk in iter_string_chunks(text, CHUNK_SIZE):
+        orders.extend(stream.feed(chunk))
+    orders.extend(stream.close())
+    return _orders_result(orders)
+
+
+def run_import_orders(text):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ConnectionManager(os.path.join(tmp, 'bench.db'))
+        db.migrate()
+        conn = db.connection()
+        summary = import_orders(conn, 'A', iter_string_chunks(text, CHUNK_SIZE))
+        rows = conn.execute('SELECT customer, price, shipping FROM order_lines').fetchall()
+        db.close_all()
+    return {'orders': [tuple(row) for row in rows], 'order_count': summary['order_count'],
+            'total_sales': summary['total_sales']}
+
+
+def run_llm_stub(text):
+    # A fresh parser each run, so its answer cache doesn't turn later runs into lookups.
+    parser = LLMOrderParser(client=StubLLMClient(), breaker=None)
+    result = parser.parse(text)
+    result['llm_calls'] = parser.client.calls
+    return result
+
+
+def run_legacy(text):
+    # Same counting as the old generate_report(): blocks with a price are orders.
+    orders = 0
+    sales = 0
+    for block in parse_whatsapp_orders(text):
+        sales_amount, _ = parse_order_text(block)
+        if sales_amount > 0:
+            orders += 1
+            sales += sales_amount
+    return {'order_count': orders, 'sales': sales}
+
+
+PARSERS = {
+    'parse_orders': run_parse_orders,
+    'order_stream': run_order_stream,
+    'import_orders': run_import_orders,
+    'llm_stub': run_llm_stub,
+    'legacy': run_legacy,
+}
+
+# Measured for comparison only; their misses don't fail the run.
+REFERENCE_PARSERS = {'legacy'}
+
+
+def check(result, expected):
+    """Correctness figures of one parser's result against the generated orders."""
+    want_sales = sum(order.price for order in expected)
+    if 'sales' in result:
+        return {
+            'orders': result['order_count'],
+            'expected': len(expected),
+            'total_ok': abs(result['sales'] - want_sales) < 0.01,
+        }
+    if 'orders' not in result:
+        want_total = sum(order.price + order.shipping for order in expected)
+        return {
+            'orders': result['order_count'],
+            'expected': len(expected),
+            'total_ok': abs(result['total_amount'] - want_total) < 0.01,
+            'llm_calls': result.get('llm_calls', 0),
+        }
+    found = Counter(result['orders'])
+    wanted = Counter(order.key for order in expected)
+    matched = sum((found & wanted).values())
+    return {
+        'orders': len(result['orders']),
+        'expected': len(expected),
+        'recall': matched / len(expected) if expected else 1.0,
+        'precision': matched / len(result['orders']) if result['orders'] else 1.0,
+        'total_ok': abs(sum(price for _, price, _ in result['orders']) - want_sales) < 0.01,
+    }
+
+
+def measure(run, text, repeat):
+    """(best seconds, peak traced bytes, last result) of run(text)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = run(text)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(text)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the order parsers on synthetic WhatsApp exports.')
+    parser.add_argument('--messages', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--parsers', nargs='+', choices=sorted(PARSERS), default=list(PARSERS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'parser':<14} {'messages':>8} {'KB':>7} {'seconds':>8} {'MB/s':>7} {'msg/s':>9} "
+          f"{'peak MB':>8}  correctness")
+    failed = False
+    for messages in args.messages:
+        text, expected = generate_export(messages, args.seed)
+        kb = len(text.encode('utf-8')) / 1024
+        for name in args.parsers:
+            seconds, peak, result = measure(PARSERS[name], text, args.repeat)
+            figures = check(result, expected)
+            wrong = (not figures['total_ok'] or figures['orders'] != figures['expected']
+                     or figures.get('recall', 1.0) < 1.0 or figures.get('precision', 1.0) < 1.0)
+            if wrong and name not in REFERENCE_PARSERS:
+                failed = True
+            details = ' '.join(
+                f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in figures.items()
+            )
+            print(f"{name:<14} {messages:>8} {kb:>7.0f} {seconds:>8.3f} {kb / 1024 / seconds:>7.1f} "
+                  f"{messages / seconds:>9.0f} {peak / 1024 / 1024:>8.1f}  {details}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
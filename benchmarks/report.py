@@ -0,0 +1,86 @@
+"""
+End-to-end latency of /api/generate_report against the replayed Graph API.
+
+Runs the Flask app in process with GRAPH_API_MODE=replay (src/graph_replay.py),
+so no network or real token is used, and sends --requests report requests
+from --concurrency threads. The spend cache is disabled unless --cached is
+given, so every report goes through the Facebook fetch path. Faults are set
+with the GRAPH_REPLAY_* options below or the same environment variables.
+
+    python -m benchmarks.report --requests 200 --concurrency 8 --latency 0.3 --jitter 0.2
+    python -m benchmarks.report --error-rate 0.1 --throttle-rate 0.05 --fetch-mode batch
+
+Orders come from the app's own database (src/orders.db), as in development.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test /api/generate_report with a replayed Graph API.')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--cached', action='store_true', help='keep the spend cache on')
+    parser.add_argument('--fetch-mode', choices=['concurrent', 'batch'])
+    parser.add_argument('--replay-file', help='recorded answers (GRAPH_REPLAY_FILE)')
+    parser.add_argument('--latency', type=float)
+    parser.add_argument('--jitter', type=float)
+    parser.add_argument('--error-rate', type=float)
+    parser.add_argument('--throttle-rate', type=float)
+    parser.add_argument('--usage-pct', type=float)
+    parser.add_argument('--pages', type=int)
+    args = parser.parse_args()
+
+    # The settings are read when the app is imported, so set them first.
+    os.environ['GRAPH_API_MODE'] = 'replay'
+    options = {
+        'GRAPH_REPLAY_FILE': args.replay_file, 'GRAPH_REPLAY_LATENCY': args.latency,
+        'GRAPH_REPLAY_JITTER': args.jitter, 'GRAPH_REPLAY_ERROR_RATE': args.error_rate,
+        'GRAPH_REPLAY_THROTTLE_RATE': args.throttle_rate, 'GRAPH_REPLAY_USAGE_PCT': args.usage_pct,
+        'GRAPH_REPLAY_PAGES': args.pages, 'FACEBOOK_FETCH_MODE': args.fetch_mode,
+    }
+    for name, value in options.items():
+        if value is not None:
+            os.environ[name] = str(value)
+    if not args.cached:
+        os.environ['SPEND_CACHE_TTL'] = '0'
+        os.environ['SPEND_CACHE_MAX_STALE'] = '0'
+
+    from src.main import app
+
+    client = app.test_client()
+
+    def one(_):
+        start = time.perf_counter()
+        response = client.get('/api/generate_report')
+        body = response.get_json() or {}
+        return time.perf_counter() - start, response.status_code, len(body.get('unavailable_teams') or [])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds for seconds, _, _ in results]
+    failed = sum(1 for _, status, _ in results if status != 200)
+    partial = sum(1 for _, status, missing in results if status == 200 and missing)
+    print(f"{args.requests} reports in {elapsed:.2f}s ({args.requests / elapsed:.1f}/s), "
+          f"concurrency {args.concurrency}")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p90 {percentile(latencies, 0.9) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+    print(f"errors {failed}, reports with unavailable teams {partial}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Synthetic WhatsApp chat exports for the parser benchmarks.
+
+generate_export(messages) builds a team chat the way the agents write it:
+order messages in the long form (name, phones, governorate, offer text,
+amount, page, agent) and the short form (name, amount, agent), mixed with
+chatter, media/deleted/join lines and orders whose amount is not filled in.
+Headers rotate between the iOS Arabic, iOS English and Android export
+formats, labels between the spellings seen in real chats (الأسم, مبلغ,
+الإيچينت, tatweel...), amounts between "1890+ 75م.ش", "1190 + 65",
+"1,250 + 70 شحن", three-number amounts and Arabic-Indic digits, and some
+messages carry the edited marker.
+
+It returns the text and the orders a correct parser finds in it, with price
+and shipping split the way parse_amount() defines, so benchmarks can check
+correctness as well as speed. The same seed always gives the same export.
+
+    python -m benchmarks.whatsapp_export --messages 10000 -o /tmp/chat.txt
+"""
+import argparse
+import random
+from dataclasses import dataclass
+
+FIRST_NAMES = ['محمد', 'أحمد', 'محمود', 'مصطفى', 'عوض', 'مي', 'منى', 'سارة', 'هبة', 'إيمان', 'ياسمين',
+               'عبدالله', 'خالد', 'عمر', 'نورا', 'رانيا', 'هالة', 'شيماء', 'إسلام', 'حسن', 'فاطمة',
+               'آية', 'يوسف', 'كريم', 'دعاء', 'ولاء', 'سمير', 'جمال', 'ريهام', 'نجلاء']
+FAMILY_NAMES = ['سعد', 'أشرف', 'إبراهيم', 'الحداد', 'عبدالرحمن', 'السيد', 'حسين', 'فتحي', 'عادل',
+                'منصور', 'رمضان', 'الشافعي', 'عيسى', 'زكي', 'النجار', 'الشرقاوي', 'بدوي', 'حمدي',
+                'صبري', 'عثمان', 'جاد', 'سليمان', 'فوزي', 'يونس', 'مرسي', 'طه', 'غنيم', 'شعبان',
+                'العربي', 'قاسم']
+AGENTS = ['روان', 'روان محمود', 'ندى', 'شهد', 'مريم', 'هاجر', 'بسمة', 'آلاء']
+GOVERNORATES = ['القاهره', 'الجيزة', 'البحيرة', 'الإسكندرية', 'الشرقية', 'المنوفية', 'أسيوط', 'سوهاج',
+                'الدقهلية', 'قنا']
+PRODUCTS = ['علبة كبسولات بيسالنتا', 'علبة كبسولات ستارفيكس بلس', 'علبة كبسولات جرين كوفي',
+            'كورس بيسالنتا كامل', '2 نقط + 2 اعشاب']
+PAGES = ['بــيـسـالـيـنتـا - Besalenta', 'ستارفيكس - Starfix', 'جرين كوفي']
+OFFERS = [
+    '💥الكورس الثاني لنزول من 30ل35 كيلو\n1- كورس بيسالنتا( كبسولات + نقط + اعشاب)\n'
+    '2- كورس ستارفيكس بلس ( كبسولات + نقط + اعشاب )\nب 1890ج بدلا من 4350ج🔥 + مصاريف الشحن 📦',
+    'عرض الشهر 🔥 علبتين ب 1190ج بدل 2000ج',
+    'الكورس الاول 🤩❤\u200d🔥 نزول من 10 ل 15 كيلو',
+]
+CHATTER = ['تمام يا فندم', 'تم التأكيد مع العميل وهيستلم بكرة ان شاء الله', 'تم الشحن', 'ok',
+           'العميل مش بيرد على التليفون من الصبح، هحاول تاني بالليل', 'صباح الخير يا جماعة 🌹',
+           'ممكن حد يراجع الأوردر اللي فوق؟ المبلغ مش مظبوط', 'العميلة عايزة تأجل الاستلام لبعد العيد',
+           'الطلب ده اتلغى', 'مين مسؤول عن شحنات اسكندرية النهارده؟']
+JUNK = ['<Media omitted>', '\u200eThis message was deleted', '\u200eتم حذف هذه الرسالة', 'null',
+        'image omitted', '\u200e<attached: 00000123-PHOTO-2025-07-17-12-37-42.jpg>']
+
+# Every spelling of a label the parser accepts, as agents type them.
+NAME_LABELS = ['الاسم', 'الأسم', 'اسم', 'الاســم']
+AMOUNT_LABELS = ['المبلغ', 'مبلغ', 'المبـلغ']
+AGENT_LABELS = ['الايچينت', 'الإيچينت', 'الايجنت', 'ايجينت', 'الايجينت']
+PHONE_LABELS = ['رقم التليفون', 'رقم الهاتف', 'رقم الموبايل']
+COLONS = [' : ', ':', ' :', ': ', '： ']
+
+EDITED_MARKERS = ['\u200f<تم تعديل هذه الرسالة>', ' <This message was edited>']
+ARABIC_DIGITS = str.maketrans('0123456789', '٠١٢٣٤٥٦٧٨٩')
+
+# Share of messages of each kind; the rest is chatter.
+ORDER_SHARE = 0.35
+INVALID_ORDER_SHARE = 0.03
+JUNK_SHARE = 0.1
+
+
+@dataclass(frozen=True)
+class ExpectedOrder:
+    name: str
+    price: float
+    shipping: float
+    agent: str
+
+    @property
+    def key(self):
+        return (self.name, self.price, self.shipping)
+
+
+def _header(rng, index, sender):
+    """One message header in a format chosen at random, at a time that grows with index."""
+    minutes = index // 3
+    day = 1 + (minutes // (24 * 60)) % 28
+    hour, minute, second = (minutes // 60) % 24, minutes % 60, index % 60
+    hour12 = hour % 12 or 12
+    style = rng.randrange(4)
+    if style == 0:
+        # iOS with Arabic locale: RLM marks around the date, Arabic comma, ص/م.
+        return (f"[\u200f{day}\u200f/7\u200f/2025، {hour12}:{minute:02d}:{second:02d} "
+                f"{'ص' if hour < 12 else 'م'}] ~ {sender}: ")
+    if style == 1:
+        # iOS with English locale.
+        return f"[{day:02d}/07/2025, {hour:02d}:{minute:02d}:{second:02d}] {sender}: "
+    if style == 2:
+        # Android, the format the old clean_whatsapp_text() stripped.
+        return f"{day:02d}/07/2025, {hour12}:{minute:02d} {'AM' if hour < 12 else 'PM'} - {sender}: "
+    # Android with a short US date.
+    return f"7/{day}/25, {hour12}:{minute:02d} {'AM' if hour < 12 else 'PM'} - {sender}: "
+
+
+def _amount(rng):
+    """(amount text, price, shipping) in one of the layouts agents use."""
+    price = rng.choice([950, 1190, 1250, 1450, 1890, 2350, 3100])
+    shipping = rng.choice([55, 65, 70, 75, 85])
+    style = rng.randrange(6)
+    if style == 0:
+        return f"{price}+ {shipping}م.ش", price, shipping
+    if style == 1:
+        return f"{price} + {shipping}", price, shipping
+    if style == 2:
+        return f"{price:,} + {shipping} شحن", price, shipping
+    if style == 3:
+        # Two products and the shipping fee: the last number is the shipping.
+        extra = rng.choice([300, 450, 1600])
+        return f"{price} + {extra} + {shipping}", price + extra, shipping
+    if style == 4:
+        return f"{price} + {shipping}".translate(ARABIC_DIGITS), price, shipping
+    return f"{price} ج", price, 0
+
+
+def _label(rng, labels):
+    return rng.choice(labels) + rng.choice(COLONS)
+
+
+def _phone(rng):
+    return '01' + rng.choice('0125') + ''.join(rng.choice('0123456789') for _ in range(8))
+
+
+def _order_message(rng, name, amount_text, agent, long_form):
+    lines = [_label(rng, NAME_LABELS) + name]
+    if long_form:
+        lines += [
+            _label(rng, PHONE_LABELS) + _phone(rng) + '   ',
+            'رقم التليفون الاضافي :   ' + _phone(rng),
+            'المحافظه : ' + rng.choice(GOVERNORATES),
+            'العنوان بالتفصيل : بجوار المسجد الكبير',
+            'الاوردر : ' + rng.choice(PRODUCTS),
+            '',
+            'العرض : ' + rng.choice(OFFERS),
+        ]
+    lines.append(_label(rng, AMOUNT_LABELS) + amount_text + (' ' if rng.random() < 0.3 else ''))
+    if long_form:
+        lines += ['السن : ', 'الحاله الصحيه : ', 'ملاحظات', 'البيدچ :' + rng.choice(PAGES),
+                  'اسم الاكونت :  ' + name.split()[0]]
+    lines.append(_label(rng, AGENT_LABELS) + agent)
+    if rng.random() < 0.1:
+        # The agent fixed the message afterwards; the marker ends up on one of its lines.
+        line = rng.randrange(len(lines))
+        lines[line] += rng.choice(EDITED_MARKERS)
+    return '\n'.join(lines)
+
+
+def generate_export(messages, seed=1):
+    """Return (export text, [ExpectedOrder]) for a chat of the given number of messages."""
+    rng = random.Random(seed)
+    used = set()
+    lines = []
+    expected = []
+    for index in range(messages):
+        agent = rng.choice(AGENTS)
+        roll = rng.random()
+        if roll < ORDER_SHARE:
+            while True:
+                name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FAMILY_NAMES)}"
+                amount_text, price, shipping = _amount(rng)
+                # Keep orders distinct, so deduplicating importers store every one.
+                if (name, price, shipping) not in used:
+                    break
+            used.add((name, price, shipping))
+            body = _order_message(rng, name, amount_text, agent, long_form=rng.random() < 0.6)
+            expected.append(ExpectedOrder(name, float(price), float(shipping), agent))
+        elif roll < ORDER_SHARE + INVALID_ORDER_SHARE:
+            # An order sent before the price was agreed: a record without a usable amount.
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FAMILY_NAMES)}"
+            body = _order_message(rng, name, 'لسه هيتأكد', agent, long_form=False)
+        elif roll < ORDER_SHARE + INVALID_ORDER_SHARE + JUNK_SHARE:
+            if rng.random() < 0.3:
+                # System lines have no sender.
+                lines.append(rng.choice([
+                    f"{index % 28 + 1:02d}/07/2025, 9:00 AM - {rng.choice(FIRST_NAMES)} joined using this group's invite link",
+                    f"{index % 28 + 1:02d}/07/2025, 9:05 AM - {rng.choice(FIRST_NAMES)} left",
+                ]))
+                continue
+            body = rng.choice(JUNK)
+        else:
+            body = rng.choice(CHATTER)
+        lines.append(_header(rng, index, agent) + body)
+    return '\n'.join(lines) + '\n', expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic WhatsApp export of team orders.')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+    text, expected = generate_export(args.messages, args.seed)
+    if args.output == '-':
+        print(text, end='')
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"{args.messages} messages, {len(expected)} orders, {len(text) / 1024:.0f} KB -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Arabic text normalization shared by the order parser.
+
+FOLD_TABLE folds the spelling variants seen in team chats onto one form:
+alef/hamza forms, teh marbuta, alef maqsura, Persian/Urdu letters, tatweel,
+bidi and zero-width marks, and Arabic-Indic digits and separators.
+normalize() applies it in a single str.translate pass, skipped when the text
+has nothing to fold.
+
+The same table drives fold_alternation(), which turns normalized words into
+a regex matching every spelling that folds to them, so the parser can scan
+raw text for labels without translating all of it first.
+"""
+import re
+
+_LETTER_FOLDS = {
+    'ا': 'أإآٱ',
+    'ه': 'ةۀ',
+    'ي': 'ىیۍ',
+    'ك': 'کگ',
+    'ج': 'چ',
+    'ف': 'ڤ',
+    'و': 'ۆ',
+}
+# Dropped entirely: tatweel, zero-width space/joiners, LRM/RLM, ALM, bidi embeddings and isolates, BOM.
+IGNORABLE = '\u0640\u200b\u200c\u200d\u200e\u200f\u061c\u202a\u202b\u202c\u202d\u202e\u2066\u2067\u2068\u2069\ufeff'
+
+FOLD_TABLE = str.maketrans({
+    **{variant: letter for letter, variants in _LETTER_FOLDS.items() for variant in variants},
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # Extended (Persian) digits
+    '٫': '.',   # Arabic decimal separator
+    '٬': ',',   # Arabic thousands separator
+    '\u00a0': ' ',   # no-break spaces
+    '\u202f': ' ',
+    '\uff1a': ':',  # fullwidth colon
+    **{ch: None for ch in IGNORABLE},
+})
+
+
+# Any character FOLD_TABLE changes. Most values (amounts, phones, many names)
+# have none, and searching for one is several times cheaper than translating.
+_FOLDABLE_RE = re.compile('[' + ''.join(re.escape(chr(code)) for code in FOLD_TABLE) + ']')
+
+
+def normalize(text):
+    """Fold text onto the canonical spelling used by the parser and fingerprints."""
+    if text.isascii() or _FOLDABLE_RE.search(text) is None:
+        return text
+    return text.translate(FOLD_TABLE)
+
+
+# Only tatweel is allowed between letters: it is the one filler seen inside
+# words, and a single-character repeat keeps the label scan fast.
+_TATWEEL_RUN = '\u0640*'
+
+
+def _fold_atom(ch):
+    if ch == ' ':
+        return r'[ \t\u00a0\u202f]+'
+    if ch in _LETTER_FOLDS:
+        return '[' + ch + _LETTER_FOLDS[ch] + ']'
+    return re.escape(ch)
+
+
+def fold_alternation(words):
+    """
+    Regex source matching any of words (already normalized) in every spelling
+    that normalize() folds to it, with tatweel allowed between letters.
+
+    The words are merged into a prefix tree, so shared prefixes such as "ال"
+    are matched once instead of once per word, and a longer word is always
+    tried before a shorter one it starts with.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def emit(node, first):
+        branches = [
+            ('' if first else _TATWEEL_RUN) + _fold_atom(ch) + emit(child, False)
+            for ch, child in node.items() if ch
+        ]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return emit(trie, True)
@@ -0,0 +1,92 @@
+"""
+Latency budgets and circuit breakers for calls to Facebook and the LLM.
+
+A Budget is the time one request may spend in total; each external call
+gets min(its own timeout, what is left of the budget).
+
+A CircuitBreaker counts consecutive failures per key (an ad account, the LLM
+endpoint). After CIRCUIT_FAILURES of them the key is "open": callers skip it
+without waiting for CIRCUIT_COOLDOWN seconds. Then one trial call is let
+through; its success closes the circuit, its failure opens it again.
+"""
+import os
+import threading
+import time
+
+CIRCUIT_FAILURES = int(os.environ.get('CIRCUIT_FAILURES', 3))
+CIRCUIT_COOLDOWN = float(os.environ.get('CIRCUIT_COOLDOWN', 60))
+
+
+class Budget:
+    """Time left for one request, shared by the external calls it makes."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, limit):
+        """The timeout for one call: its own limit, cut to the time left."""
+        return min(limit, self.remaining())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker, one circuit per key, safe across threads."""
+
+    def __init__(self, name, failures=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        # key -> [consecutive failures, opened_at or None, start of the trial call or None]
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """True if key may be called now. While a circuit is open only one trial call is allowed."""
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit[1] is None:
+                return True
+            now = time.monotonic()
+            if now - circuit[1] < self.cooldown:
+                return False
+            # A trial that never reported back doesn't block the next one forever.
+            if circuit[2] is not None and now - circuit[2] < self.cooldown:
+                return False
+            circuit[2] = now
+            return True
+
+    def success(self, key):
+        with self._lock:
+            circuit = self._circuits.pop(key, None)
+            if circuit is not None and circuit[1] is not None:
+                print(f"{self.name} circuit for {key} closed")
+
+    def failure(self, key):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, [0, None, None])
+            circuit[0] += 1
+            if circuit[2] is not None or (circuit[1] is None and circuit[0] >= self.failures):
+                circuit[1] = time.monotonic()
+                circuit[2] = None
+                print(f"{self.name} circuit for {key} open for {self.cooldown:.0f}s after {circuit[0]} failures")
+
+    def is_open(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return circuit is not None and circuit[1] is not None
+
+    def clear(self):
+        with self._lock:
+            self._circuits.clear()
+
+
+# One breaker per external dependency, shared by the whole process.
+facebook_circuit = CircuitBreaker('Facebook')
+llm_circuit = CircuitBreaker('LLM')
@@ -0,0 +1,133 @@
+"""
+Registry for the app's config files: Facebook tokens, ad account ids and the
+team-to-business mapping.
+
+Files are read on first use and cached. A cached file is stat'ed at most
+once every CONFIG_STAT_INTERVAL seconds and read again only when its mtime
+changes, so reports do no config reads and a new token or account id is
+picked up without a restart.
+"""
+import os
+import threading
+import time
+
+from src.order_store import canonical_team
+
+CONFIG_STAT_INTERVAL = float(os.environ.get('CONFIG_STAT_INTERVAL', 5))
+
+# Business 1: Team A, B, C. Business 2: Team C1.
+# A team_businesses.txt file next to the other config files overrides this.
+DEFAULT_TEAM_BUSINESSES = {
+    'A': 'Business1',
+    'B': 'Business1',
+    'C': 'Business1',
+    'C1': 'Business2',
+}
+
+
+def parse_pairs(text):
+    """Parse "key: value" lines into a dict, skipping blank or malformed lines."""
+    pairs = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and ': ' in line:
+            key, value = line.split(': ', 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class ConfigFile:
+    """One config file, parsed lazily and reloaded when its mtime changes."""
+
+    def __init__(self, path, parse, default=None):
+        self.path = path
+        self.parse = parse
+        self.default = default
+        self._value = default
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < CONFIG_STAT_INTERVAL:
+            return self._value
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < CONFIG_STAT_INTERVAL:
+                return self._value
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                if self._mtime is not None:
+                    print(f"Config file {self.path} disappeared, using defaults")
+                self._value, self._mtime = self.default, None
+                return self._value
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self._value = self.parse(f.read())
+                    self._mtime = mtime
+                    print(f"Loaded config file {self.path}")
+                except Exception as e:
+                    # Keep the last good value; try again on the next check.
+                    print(f"Error loading config file {self.path}: {e}")
+            return self._value
+
+
+class ConfigRegistry:
+    """The config files of one directory."""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.access_token = ConfigFile(
+            os.path.join(base_dir, 'facebook_access_token.txt'), lambda text: text.strip() or None
+        )
+        self.access_tokens = ConfigFile(os.path.join(base_dir, 'facebook_access_tokens.txt'), parse_pairs, {})
+        self.ad_account_ids = ConfigFile(os.path.join(base_dir, 'ad_account_ids.txt'), parse_pairs, {})
+        self.team_businesses = ConfigFile(
+            os.path.join(base_dir, 'team_businesses.txt'), parse_pairs, DEFAULT_TEAM_BUSINESSES
+        )
+
+    def account_ids(self):
+        """{team key ("A", "C1", ...): ad account id}."""
+        return {canonical_team(team): account_id for team, account_id in self.ad_account_ids.get().items()}
+
+    def business_token(self, business):
+        """Token for a Business Manager, falling back to the single facebook_access_token.txt."""
+        return self.access_tokens.get().get(business) or self.access_token.get()
+
+    def team_accounts(self, teams):
+        """
+        Map each of teams (any spelling canonical_team() accepts) to
+        (account_id, access_token), using the token of the team's business.
+        Teams without an account id or token are left out and logged.
+        """
+        account_ids = self.account_ids()
+        businesses = {canonical_team(team): business for team, business in self.team_businesses.get().items()}
+        accounts = {}
+        for team in teams:
+            key = canonical_team(team)
+            if key not in account_ids:
+                print(f"Team {team} not found in mapping")
+                continue
+            business = businesses.get(key, 'Business1')
+            access_token = self.business_token(business)
+            if not access_token:
+                print(f"Access token for {business} not found")
+                continue
+            accounts[team] = (account_ids[key], access_token)
+        return accounts
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_config(base_dir):
+    """The shared registry for base_dir; every module asking for the same directory gets the same one."""
+    base_dir = os.path.abspath(base_dir)
+    with _registries_lock:
+        if base_dir not in _registries:
+            _registries[base_dir] = ConfigRegistry(base_dir)
+        return _registries[base_dir]
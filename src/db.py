@@ -0,0 +1,332 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from datetime import datetime
+
+import pytz
+
+from src.metrics import metrics
+from src.order_store import canonical_team, report_day
+
+# Versioned schema migrations, applied in order and tracked with PRAGMA user_version.
+# Never edit a migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    (1, """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team TEXT NOT NULL,
+            order_count INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (2, """
+        CREATE TABLE IF NOT EXISTS order_lines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team TEXT NOT NULL,
+            customer TEXT,
+            price REAL NOT NULL,
+            shipping REAL NOT NULL DEFAULT 0,
+            agent TEXT,
+            order_day TEXT NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_lines_team_created
+            ON order_lines (team, created_at);
+
+        CREATE TABLE IF NOT EXISTS daily_team_totals (
+            day TEXT NOT NULL,
+            team TEXT NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            sales REAL NOT NULL DEFAULT 0,
+            shipping REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, team)
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_order_lines_rollup_insert
+        AFTER INSERT ON order_lines
+        BEGIN
+            INSERT INTO daily_team_totals (day, team, order_count, sales, shipping)
+            VALUES (NEW.order_day, NEW.team, 1, NEW.price, NEW.shipping)
+            ON CONFLICT (day, team) DO UPDATE SET
+                order_count = order_count + 1,
+                sales = sales + excluded.sales,
+                shipping = shipping + excluded.shipping;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_order_lines_rollup_delete
+        AFTER DELETE ON order_lines
+        BEGIN
+            UPDATE daily_team_totals SET
+                order_count = order_count - 1,
+                sales = sales - OLD.price,
+                shipping = shipping - OLD.shipping
+            WHERE day = OLD.order_day AND team = OLD.team;
+        END;
+    """),
+    (3, """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            stored_at REAL NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS cache_refresh_locks (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+    """),
+    (4, """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id TEXT PRIMARY KEY,
+            team TEXT NOT NULL,
+            status TEXT NOT NULL,
+            blocks_parsed INTEGER NOT NULL DEFAULT 0,
+            orders_saved INTEGER NOT NULL DEFAULT 0,
+            total_sales REAL NOT NULL DEFAULT 0,
+            rejected_count INTEGER NOT NULL DEFAULT 0,
+            rejected TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_import_jobs_created
+            ON import_jobs (created_at);
+    """),
+    (5, """
+        ALTER TABLE order_lines ADD COLUMN fingerprint TEXT;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_order_lines_day_fingerprint
+            ON order_lines (order_day, fingerprint);
+
+        ALTER TABLE import_jobs ADD COLUMN duplicates_skipped INTEGER NOT NULL DEFAULT 0;
+    """),
+    (6, """
+        CREATE TABLE IF NOT EXISTS paste_boundaries (
+            team TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            char_offset INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (team, seq)
+        ) WITHOUT ROWID;
+    """),
+    (7, """
+        CREATE TABLE IF NOT EXISTS dashboard_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day TEXT NOT NULL,
+            team TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_dashboard_events_created
+            ON dashboard_events (created_at);
+
+        CREATE TABLE IF NOT EXISTS dashboard_state (
+            day TEXT NOT NULL,
+            team TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (day, team)
+        ) WITHOUT ROWID;
+    """),
+    (8, """
+        CREATE TABLE IF NOT EXISTS metric_snapshots (
+            worker TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID;
+    """),
+    (9, """
+        CREATE TABLE IF NOT EXISTS request_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            method TEXT NOT NULL,
+            route TEXT NOT NULL,
+            path TEXT NOT NULL,
+            status TEXT,
+            payload_bytes INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            reason TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            stages TEXT NOT NULL,
+            profile BLOB NOT NULL
+        );
+    """),
+    # Reports used to be stored a second time under flight:report:DAY, and
+    # those rows were never deleted.
+    (10, """
+        DELETE FROM cache_entries WHERE key LIKE 'flight:%';
+    """),
+    (11, """
+        ALTER TABLE paste_boundaries ADD COLUMN paste_end INTEGER NOT NULL DEFAULT 0;
+    """),
+    # Dedup per team, like the team files: two teams may sell the same order the same day.
+    (12, """
+        DROP INDEX IF EXISTS idx_order_lines_day_fingerprint;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_order_lines_team_day_fingerprint
+            ON order_lines (team, order_day, fingerprint);
+    """),
+    # Results of LLM parses whose answers came in after the request returned
+    # (src/llm_queue.py), readable from every worker.
+    (13, """
+        CREATE TABLE IF NOT EXISTS llm_results (
+            id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            skipped INTEGER NOT NULL,
+            late INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_llm_results_updated
+            ON llm_results (updated_at);
+    """),
+    # Orders saved before migration 2 only exist as per-save counts in orders.
+    # Give each counted order a row (its price was never stored) on the Cairo
+    # day it was saved, so the daily report and the rollup include them.
+    (14, """
+        WITH RECURSIVE counted (id, remaining) AS (
+            SELECT id, order_count FROM orders WHERE order_count > 0
+            UNION ALL
+            SELECT id, remaining - 1 FROM counted WHERE remaining > 1
+        )
+        INSERT INTO order_lines (team, price, shipping, order_day, created_at)
+        SELECT canonical_team(orders.team), 0, 0,
+               cairo_day(COALESCE(orders.timestamp, CURRENT_TIMESTAMP)),
+               COALESCE(orders.timestamp, CURRENT_TIMESTAMP)
+        FROM counted JOIN orders ON orders.id = counted.id;
+    """),
+    (15, """
+        ALTER TABLE paste_boundaries ADD COLUMN fingerprints TEXT NOT NULL DEFAULT '';
+    """),
+]
+
+# Applied to every new connection. WAL lets readers and the single writer work
+# side by side, and busy_timeout makes concurrent saves wait instead of failing
+# with "database is locked".
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+]
+
+
+class ConnectionManager:
+    """
+    Hands out one long-lived SQLite connection per thread for a database file.
+
+    The schema is migrated once, on first use in each process, so request
+    handlers only pay for a thread-local lookup instead of a connect and a
+    CREATE TABLE on every call.
+    """
+
+    def __init__(self, db_path, timeout=5.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._migrated_pid = None
+        self._connections = set()
+
+    def _connect(self):
+        start = time.perf_counter()
+        # Each connection is only used by the thread that opened it, but the
+        # thread's exit may close it from another thread (see connection()).
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        metrics.observe('db_connect_seconds', time.perf_counter() - start)
+        return conn
+
+    def migrate(self):
+        """Apply pending migrations. Safe to call repeatedly and from several processes."""
+        with self._lock:
+            if self._migrated_pid == os.getpid():
+                return
+            conn = self._connect()
+            try:
+                # BEGIN IMMEDIATE takes the write lock up front so two workers
+                # starting together don't both try to apply the same migration.
+                conn.isolation_level = None
+                # Functions data migrations need that SQL doesn't have.
+                conn.create_function('canonical_team', 1, canonical_team, deterministic=True)
+                conn.create_function('cairo_day', 1, _cairo_day, deterministic=True)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    current = conn.execute("PRAGMA user_version").fetchone()[0]
+                    for version, sql in MIGRATIONS:
+                        if version > current:
+                            for statement in _split_statements(sql):
+                                conn.execute(statement)
+                            conn.execute(f"PRAGMA user_version = {version}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.close()
+            self._migrated_pid = os.getpid()
+
+    def connection(self):
+        """
+        Return this thread's connection, opening it on first use. It is closed
+        when the thread exits, so short-lived threads don't leak file handles.
+        """
+        holder = getattr(self._local, "holder", None)
+        # A connection inherited through fork() must not be reused by the child.
+        if holder is not None and holder.pid == os.getpid():
+            return holder.conn
+        self.migrate()
+        holder = _ThreadConnection(self._connect())
+        with self._lock:
+            self._connections.add(holder.conn)
+        # The thread-local holder is dropped when the thread ends.
+        weakref.finalize(holder, self._release, holder.conn, holder.pid)
+        self._local.holder = holder
+        return holder.conn
+
+    def _release(self, conn, pid):
+        if pid != os.getpid():
+            return
+        with self._lock:
+            if conn not in self._connections:
+                return
+            self._connections.discard(conn)
+        conn.close()
+
+    def close_all(self):
+        """Close every connection opened by this process."""
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class _ThreadConnection:
+    """One thread's connection and the process it was opened in."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+
+
+def _cairo_day(timestamp):
+    # SQLite's CURRENT_TIMESTAMP is UTC "YYYY-MM-DD HH:MM:SS".
+    return report_day(pytz.utc.localize(datetime.strptime(timestamp[:19], '%Y-%m-%d %H:%M:%S')))
+
+
+def _split_statements(sql):
+    # sqlite3.complete_statement lets trigger bodies (which contain ';') stay intact.
+    statements = []
+    buffer = ""
+    for line in sql.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip():
+                statements.append(buffer.strip())
+            buffer = ""
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
@@ -0,0 +1,258 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from facebook_business.adobjects.adaccount import AdAccount
+
+from src.circuit_breaker import facebook_circuit
+from src.facebook_sessions import api_pool
+from src.metrics import metrics, submit_in_context
+from src.rate_limits import is_throttle_error, usage_model
+from src.spend_cache import SpendCache
+
+# Upper bound on simultaneous Graph API calls, and on how long a report waits for all of them.
+MAX_WORKERS = int(os.environ.get('FACEBOOK_MAX_WORKERS', 8))
+FETCH_DEADLINE = float(os.environ.get('FACEBOOK_FETCH_DEADLINE', 15))
+# "concurrent": one request per account in parallel; "batch": one Graph API batch per business token.
+FETCH_MODE = os.environ.get('FACEBOOK_FETCH_MODE', 'concurrent')
+# The Graph API accepts at most 50 requests in one batch call.
+BATCH_LIMIT = 50
+
+# Shared by every report in this process; see src/spend_cache.py for the TTL settings.
+spend_cache = SpendCache(throttle=usage_model)
+
+
+def make_api(access_token):
+    """
+    The pooled API object for one token. It never touches FacebookAdsApi's
+    global default, so accounts from different businesses can be fetched
+    side by side, and it reuses its keep-alive connections across reports.
+    """
+    return api_pool.get(access_token)
+
+
+def _insights_params(since, until):
+    return {
+        'time_range': {'since': since, 'until': until},
+        'time_increment': 1,
+    }
+
+
+def fetch_account_spend(api, account_id, since, until):
+    """Total spend of one ad account between two YYYY-MM-DD dates."""
+    account = AdAccount(account_id, api=api)
+    insights = account.get_insights(fields=['spend'], params=_insights_params(since, until))
+    return sum(float(insight.get('spend', 0)) for insight in insights)
+
+
+def _tracked_account_spend(api, account_id, since, until):
+    # The outcome counts for the account's circuit even if the caller stopped
+    # waiting, so a hung account is only marked failed once its call gives up.
+    start = time.perf_counter()
+    try:
+        spend = fetch_account_spend(api, account_id, since, until)
+    except Exception:
+        facebook_circuit.failure(account_id)
+        _record_fetch(start, 'error', account=account_id)
+        raise
+    facebook_circuit.success(account_id)
+    _record_fetch(start, 'ok', account=account_id)
+    return spend
+
+
+def _record_fetch(start, outcome, **labels):
+    metrics.observe('facebook_fetch_seconds', time.perf_counter() - start, **labels)
+    metrics.inc('facebook_fetch_total', outcome=outcome, **labels)
+
+
+def fetch_spend(accounts, since, until, mode=None, max_workers=MAX_WORKERS, deadline=FETCH_DEADLINE):
+    """
+    Fetch spend for several ad accounts, using FACEBOOK_FETCH_MODE unless a
+    mode is given. See fetch_spend_concurrent() for the arguments and result.
+    Accounts backing off after hitting a rate limit, or whose circuit is
+    open after repeated failures, are skipped.
+    """
+    allowed = {}
+    for team, (account_id, access_token) in accounts.items():
+        wait_for = usage_model.blocked_for(account_id)
+        if wait_for:
+            print(f"Skipping spend for {team} ({account_id}): rate limited for another {wait_for:.0f}s")
+            continue
+        if not facebook_circuit.allow(account_id):
+            print(f"Skipping spend for {team} ({account_id}): circuit open after repeated failures")
+            continue
+        allowed[team] = (account_id, access_token)
+    if (mode or FETCH_MODE) == 'batch':
+        return fetch_spend_batched(allowed, since, until, max_workers=max_workers, deadline=deadline)
+    return fetch_spend_concurrent(allowed, since, until, max_workers=max_workers, deadline=deadline)
+
+
+def get_cached_spend(accounts, since, until, timeout=None):
+    """
+    Like fetch_spend(), but served from spend_cache when possible. Returns
+    ({team: spend}, {team: age of that figure in seconds}). timeout caps the
+    wait for accounts that have to be fetched now.
+    """
+    return spend_cache.get_many(accounts, since, until, fetch_spend, timeout=timeout)
+
+
+def fetch_spend_concurrent(accounts, since, until, max_workers=MAX_WORKERS, deadline=FETCH_DEADLINE):
+    """
+    Fetch spend for several ad accounts at once, one request per account.
+
+    accounts maps a team to (account_id, access_token). Returns {team: spend}
+    for every account that answered before the deadline; teams that failed or
+    timed out are left out and logged.
+    """
+    if not accounts:
+        return {}
+
+    apis = {}
+    for _, access_token in accounts.values():
+        if access_token not in apis:
+            apis[access_token] = make_api(access_token)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(accounts))))
+    futures = {
+        submit_in_context(executor, _tracked_account_spend, apis[access_token], account_id, since, until): (team, account_id)
+        for team, (account_id, access_token) in accounts.items()
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    # Don't wait for stragglers; their threads finish in the background.
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    spend_by_team = {}
+    for future in done:
+        team, account_id = futures[future]
+        try:
+            spend_by_team[team] = future.result()
+            print(f"Successfully fetched spend for {team}: {spend_by_team[team]}")
+        except Exception as e:
+            if is_throttle_error(e):
+                usage_model.record_throttled(account_id)
+            print(f"Error fetching spend for {team} ({account_id}): {e}")
+    for future in not_done:
+        team, account_id = futures[future]
+        print(f"Timed out fetching spend for {team} ({account_id}) after {deadline}s")
+    return spend_by_team
+
+
+def _execute_spend_batch(api, team_accounts, since, until):
+    """
+    Send one Graph API batch with an insights query for each (team, account_id)
+    pair. Returns ({team: spend}, {team: error message}).
+    """
+    spend_by_team = {}
+    errors = {}
+    paged = []
+
+    def on_success(team, account_id, response):
+        usage_model.record(account_id, response.headers() or {})
+        body = response.json()
+        spend_by_team[team] = sum(float(row.get('spend', 0)) for row in body.get('data', []))
+        if body.get('paging', {}).get('next'):
+            paged.append((team, account_id))
+
+    def on_failure(team, account_id, response):
+        usage_model.record(account_id, response.headers() or {})
+        error = response.error()
+        if is_throttle_error(error):
+            usage_model.record_throttled(account_id)
+        errors[team] = error.api_error_message() or str(error)
+
+    batch = api.new_batch()
+    for team, account_id in team_accounts:
+        AdAccount(account_id, api=api).get_insights(
+            fields=['spend'],
+            params=_insights_params(since, until),
+            batch=batch,
+            success=lambda response, team=team, account_id=account_id: on_success(team, account_id, response),
+            failure=lambda response, team=team, account_id=account_id: on_failure(team, account_id, response),
+        )
+
+    # execute() hands back the calls that got no answer at all; give them one more try.
+    retry = batch.execute()
+    if retry is not None:
+        retry = retry.execute()
+    if retry is not None:
+        for team, _ in team_accounts:
+            if team not in spend_by_team and team not in errors:
+                errors[team] = 'no response in batch'
+
+    # Long date ranges can span several pages; read the rest of those directly.
+    for team, account_id in paged:
+        try:
+            spend_by_team[team] = fetch_account_spend(api, account_id, since, until)
+        except Exception as e:
+            if is_throttle_error(e):
+                usage_model.record_throttled(account_id)
+            del spend_by_team[team]
+            errors[team] = str(e)
+
+    return spend_by_team, errors
+
+
+def _tracked_spend_batch(api, team_accounts, since, until):
+    # Like _tracked_account_spend(), for every account in one batch.
+    start = time.perf_counter()
+    try:
+        spend_by_team, errors = _execute_spend_batch(api, team_accounts, since, until)
+    except Exception:
+        for _, account_id in team_accounts:
+            facebook_circuit.failure(account_id)
+        _record_fetch(start, 'error', account='batch')
+        raise
+    _record_fetch(start, 'ok' if not errors else 'partial', account='batch')
+    for team, account_id in team_accounts:
+        if team in spend_by_team:
+            facebook_circuit.success(account_id)
+        else:
+            facebook_circuit.failure(account_id)
+    return spend_by_team, errors
+
+
+def fetch_spend_batched(accounts, since, until, max_workers=MAX_WORKERS, deadline=FETCH_DEADLINE, batch_limit=BATCH_LIMIT):
+    """
+    Fetch spend for several ad accounts with Graph API batch requests: one HTTP
+    call per business token (more if a token has over batch_limit accounts).
+    Takes and returns the same shapes as fetch_spend_concurrent().
+    """
+    if not accounts:
+        return {}
+
+    by_token = {}
+    for team, (account_id, access_token) in accounts.items():
+        by_token.setdefault(access_token, []).append((team, account_id))
+
+    jobs = []
+    for access_token, team_accounts in by_token.items():
+        api = make_api(access_token)
+        for start in range(0, len(team_accounts), batch_limit):
+            jobs.append((api, team_accounts[start:start + batch_limit]))
+
+    # Batches for different businesses still go out side by side.
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs))))
+    futures = {
+        submit_in_context(executor, _tracked_spend_batch, api, team_accounts, since, until): team_accounts
+        for api, team_accounts in jobs
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    spend_by_team = {}
+    for future in done:
+        try:
+            batch_spend, errors = future.result()
+        except Exception as e:
+            for team, account_id in futures[future]:
+                print(f"Error fetching spend for {team} ({account_id}): {e}")
+            continue
+        spend_by_team.update(batch_spend)
+        for team, error in errors.items():
+            print(f"Error fetching spend for {team} ({accounts[team][0]}): {error}")
+        for team, spend in batch_spend.items():
+            print(f"Successfully fetched spend for {team}: {spend}")
+    for future in not_done:
+        for team, account_id in futures[future]:
+            print(f"Timed out fetching spend for {team} ({account_id}) after {deadline}s")
+    return spend_by_team
@@ -0,0 +1,83 @@
+"""
+One FacebookAdsApi per access token, kept for the life of the process.
+
+Each API object owns a requests.Session, so its HTTPS connections to
+graph.facebook.com stay open between reports instead of paying a new TLS
+handshake for every account. The connection pool of each session is sized
+for FACEBOOK_MAX_WORKERS concurrent fetchers; requests.Session is safe to
+share between those threads.
+
+With GRAPH_API_MODE set to record or replay, the sessions go through
+GraphReplayAdapter instead (see src/graph_replay.py).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from facebook_business.api import FacebookAdsApi, FacebookSession
+from requests.adapters import HTTPAdapter
+
+from src.graph_replay import GRAPH_API_MODE, GraphReplayAdapter, graph_replay
+from src.rate_limits import usage_model
+
+# Open connections kept per token; extra concurrent calls wait for a free one.
+POOL_CONNECTIONS = int(os.environ.get('FACEBOOK_MAX_WORKERS', 8))
+# Seconds before a Graph API call gives up on connecting or reading.
+HTTP_TIMEOUT = float(os.environ.get('FACEBOOK_HTTP_TIMEOUT', 30))
+# Tokens kept at once; the least recently used one is dropped beyond this.
+MAX_TOKENS = int(os.environ.get('FACEBOOK_MAX_TOKENS', 16))
+
+
+class ApiPool:
+    """Hands out the same FacebookAdsApi for the same token, from any thread."""
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, timeout=HTTP_TIMEOUT, max_tokens=MAX_TOKENS,
+                 mode=GRAPH_API_MODE):
+        self.pool_connections = pool_connections
+        self.mode = mode
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self._apis = OrderedDict()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _build(self, access_token):
+        session = FacebookSession(access_token=access_token, timeout=self.timeout)
+        # pool_block makes extra threads wait for a connection instead of opening
+        # one-off connections that are thrown away after a single call.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_connections, pool_block=True)
+        if self.mode == 'replay':
+            adapter = GraphReplayAdapter(graph_replay)
+        elif self.mode == 'record':
+            adapter = GraphReplayAdapter(graph_replay, upstream=adapter)
+        session.requests.mount('https://', adapter)
+        # Every response updates the rate-limit usage of the account it was for.
+        session.requests.hooks['response'].append(usage_model.record_response)
+        return FacebookAdsApi(session)
+
+    def get(self, access_token):
+        """The API object for access_token, created on first use."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets inherited through fork() belong to the parent process.
+                self._apis.clear()
+                self._pid = os.getpid()
+            api = self._apis.get(access_token)
+            if api is None:
+                api = self._apis[access_token] = self._build(access_token)
+                while len(self._apis) > self.max_tokens:
+                    # Not closed here: another thread may still be using it.
+                    self._apis.popitem(last=False)
+            else:
+                self._apis.move_to_end(access_token)
+            return api
+
+    def close(self):
+        with self._lock:
+            for api in self._apis.values():
+                api._session.requests.close()
+            self._apis.clear()
+
+
+# Shared by every module that talks to the Graph API.
+api_pool = ApiPool()
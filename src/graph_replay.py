@@ -0,0 +1,330 @@
+"""
+Record/replay stand-in for the Graph API, for offline benchmarks and load tests.
+
+GRAPH_API_MODE picks what the pooled Facebook sessions talk to:
+
+    live     graph.facebook.com (the default)
+    record   graph.facebook.com, saving every answer to GRAPH_REPLAY_FILE
+    replay   GRAPH_REPLAY_FILE only, without any network access
+
+In record and replay mode GraphReplayAdapter is mounted on the sessions of
+src/facebook_sessions.py, so every fetch path (per account, batch,
+generate_report.py) goes through it unchanged. Answers are keyed by method,
+path and query without the API version and the access token, and batch
+calls are recorded and replayed per sub-request. An insights query that was
+never recorded gets a made-up but stable spend per account and day, so
+replay works without a recording at all.
+
+Replay can also make the API misbehave, per request and reproducibly for a
+given GRAPH_REPLAY_SEED: latency (GRAPH_REPLAY_LATENCY plus up to
+GRAPH_REPLAY_JITTER seconds, raising a read timeout past the session's
+timeout), server errors (GRAPH_REPLAY_ERROR_RATE), rate-limit errors
+(GRAPH_REPLAY_THROTTLE_RATE), usage headers at GRAPH_REPLAY_USAGE_PCT, and
+results split over GRAPH_REPLAY_PAGES pages.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.client import responses as HTTP_REASONS
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+GRAPH_API_MODE = os.environ.get('GRAPH_API_MODE', 'live')
+GRAPH_REPLAY_FILE = os.environ.get(
+    'GRAPH_REPLAY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph_replay.json')
+)
+GRAPH_REPLAY_SEED = os.environ.get('GRAPH_REPLAY_SEED', '1')
+GRAPH_REPLAY_LATENCY = float(os.environ.get('GRAPH_REPLAY_LATENCY', 0))
+GRAPH_REPLAY_JITTER = float(os.environ.get('GRAPH_REPLAY_JITTER', 0))
+GRAPH_REPLAY_ERROR_RATE = float(os.environ.get('GRAPH_REPLAY_ERROR_RATE', 0))
+GRAPH_REPLAY_THROTTLE_RATE = float(os.environ.get('GRAPH_REPLAY_THROTTLE_RATE', 0))
+# Usage reported in the rate-limit headers of every answer (0 sends none).
+GRAPH_REPLAY_USAGE_PCT = float(os.environ.get('GRAPH_REPLAY_USAGE_PCT', 0))
+# Minutes a throttled account is told to wait before calling again.
+GRAPH_REPLAY_REGAIN_MINUTES = float(os.environ.get('GRAPH_REPLAY_REGAIN_MINUTES', 1))
+GRAPH_REPLAY_PAGES = int(os.environ.get('GRAPH_REPLAY_PAGES', 1))
+
+# Left out of the keys: they change between machines and runs, not the answer.
+IGNORED_PARAMS = {'access_token', 'appsecret_proof'}
+# Only these headers are saved; the rest is per-response noise.
+RECORDED_HEADERS = {'x-business-use-case-usage', 'x-ad-account-usage', 'x-fb-ads-insights-throttle', 'x-app-usage'}
+
+_VERSION_RE = re.compile(r'^/v\d+\.\d+(?=/|$)')
+_INSIGHTS_RE = re.compile(r'^/(act_\d+)/insights$')
+
+
+def request_key(method, url, body=None):
+    """'GET /act_1/insights?fields=spend&...' for a full URL or a batch relative_url."""
+    parts = urlsplit(url if '://' in url else '/' + url.lstrip('/'))
+    path = _VERSION_RE.sub('', parts.path) or '/'
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    if body:
+        params += parse_qsl(body, keep_blank_values=True)
+    query = sorted((name, value) for name, value in params if name not in IGNORED_PARAMS)
+    return f"{method.upper()} {path}?{urlencode(query)}"
+
+
+def _without_cursor(key):
+    """key without its 'after' paging cursor, i.e. the key of the first page."""
+    method_path, _, query = key.partition('?')
+    params = [(name, value) for name, value in parse_qsl(query, keep_blank_values=True) if name != 'after']
+    return f"{method_path}?{urlencode(params)}"
+
+
+def _batch_items(request):
+    """The sub-requests of a Graph API batch call, or None for an ordinary request."""
+    if request.method != 'POST' or not request.body:
+        return None
+    body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+    fields = dict(parse_qsl(body, keep_blank_values=True))
+    if 'batch' not in fields:
+        return None
+    return json.loads(fields['batch'])
+
+
+def _error(code, message, error_type='OAuthException', **extra):
+    return {'error': {'message': message, 'type': error_type, 'code': code, **extra}}
+
+
+def _days(since, until):
+    day, last = date.fromisoformat(since), date.fromisoformat(until)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class GraphReplay:
+    """The recorded answers, plus the faults to inject when replaying them."""
+
+    def __init__(self, path=GRAPH_REPLAY_FILE, seed=GRAPH_REPLAY_SEED, latency=GRAPH_REPLAY_LATENCY,
+                 jitter=GRAPH_REPLAY_JITTER, error_rate=GRAPH_REPLAY_ERROR_RATE,
+                 throttle_rate=GRAPH_REPLAY_THROTTLE_RATE, usage_pct=GRAPH_REPLAY_USAGE_PCT,
+                 regain_minutes=GRAPH_REPLAY_REGAIN_MINUTES, pages=GRAPH_REPLAY_PAGES):
+        self.path = path
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.usage_pct = usage_pct
+        self.regain_minutes = regain_minutes
+        self.pages = max(1, pages)
+        self._entries = None
+        self._calls = {}
+        # Keys already reported as missing; a load test asks for them on every request.
+        self._missing = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Called with the lock held.
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+                print(f"Loaded {len(self._entries)} Graph API recordings from {self.path}")
+            except FileNotFoundError:
+                self._entries = {}
+        return self._entries
+
+    def _rng(self, key):
+        # The n-th call for a key always gets the same faults, whatever the thread order.
+        with self._lock:
+            n = self._calls[key] = self._calls.get(key, 0) + 1
+        return random.Random(f"{self.seed}|{key}|{n}")
+
+    def delay(self, key):
+        """Seconds the answer to key takes."""
+        if not (self.latency or self.jitter):
+            return 0.0
+        return self.latency + self._rng('delay ' + key).uniform(0, self.jitter)
+
+    def record(self, key, status, headers, body):
+        """Save one answer and write the file."""
+        headers = {name: value for name, value in headers.items() if name.lower() in RECORDED_HEADERS}
+        with self._lock:
+            self._load()[key] = {'status': status, 'headers': headers, 'body': body}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def answer(self, key):
+        """(status, headers, body) for one request, with the configured faults applied."""
+        rng = self._rng(key)
+        path = key.split(' ', 1)[1].split('?', 1)[0]
+        account = _INSIGHTS_RE.match(path)
+        account_id = account.group(1) if account else None
+        if rng.random() < self.error_rate:
+            return 500, self._usage_headers(account_id), _error(
+                2, 'An unexpected error has occurred. Please retry your request later.', is_transient=True)
+        if rng.random() < self.throttle_rate:
+            return 400, self._usage_headers(account_id, throttled=True), _error(
+                80004, 'There have been too many calls to this ad-account. Wait a bit and try again.',
+                error_subcode=2446079)
+
+        with self._lock:
+            entries = self._load()
+            # Pages recorded with their own cursors are replayed as they are; otherwise
+            # later pages come from the first page's answer, split by _page().
+            entry = entries.get(key) or entries.get(_without_cursor(key))
+        if entry is not None:
+            status, headers, body = entry['status'], dict(entry['headers']), entry['body']
+        elif account_id is not None:
+            status, headers, body = 200, {}, self._insights(account_id, key)
+        else:
+            with self._lock:
+                first = key not in self._missing
+                self._missing.add(key)
+            if first:
+                print(f"Graph API replay: nothing recorded for {key}")
+            return 400, {}, _error(2500, f"Unknown path components: {path}")
+        headers.update(self._usage_headers(account_id))
+        return status, headers, self._page(key, body)
+
+    def _insights(self, account_id, key):
+        # Stable made-up spend per account and day, in the shape Facebook returns it.
+        params = dict(parse_qsl(key.split('?', 1)[1]))
+        try:
+            time_range = json.loads(params.get('time_range', '{}'))
+            days = list(_days(time_range['since'], time_range['until']))
+        except (ValueError, KeyError):
+            days = [date.today().isoformat()]
+        rows = []
+        for day in days:
+            digest = hashlib.sha1(f"{account_id}|{day}".encode()).digest()
+            spend = 200 + int.from_bytes(digest[:4], 'big') % 480000 / 100
+            rows.append({'spend': f"{spend:.2f}", 'date_start': day, 'date_stop': day})
+        return {'data': rows}
+
+    def _page(self, key, body):
+        """
+        Serve one of self.pages pages of body's data, picked by the 'after'
+        cursor. There are always self.pages pages, even for a single row, so
+        the client's paging is exercised; rows fill the first pages and any
+        pages left over are empty.
+        """
+        if self.pages <= 1 or not isinstance(body, dict) or 'paging' in body or not isinstance(body.get('data'), list):
+            return body
+        params = dict(parse_qsl(key.split('?', 1)[1]))
+        try:
+            page = int(params.get('after', 0) or 0)
+        except ValueError:
+            page = 0
+        rows = body['data']
+        start = -(-page * len(rows) // self.pages)
+        end = -(-(page + 1) * len(rows) // self.pages)
+        body = dict(body, data=rows[start:end])
+        body['paging'] = {'cursors': {'before': str(page), 'after': str(page + 1)}}
+        if page + 1 < self.pages:
+            body['paging']['next'] = f"https://graph.facebook.com/replay?after={page + 1}"
+        return body
+
+    def _usage_headers(self, account_id, throttled=False):
+        if not (self.usage_pct or throttled):
+            return {}
+        pct = 100 if throttled else self.usage_pct
+        usage = {
+            'type': 'ads_insights', 'call_count': pct, 'total_cputime': pct / 2, 'total_time': pct / 2,
+            'estimated_time_to_regain_access': self.regain_minutes if throttled else 0,
+        }
+        business = {'replay': [usage]}
+        headers = {'x-app-usage': json.dumps({'call_count': pct / 4, 'total_cputime': 0, 'total_time': 0})}
+        headers['x-business-use-case-usage'] = json.dumps(business)
+        if account_id is not None:
+            headers['x-ad-account-usage'] = json.dumps({'acc_id_util_pct': pct})
+        return headers
+
+
+class GraphReplayAdapter(BaseAdapter):
+    """
+    requests transport adapter answering from a GraphReplay. With upstream
+    (the real HTTPAdapter) it records instead: requests go to Facebook and
+    the answers are saved.
+    """
+
+    def __init__(self, replay, upstream=None):
+        super().__init__()
+        self.replay = replay
+        self.upstream = upstream
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.upstream is not None:
+            response = self.upstream.send(request, stream=stream, timeout=timeout, verify=verify,
+                                          cert=cert, proxies=proxies)
+            try:
+                self._record(request, response)
+            except Exception as e:
+                print(f"Error recording Graph API response: {e}")
+            return response
+
+        items = _batch_items(request)
+        key = request_key(request.method, request.url, None if items is not None else self._form(request))
+        delay = self.replay.delay(key)
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and delay > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.exceptions.ReadTimeout(f"Graph API replay: no answer within {read_timeout}s", request=request)
+        if delay:
+            time.sleep(delay)
+
+        if items is None:
+            return self._response(request, *self.replay.answer(key))
+        answers = []
+        for item in items:
+            status, headers, body = self.replay.answer(
+                request_key(item.get('method', 'GET'), item['relative_url'], item.get('body')))
+            answers.append({
+                'code': status,
+                'headers': [{'name': name, 'value': value} for name, value in headers.items()],
+                'body': json.dumps(body),
+            })
+        return self._response(request, 200, {}, answers)
+
+    @staticmethod
+    def _form(request):
+        # Parameters of a POST other than a batch are part of what is asked.
+        if request.method == 'GET' or not request.body:
+            return None
+        return request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+
+    def _record(self, request, response):
+        items = _batch_items(request)
+        if items is None:
+            self.replay.record(request_key(request.method, request.url, self._form(request)),
+                               response.status_code, response.headers, response.json())
+            return
+        if response.status_code != 200:
+            return
+        for item, answer in zip(items, response.json()):
+            if answer:
+                headers = {header['name']: header['value'] for header in answer.get('headers') or []}
+                self.replay.record(request_key(item.get('method', 'GET'), item['relative_url'], item.get('body')),
+                                   answer['code'], headers, json.loads(answer['body']))
+
+    def _response(self, request, status, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = HTTP_REASONS.get(status, '')
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json; charset=UTF-8', **headers})
+        response._content = json.dumps(body).encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+# One set of recordings per process, shared by every pooled session.
+graph_replay = GraphReplay()
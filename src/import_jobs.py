@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.order_import import import_orders, iter_string_chunks
+from src.paste_checkpoints import PasteCheckpoint
+
+# Imports running at once in each gunicorn worker.
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+# Finished jobs older than this are deleted when new ones are submitted.
+IMPORT_JOB_RETENTION = float(os.environ.get('IMPORT_JOB_RETENTION', 24 * 3600))
+# A queued or running job not updated for this long lost its worker (restart,
+# crash) and is marked failed. Running jobs update after every batch.
+IMPORT_JOB_STALE_SECONDS = float(os.environ.get('IMPORT_JOB_STALE_SECONDS', 600))
+
+STALE_JOB_ERROR = 'توقفت عملية الحفظ قبل أن تكتمل، برجاء إعادة المحاولة.'
+
+
+class ImportJobs:
+    """
+    Runs order imports on a local thread pool and records their progress in
+    the import_jobs table (migration 4), so any worker can answer status polls.
+    on_done(team), if given, is called after a job stored its orders.
+
+    Jobs whose worker died stay queued or running in the table; they are
+    marked failed once they haven't been updated for IMPORT_JOB_STALE_SECONDS,
+    and pruned with the other finished jobs.
+    """
+
+    def __init__(self, db, max_workers=IMPORT_WORKERS, on_done=None):
+        self.db = db
+        self.max_workers = max_workers
+        self.on_done = on_done
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Threads don't survive fork(), so each gunicorn worker starts its own pool.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='import')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, team, text):
+        """Queue text for import and return the new job's id straight away."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self.db.connection()
+        self._expire_stale(conn, now)
+        with conn:
+            conn.execute(
+                "DELETE FROM import_jobs WHERE created_at < ? AND status IN ('done', 'failed')",
+                (now - IMPORT_JOB_RETENTION,),
+            )
+            conn.execute(
+                "INSERT INTO import_jobs (id, team, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, team, now, now),
+            )
+        self._get_executor().submit(self._run, job_id, team, text)
+        return job_id
+
+    def _expire_stale(self, conn, now, job_id=None):
+        sql = ("UPDATE import_jobs SET status = 'failed', error = ?, updated_at = ? "
+               "WHERE status IN ('queued', 'running') AND updated_at < ?")
+        params = [STALE_JOB_ERROR, now, now - IMPORT_JOB_STALE_SECONDS]
+        if job_id is not None:
+            sql += ' AND id = ?'
+            params.append(job_id)
+        with conn:
+            conn.execute(sql, params)
+
+    def _update(self, job_id, status, summary=None, error=None):
+        summary = summary or {}
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                'UPDATE import_jobs SET status = ?, blocks_parsed = ?, orders_saved = ?, total_sales = ?, '
+                'duplicates_skipped = ?, rejected_count = ?, rejected = ?, error = ?, updated_at = ? WHERE id = ?',
+                (
+                    status,
+                    summary.get('blocks', 0),
+                    summary.get('order_count', 0),
+                    summary.get('total_sales', 0),
+                    summary.get('duplicates_skipped', 0),
+                    summary.get('rejected_count', 0),
+                    json.dumps(summary.get('rejected', []), ensure_ascii=False),
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def _run(self, job_id, team, text):
+        summary = None
+        try:
+            self._update(job_id, 'running')
+
+            def progress(current):
+                nonlocal summary
+                summary = current
+                self._update(job_id, 'running', current)
+
+            conn = self.db.connection()
+            # Only the messages added since the team's last paste of this chat are parsed.
+            checkpoint = PasteCheckpoint(conn, team, text)
+            summary = import_orders(conn, team, iter_string_chunks(checkpoint.tail), progress=progress,
+                                    known=checkpoint.previous)
+            checkpoint.save()
+            self._update(job_id, 'done', summary)
+            if self.on_done is not None and (summary['order_count'] or checkpoint.superseded):
+                self.on_done(team)
+        except Exception as e:
+            print(f"Import job {job_id} failed: {e}")
+            self._update(job_id, 'failed', summary, error=str(e))
+
+    def get(self, job_id):
+        """Return the job's status as a dict, or None for an unknown id."""
+        conn = self.db.connection()
+        self._expire_stale(conn, time.time(), job_id)
+        row = conn.execute(
+            'SELECT id, team, status, blocks_parsed, orders_saved, total_sales, duplicates_skipped, rejected_count, '
+            'rejected, error, created_at, updated_at FROM import_jobs WHERE id = ?',
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'team': row[1],
+            'status': row[2],
+            'blocks_parsed': row[3],
+            'orders_saved': row[4],
+            'total_sales': row[5],
+            'duplicates_skipped': row[6],
+            'rejected_count': row[7],
+            'rejected': json.loads(row[8]) if row[8] else [],
+            'error': row[9],
+            'created_at': row[10],
+            'updated_at': row[11],
+        }
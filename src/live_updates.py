@@ -0,0 +1,150 @@
+"""
+Live per-team dashboard updates, pushed to the report page over SSE or long-poll.
+
+Whoever changes a team's numbers (a save, an import job, a spend refresh)
+publishes only the changed fields once. The event is appended to
+dashboard_events and merged into dashboard_state (migration 7), so every
+gunicorn worker sees it. In each worker a single poller thread reads new
+events and wakes all of that worker's viewers; viewers never query the
+database themselves except to catch up after reconnecting.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from src.order_store import report_day
+
+# How often each worker's poller looks for new events.
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 0.5))
+# Events are kept this long for viewers that reconnect with Last-Event-ID.
+LIVE_EVENT_RETENTION = float(os.environ.get('LIVE_EVENT_RETENTION', 3600))
+# Recent events kept in memory per worker.
+LIVE_BUFFER_SIZE = 1000
+
+
+class LiveUpdates:
+    def __init__(self, db, poll_interval=LIVE_POLL_INTERVAL):
+        self.db = db
+        self.poll_interval = poll_interval
+        self._events = deque(maxlen=LIVE_BUFFER_SIZE)
+        self._last_id = None
+        self._condition = threading.Condition()
+        self._poller_pid = None
+
+    def publish(self, team, fields, day=None):
+        """Record that team's fields changed; every viewer on every worker gets them."""
+        day = day or report_day()
+        conn = self.db.connection()
+        payload = json.dumps(fields, ensure_ascii=False)
+        with conn:
+            # json_patch merges in one statement, so concurrent publishes can't lose fields.
+            conn.execute(
+                'INSERT INTO dashboard_state (day, team, payload) VALUES (?, ?, ?) '
+                'ON CONFLICT (day, team) DO UPDATE SET payload = json_patch(payload, excluded.payload)',
+                (day, team, payload),
+            )
+            self._append(conn, day, team, payload)
+
+    def reset(self, day=None):
+        """Forget the day's state (after the orders were cleared) and tell viewers to start over."""
+        day = day or report_day()
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM dashboard_state WHERE day = ?', (day,))
+            self._append(conn, day, '*', json.dumps({'reset': True}))
+
+    @staticmethod
+    def _append(conn, day, team, payload):
+        now = time.time()
+        conn.execute(
+            'INSERT INTO dashboard_events (day, team, payload, created_at) VALUES (?, ?, ?, ?)',
+            (day, team, payload, now),
+        )
+        conn.execute('DELETE FROM dashboard_events WHERE created_at < ?', (now - LIVE_EVENT_RETENTION,))
+
+    def snapshot(self, day=None):
+        """{team: fields} for the day, plus the id of the last event it includes."""
+        conn = self.db.connection()
+        # Read the id first: events published in between are sent again, never missed.
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM dashboard_events').fetchone()[0]
+        rows = conn.execute(
+            'SELECT team, payload FROM dashboard_state WHERE day = ?', (day or report_day(),)
+        ).fetchall()
+        return {team: json.loads(payload) for team, payload in rows}, last_id
+
+    def _read(self, after_id, limit=LIVE_BUFFER_SIZE):
+        rows = self.db.connection().execute(
+            'SELECT id, day, team, payload FROM dashboard_events WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit),
+        ).fetchall()
+        return [
+            {'id': event_id, 'day': day, 'team': team, 'fields': json.loads(payload)}
+            for event_id, day, team, payload in rows
+        ]
+
+    def _ensure_poller(self):
+        # Threads don't survive fork(), so each gunicorn worker starts its own poller.
+        with self._condition:
+            if self._poller_pid == os.getpid():
+                return
+            self._poller_pid = os.getpid()
+            self._events.clear()
+            self._last_id = None
+        threading.Thread(target=self._poll, daemon=True, name='live-updates').start()
+
+    def _poll(self):
+        while True:
+            try:
+                if self._last_id is None:
+                    self._last_id = self.db.connection().execute(
+                        'SELECT COALESCE(MAX(id), 0) FROM dashboard_events'
+                    ).fetchone()[0]
+                events = self._read(self._last_id)
+                if events:
+                    with self._condition:
+                        self._events.extend(events)
+                        self._last_id = events[-1]['id']
+                        self._condition.notify_all()
+            except Exception as e:
+                print(f"Error polling dashboard events: {e}")
+            time.sleep(self.poll_interval)
+
+    def wait(self, after_id, timeout):
+        """
+        Events with an id above after_id, waiting up to timeout seconds for the
+        first one. Returns [] on timeout.
+        """
+        self._ensure_poller()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._last_id is not None and after_id < self._last_id:
+                    if self._events and self._events[0]['id'] <= after_id + 1:
+                        return [event for event in self._events if event['id'] > after_id]
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+        # The viewer is further behind than the buffer reaches.
+        return self._read(after_id)
+
+    def stream(self, after_id, duration, heartbeat=15):
+        """
+        Server-sent events for one viewer: every event after after_id for up to
+        duration seconds, with a comment line every heartbeat seconds so proxies
+        keep the connection open. The browser reconnects with Last-Event-ID.
+        """
+        yield 'retry: 3000\n\n'
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            events = self.wait(after_id, min(heartbeat, max(0.0, end - time.monotonic())))
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                after_id = event['id']
+                data = json.dumps({'day': event['day'], 'team': event['team'], 'fields': event['fields']}, ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: team\ndata: {data}\n\n"
@@ -0,0 +1,161 @@
+"""
+Bounded queue for LLM order parsing, so a slow model can't hold request workers.
+
+Batches of unclear blocks run on a small per-process thread pool
+(ORDER_LLM_CONCURRENCY at once, at most ORDER_LLM_QUEUE_SIZE queued or
+running). Each call has its own timeout (ORDER_LLM_CALL_TIMEOUT), and a
+request waits at most ORDER_LLM_DEADLINE seconds for all of its batches.
+Blocks still waiting after that keep their regex result in the response;
+when their answers arrive they go into the parser's cache and into the
+request's result record. Records live in the llm_results table (migration
+13), so GET /process_orders/<parse_id> finds them on any worker.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src.metrics import submit_in_context
+from src.order_llm import split_blocks, summarize
+
+LLM_CONCURRENCY = int(os.environ.get('ORDER_LLM_CONCURRENCY', 4))
+LLM_QUEUE_SIZE = int(os.environ.get('ORDER_LLM_QUEUE_SIZE', 32))
+LLM_CALL_TIMEOUT = float(os.environ.get('ORDER_LLM_CALL_TIMEOUT', 20))
+LLM_DEADLINE = float(os.environ.get('ORDER_LLM_DEADLINE', 3))
+# Result records of requests that finished before their LLM answers did.
+LLM_RESULT_RETENTION = float(os.environ.get('ORDER_LLM_RESULT_RETENTION', 600))
+
+
+class LLMQueue:
+    """
+    Runs an LLMOrderParser's completions with bounded concurrency and a
+    deadline, recording late results in db (a ConnectionManager).
+    """
+
+    def __init__(self, parser, db, concurrency=LLM_CONCURRENCY, queue_size=LLM_QUEUE_SIZE,
+                 call_timeout=LLM_CALL_TIMEOUT, deadline=LLM_DEADLINE):
+        self.parser = parser
+        self.db = db
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.call_timeout = call_timeout
+        self.deadline = deadline
+        self._executor = None
+        self._executor_pid = None
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._record_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Threads don't survive fork(), so each gunicorn worker starts its own pool.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='llm')
+                self._executor_pid = os.getpid()
+                self._queued = 0
+            return self._executor
+
+    def _release(self, future):
+        with self._lock:
+            self._queued -= 1
+
+    def _submit(self, batch):
+        """Queue one batch, or return None when the queue is full."""
+        executor = self._get_executor()
+        with self._lock:
+            if self._queued >= self.queue_size:
+                return None
+            self._queued += 1
+        future = submit_in_context(executor, self.parser.complete_batch, batch, self.call_timeout)
+        future.add_done_callback(self._release)
+        return future
+
+    def _apply(self, future, batch):
+        try:
+            self.parser.apply_answers(batch, future.result())
+        except Exception as e:
+            # The regex results stand for this batch.
+            print(f"Error parsing with ChatGPT: {e}")
+
+    def parse(self, text, deadline=None):
+        """
+        Like LLMOrderParser.parse(), but returns within the deadline. The
+        result also has pending_blocks, the blocks answered by regex only
+        because the model was late or the queue full, and parse_id, set when
+        late answers will still be recorded.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        blocks = split_blocks(text or '')
+        futures = {}
+        skipped = 0
+        for batch in self.parser.batches(self.parser.uncertain_blocks(blocks)):
+            future = self._submit(batch) if not skipped else None
+            if future is None:
+                skipped += len(batch)
+                continue
+            futures[future] = batch
+        if skipped:
+            print(f"LLM queue full, using the regex result for {skipped} blocks")
+
+        done, not_done = wait(futures, timeout=deadline)
+        for future in done:
+            self._apply(future, futures[future])
+
+        result = summarize(blocks)
+        result['pending_blocks'] = skipped + sum(len(futures[future]) for future in not_done)
+        result['parse_id'] = None
+        if not_done:
+            parse_id = uuid.uuid4().hex
+            result['parse_id'] = parse_id
+            self._store(parse_id, result, skipped, result['pending_blocks'] - skipped)
+            for future in not_done:
+                future.add_done_callback(
+                    lambda future, batch=futures[future]: self._finish_late(parse_id, blocks, future, batch)
+                )
+        return result
+
+    def _store(self, parse_id, summary, skipped, late):
+        # skipped blocks were never queued and keep their regex answer; late
+        # ones drop off as their batches are answered.
+        now = time.time()
+        summary = {key: summary[key] for key in ('total_amount', 'order_count', 'blocks', 'llm_blocks', 'cached_blocks')}
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM llm_results WHERE updated_at < ?', (now - LLM_RESULT_RETENTION,))
+            conn.execute(
+                'INSERT INTO llm_results (id, summary, skipped, late, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (parse_id, json.dumps(summary), skipped, late, now),
+            )
+
+    def _finish_late(self, parse_id, blocks, future, batch):
+        self._apply(future, batch)
+        try:
+            conn = self.db.connection()
+            # Batches of one parse can finish together; the lock keeps an
+            # older summary from overwriting a newer one.
+            with self._record_lock, conn:
+                conn.execute(
+                    'UPDATE llm_results SET summary = ?, late = late - ?, updated_at = ? WHERE id = ?',
+                    (json.dumps(summarize(blocks)), len(batch), time.time(), parse_id),
+                )
+        except Exception as e:
+            print(f"Error recording late LLM answers for {parse_id}: {e}")
+
+    def get(self, parse_id):
+        """
+        The current result of an earlier parse() that returned parse_id, or
+        None. pending_blocks counts the same way as in parse(); final is True
+        once no late answer is still expected.
+        """
+        row = self.db.connection().execute(
+            'SELECT summary, skipped, late, updated_at FROM llm_results WHERE id = ?', (parse_id,)
+        ).fetchone()
+        if row is None or time.time() - row[3] > LLM_RESULT_RETENTION:
+            return None
+        result = json.loads(row[0])
+        result['pending_blocks'] = row[1] + row[2]
+        result['final'] = row[2] == 0
+        result['parse_id'] = parse_id
+        return result
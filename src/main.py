@@ -1,18 +1,35 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import json
+import hmac
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
 from datetime import datetime
 import pytz
 import sqlite3
-import re
 import requests
-from facebook_business.api import FacebookAdsApi
-from facebook_business.adobjects.adaccount import AdAccount
+import threading
+import time
 
 # Get the absolute path of the directory containing this script
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 from whitenoise import WhiteNoise
 
+from src.config import get_config
+from src.db import ConnectionManager
+from src.import_jobs import ImportJobs
+from src.live_updates import LiveUpdates
+from src.metrics import metrics
+from src.profiling import ProfilingMiddleware, profile_text
+from src.order_import import import_orders, iter_text_chunks
+from src.order_parser import parse_orders
+from src.circuit_breaker import Budget
+from src.facebook_ads import FETCH_DEADLINE, get_cached_spend, spend_cache
+from src.shared_cache import SharedCache
+from src.spend_cache import SPEND_CACHE_TTL
+from src.single_flight import SingleFlight
+from src.paste_checkpoints import PasteCheckpoint
+from src.order_store import TEAMS, canonical_team, clear_orders, daily_team_totals, insert_orders, report_day
+
 app = Flask(__name__,
             static_folder=os.path.join(basedir, 'static'),
             template_folder=os.path.join(basedir, 'templates'))
@@ -22,27 +39,68 @@ app.wsgi_app.add_files(os.path.join(basedir, 'templates'), prefix='templates/')
 
 def get_db_path():
     """الحصول على المسار المطلق لقاعدة البيانات في مجلد tmp"""
-    return os.path.join(basedir, 'orders.db') # Changed to be in the same directory as the app
+    # ORDERS_DB_PATH بيستخدم في الاختبارات عشان ما تلمسش قاعدة بيانات التطبيق
+    return os.environ.get('ORDERS_DB_PATH') or os.path.join(basedir, 'orders.db') # Changed to be in the same directory as the app
+
+db = ConnectionManager(get_db_path())
 
 def init_db():
-    conn = sqlite3.connect(get_db_path())
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            team TEXT NOT NULL,
-            order_count INTEGER NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """
-    )
-    conn.commit()
-    conn.close()
+    """تجهيز قاعدة البيانات وتطبيق التحديثات مرة واحدة عند بدء العامل"""
+    db.migrate()
 
 def get_db_connection():
-    """الحصول على اتصال بقاعدة البيانات مع التأكد من وجود الجداول"""
-    init_db()
-    return sqlite3.connect(get_db_path())
+    """الحصول على اتصال قاعدة البيانات الخاص بهذا الـ thread"""
+    return db.connection()
+
+init_db()
+# كل عامل بيكتب أرقامه في قاعدة البيانات كل شوية، و /metrics بيجمعها
+metrics.attach(db)
+
+# بروفايل للطلبات البطيئة ولعينة من الطلبات، بينزل من /admin/profiles
+profiler = ProfilingMiddleware(app.wsgi_app, db, url_map=app.url_map)
+app.wsgi_app = profiler
+# مفتاح صفحات الإدارة؛ لو مش متحدد الصفحات دي مقفولة
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# كاش مشترك في نفس ملف قاعدة البيانات بين كل عمال gunicorn: أرقام الصرف وآخر تقرير ناجح
+shared_cache = SharedCache(db)
+spend_cache.shared = shared_cache
+report_flight = SingleFlight(shared=shared_cache)
+
+# تحديثات مباشرة للوحة التقرير: كل تغيير بيتحسب مرة واحدة ويتبعت لكل المشاهدين
+live_updates = LiveUpdates(db)
+# أقصى مدة لاتصال SSE واحد؛ المتصفح بيعيد الاتصال لوحده ويكمل من Last-Event-ID
+LIVE_STREAM_DURATION = float(os.environ.get('LIVE_STREAM_DURATION', 300))
+# كل اتصال SSE بيمسك thread من الـ 16 بتوع الـ worker (Procfile) طول مدته، فأقصى عدد
+# اتصالات مفتوحة في كل worker 4؛ اللي بعدهم بياخدوا event "fallback" ويشتغلوا long-poll
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 4))
+live_stream_slots = threading.BoundedSemaphore(LIVE_MAX_STREAMS)
+# الـ long-poll كمان بيمسك thread طول انتظاره: أقصى LIVE_MAX_POLLS طلب مستني في كل worker،
+# واللي بعدهم بياخدوا 503 مع Retry-After. وأطول انتظار لطلب واحد LIVE_POLL_MAX_WAIT ثانية
+LIVE_MAX_POLLS = int(os.environ.get('LIVE_MAX_POLLS', 6))
+LIVE_POLL_MAX_WAIT = float(os.environ.get('LIVE_POLL_MAX_WAIT', 20))
+LIVE_POLL_RETRY_AFTER = 5
+live_poll_slots = threading.BoundedSemaphore(LIVE_MAX_POLLS)
+
+def publish_team_totals(team):
+    """نشر عدد أوردرات ومبيعات اليوم لفريق واحد بعد أي حفظ"""
+    try:
+        team = canonical_team(team)
+        totals = daily_team_totals(get_db_connection()).get(team, {})
+        live_updates.publish(team, {'orders': totals.get('orders', 0), 'sales': totals.get('sales', 0)})
+    except Exception as e:
+        print(f"Error publishing totals for {team}: {e}")
+
+def publish_spend(accounts, spend_by_team):
+    """نشر الصرف الجديد بعد أي تحديث من Facebook (حتى لو في الخلفية)"""
+    for team, spend in spend_by_team.items():
+        try:
+            live_updates.publish(canonical_team(team), {'spend': spend, 'spend_stale': False})
+        except Exception as e:
+            print(f"Error publishing spend for {team}: {e}")
+
+spend_cache.on_update = publish_spend
+import_jobs = ImportJobs(db, on_done=publish_team_totals)
 
 @app.route('/')
 def index():
@@ -58,73 +116,258 @@ def save_orders():
         if not team or not orders_text.strip():
             return jsonify({'error': 'الرجاء اختيار الفريق وإدخال نصوص الأوردرات.'}), 400
 
-        parsed_orders = parse_orders(orders_text)
-        
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Aggregate orders by team from parsed_orders
-        team_order_counts = {}
-        for order in parsed_orders:
-            # Assuming the team is passed from the frontend and is consistent for the batch
-            # If individual orders can have different teams, this logic needs adjustment
-            team_order_counts[team] = team_order_counts.get(team, 0) + 1
-
-        for team_name, count in team_order_counts.items():
-            if count > 0:
-                cursor.execute('INSERT INTO orders (team, order_count) VALUES (?, ?)', (team_name, count))
+        # لو الشات ده اتلصق قبل كده، بنقرا بس الرسايل الجديدة اللي في آخره
+        checkpoint = PasteCheckpoint(conn, team, orders_text)
+        parsed_orders = parse_orders(checkpoint.tail)
         
-        conn.commit()
-        conn.close()
+        # الأوردرات اللي اتحفظت من الرسايل دي في لصق قبل كده مش بتتحفظ تاني، واللي اتعدلت بتحل محل القديمة
+        stored = insert_orders(conn, team, parsed_orders, known=checkpoint.previous)
+        checkpoint.save()
+        saved = len(stored)
+        if saved or checkpoint.superseded:
+            publish_team_totals(team)
+        total_sales = sum(order.price for order in stored)
+        # الأوردرات اللي اتحفظت قبل كده النهارده (لصق متكرر) بتتشال ومش بتتحسب تاني
+        duplicates_skipped = len(parsed_orders) - saved
         
-        return jsonify({'message': f'تم حفظ {len(parsed_orders)} أوردرات بنجاح!', 'orders_saved': len(parsed_orders)}), 200
+        return jsonify({
+            'message': f'تم حفظ {saved} أوردرات بنجاح!',
+            'orders_saved': saved,
+            'duplicates_skipped': duplicates_skipped,
+            'messages_skipped': checkpoint.skipped_messages,
+            'orders_replaced': checkpoint.superseded,
+            'details': {'order_count': saved, 'total_sales': total_sales, 'duplicates_skipped': duplicates_skipped}
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/upload_orders', methods=['POST'])
+def upload_orders():
+    """
+    رفع ملف شات واتساب كامل (multipart أو body خام) وقراءته على أجزاء بدل تحميله كله في الذاكرة.
+
+    multipart: كل ملف اسم الحقل بتاعه هو الفريق، أو حقل "file" مع حقل "team".
+    body خام: الفريق في ?team=
+    """
+    try:
+        uploads = []
+        if request.mimetype == 'multipart/form-data':
+            for field, upload in request.files.items(multi=True):
+                team = request.form.get('team', '') if field == 'file' else field
+                uploads.append((team, upload.stream))
+        else:
+            uploads.append((request.args.get('team', ''), request.stream))
+
+        if not uploads:
+            return jsonify({'error': 'الرجاء رفع ملف الأوردرات.'}), 400
+        for team, _ in uploads:
+            if canonical_team(team) not in TEAMS:
+                return jsonify({'error': f'فريق غير معروف: {team}'}), 400
+
+        conn = get_db_connection()
+        teams = {}
+        rejected = []
+        for team, stream in uploads:
+            summary = import_orders(conn, team, iter_text_chunks(stream))
+            totals = teams.setdefault(canonical_team(team), {'blocks': 0, 'order_count': 0, 'total_sales': 0.0, 'duplicates_skipped': 0, 'rejected_count': 0})
+            for key in totals:
+                totals[key] += summary[key]
+            rejected.extend(dict(block, team=canonical_team(team)) for block in summary['rejected'])
+
+        saved = sum(totals['order_count'] for totals in teams.values())
+        for team, totals in teams.items():
+            if totals['order_count']:
+                publish_team_totals(team)
+        return jsonify({
+            'message': f'تم حفظ {saved} أوردرات بنجاح!',
+            'orders_saved': saved,
+            'teams': teams,
+            'rejected': rejected
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/import_jobs', methods=['POST'])
+def create_import_job():
+    """استلام الأوردرات وحفظها في الخلفية، والرد فورًا برقم المهمة"""
+    try:
+        data = request.get_json()
+        team = data.get('team', '')
+        orders_text = data.get('orders', '')
+
+        if not team or not orders_text.strip():
+            return jsonify({'error': 'الرجاء اختيار الفريق وإدخال نصوص الأوردرات.'}), 400
+        if canonical_team(team) not in TEAMS:
+            return jsonify({'error': f'فريق غير معروف: {team}'}), 400
+
+        job_id = import_jobs.submit(team, orders_text)
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+    except Exception as e:
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/import_jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """حالة مهمة الحفظ: عدد البلوكات اللي اتقرت والأوردرات اللي اتحفظت والأخطاء"""
+    try:
+        job = import_jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'المهمة غير موجودة.'}), 404
+        return jsonify(job), 200
     except Exception as e:
         return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
 
 @app.route('/api/clear_data', methods=['POST'])
 def clear_data():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM orders')
-        conn.commit()
-        conn.close()
+        clear_orders(get_db_connection())
+        # آخر تقرير محفوظ مبقاش صالح بعد مسح الأوردرات
+        shared_cache.delete(f"report:{report_day()}")
+        live_updates.reset()
         return jsonify({'message': 'تم مسح جميع البيانات بنجاح!'}), 200
     except Exception as e:
         return jsonify({'error': f'حدث خطأ أثناء مسح البيانات: {str(e)}'}), 500
 
-def load_facebook_access_token():
-    """قراءة مفتاح الوصول لـ Facebook من الملف"""
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """أرقام المراحل (parse, DB, Facebook, الكاش, LLM) لكل العمال مجمعة بصيغة Prometheus"""
+    try:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return Response(f"# error: {e}\n", status=500, mimetype='text/plain')
+
+def admin_allowed():
+    """التأكد إن الطلب معاه ADMIN_TOKEN (في X-Admin-Token أو ?token=)"""
+    token = request.headers.get('X-Admin-Token') or request.args.get('token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """آخر بروفايلات الطلبات (البطيئة والعينة) مع المسار وحجم البيانات وتوقيت كل مرحلة"""
+    if not admin_allowed():
+        return jsonify({'error': 'غير مسموح'}), 403
     try:
-        token_file_path = os.path.join(basedir, 'facebook_access_token.txt')
-        with open(token_file_path, 'r') as f:
-            return f.read().strip()
+        return jsonify({'profiles': profiler.recent()}), 200
     except Exception as e:
-        print(f"Error loading Facebook access token: {e}")
-        return None
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
 
-def load_ad_account_ids():
-    """قراءة معرفات الحسابات الإعلانية من الملف"""
+@app.route('/admin/profiles/<int:profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    تنزيل بروفايل واحد: cProfile كملف .prof (أو نص pstats مع ?format=text)،
+    وعينات الـ stack كملف folded لأدوات الـ flame graph
+    """
+    if not admin_allowed():
+        return jsonify({'error': 'غير مسموح'}), 403
     try:
-        ids_file_path = os.path.join(basedir, 'ad_account_ids.txt')
-        ad_accounts = {}
-        with open(ids_file_path, 'r') as f:
-            for line in f:
-                if ':' in line:
-                    team, account_id = line.strip().split(': ')
-                    ad_accounts[team] = account_id
-        return ad_accounts
+        stored = profiler.load(profile_id)
+        if stored is None:
+            return jsonify({'error': 'البروفايل ده مش موجود أو اتمسح'}), 404
+        kind, data = stored
+        if kind == 'cprofile' and request.args.get('format') == 'text':
+            return Response(profile_text(data), mimetype='text/plain')
+        if kind == 'cprofile':
+            return Response(data, mimetype='application/octet-stream', headers={
+                'Content-Disposition': f'attachment; filename=profile-{profile_id}.prof'})
+        return Response(data, mimetype='text/plain', headers={
+            'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'})
     except Exception as e:
-        print(f"Error loading ad account IDs: {e}")
-        return {
-            "A": "act_876940394061784",
-            "B": "act_1063536228108993", 
-            "C": "act_1256754798336209",
-            "C1": "act_652648836844418"
-        }
-
-def get_facebook_ads_data():
-    """سحب بيانات الصرف الحقيقية من Facebook Ads API"""
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/live/snapshot', methods=['GET'])
+def live_snapshot():
+    """أرقام كل الفرق الحالية، ورقم آخر تحديث متضمن فيها"""
+    try:
+        teams, last_id = live_updates.snapshot()
+        return jsonify({'teams': teams, 'last_id': last_id}), 200
+    except Exception as e:
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/live/stream', methods=['GET'])
+def live_stream():
+    """
+    Server-sent events: أول رسالة snapshot بأرقام كل الفرق، وبعدها تحديث صغير لكل فريق يتغير.
+    لو المتصفح بيعيد الاتصال بيبعت Last-Event-ID وبيكمل من عنده من غير snapshot.
+    لو الـ worker فيه LIVE_MAX_STREAMS اتصال مفتوح، بيرجع event "fallback" بس والمتصفح يستخدم /api/live/updates.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    after_id = None
+    if last_event_id is not None:
+        try:
+            after_id = int(last_event_id)
+        except ValueError:
+            after_id = -1
+        if after_id < 0:
+            return jsonify({'error': 'Last-Event-ID أو after لازم يكون رقم صحيح'}), 400
+
+    def events():
+        nonlocal after_id
+        if not live_stream_slots.acquire(blocking=False):
+            yield "event: fallback\ndata: {}\n\n"
+            return
+        try:
+            if after_id is None:
+                teams, after_id = live_updates.snapshot()
+                yield f"id: {after_id}\nevent: snapshot\ndata: {json.dumps({'teams': teams}, ensure_ascii=False)}\n\n"
+            yield from live_updates.stream(after_id, LIVE_STREAM_DURATION)
+        finally:
+            live_stream_slots.release()
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/live/updates', methods=['GET'])
+def live_poll():
+    """Long-poll للمتصفحات اللي مش بتدعم SSE: بيستنى لحد أول تحديث بعد after أو timeout"""
+    try:
+        after_id = int(request.args.get('after', 0))
+        timeout = float(request.args.get('timeout', LIVE_POLL_MAX_WAIT))
+    except ValueError:
+        after_id = timeout = -1
+    # float() بيقبل nan و inf، والمقارنة دي بترفضهم
+    if after_id < 0 or not 0 <= timeout < float('inf'):
+        return jsonify({'error': 'after و timeout لازم يكونوا أرقام موجبة'}), 400
+    timeout = min(timeout, LIVE_POLL_MAX_WAIT)
+
+    if not live_poll_slots.acquire(blocking=False):
+        response = jsonify({'error': 'السيرفر مشغول، حاول تاني بعد شوية'})
+        response.headers['Retry-After'] = str(LIVE_POLL_RETRY_AFTER)
+        return response, 503
+    try:
+        events = live_updates.wait(after_id, timeout)
+        return jsonify({
+            'events': events,
+            'last_id': events[-1]['id'] if events else after_id
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        live_poll_slots.release()
+
+# التوكن ومعرفات الحسابات بتتقري أول مرة بس، وبتتقري تاني لو الملف اتعدل (src/config.py)
+config = get_config(basedir)
+
+# أقصى وقت لحساب التقرير كله؛ الحسابات اللي ما ترد فيه بتظهر "غير متاح"
+REPORT_BUDGET = float(os.environ.get('REPORT_BUDGET', 10))
+UNAVAILABLE = "غير متاح"
+
+# بتستخدم لو ملف ad_account_ids.txt مش موجود
+DEFAULT_AD_ACCOUNT_IDS = {
+    "A": "act_876940394061784",
+    "B": "act_1063536228108993",
+    "C": "act_1256754798336209",
+    "C1": "act_652648836844418"
+}
+
+def get_facebook_ads_data(budget=None):
+    """
+    سحب بيانات الصرف الحقيقية من Facebook Ads API في حدود الوقت المتاح (budget).
+    الفرق اللي صرفها ما وصلش في الوقت (أو الحساب واقف بسبب الـ circuit breaker)
+    بيبقى صرفها None وبتظهر في التقرير "غير متاح" بدل صفر.
+    """
     data = {
         "A": {"spend": 0, "orders": 0, "held": 0, "sales": 0, "roas": 0},
         "B": {"spend": 0, "orders": 0, "held": 0, "sales": 0, "roas": 0},
@@ -133,125 +376,93 @@ def get_facebook_ads_data():
         "Follow-up": {"spend": 0, "orders": 0, "held": 0, "sales": 0, "roas": 0}
     }
 
-    # تحميل مفتاح الوصول ومعرفات الحسابات
-    access_token = load_facebook_access_token()
-    ad_account_ids = load_ad_account_ids()
+    # مفتاح الوصول ومعرفات الحسابات من الكاش، من غير قراءة ملفات
+    access_token = config.access_token.get()
+    ad_account_ids = config.account_ids() or DEFAULT_AD_ACCOUNT_IDS
     
     if not access_token:
         print("No Facebook access token found, using dummy data")
         return data
 
-    # تهيئة Facebook Ads API
-    try:
-        FacebookAdsApi.init(access_token=access_token)
-    except Exception as e:
-        print(f"Error initializing Facebook Ads API: {e}")
-        return data
-
-    # سحب بيانات الصرف لكل فريق
-    for team, ad_account_id in ad_account_ids.items():
-        if team in data:  # التأكد من أن الفريق موجود في البيانات
-            try:
-                account = AdAccount(ad_account_id)
-                # سحب بيانات اليوم الحالي
-                today = datetime.now().strftime("%Y-%m-%d")
-                insights = account.get_insights(
-                    fields=["spend"],
-                    params={
-                        "time_range": {"since": today, "until": today}
-                    }
-                )
-                
-                if insights and len(insights) > 0:
-                    spend_value = insights[0].get("spend", "0")
-                    data[team]["spend"] = float(spend_value)
-                    print(f"Successfully fetched spend for {team}: {spend_value}")
-                else:
-                    print(f"No insights data found for {team} ({ad_account_id})")
-                    
-            except Exception as e:
-                print(f"Error fetching data for {team} ({ad_account_id}): {e}")
-                # في حالة الخطأ، نحتفظ بالقيمة الافتراضية 0
+    # سحب بيانات الصرف لكل الفرق في نفس الوقت بدل واحد ورا التاني
+    today = report_day()
+    accounts = {
+        team: (ad_account_id, access_token)
+        for team, ad_account_id in ad_account_ids.items()
+        if team in data  # التأكد من أن الفريق موجود في البيانات
+    }
+    # الصرف بيتجاب من الكاش لو عمره أقل من SPEND_CACHE_TTL، والقديم بيتحدث في الخلفية
+    timeout = budget.timeout(FETCH_DEADLINE) if budget is not None else None
+    spend_by_team, ages = get_cached_spend(accounts, today, today, timeout=timeout)
+    for team, spend in spend_by_team.items():
+        data[team]["spend"] = spend
+        data[team]["spend_age"] = ages[team]
+        # رقم قديم: الحساب قرب من حد الـ API أو التحديث فشل، فبنعرض آخر قيمة معروفة
+        data[team]["spend_stale"] = ages[team] > SPEND_CACHE_TTL
+    # الفرق اللي فشل سحبها: غير متاح، مش صفر
+    for team in accounts.keys() - spend_by_team.keys():
+        data[team]["spend"] = None
 
     return data
 
+def build_report_payload():
+    """حساب التقرير الكامل (أوردرات اليوم + الصرف) وحفظه كآخر تقرير ناجح"""
+    with metrics.timer('report_build_seconds'):
+        return _build_report_payload()
+
+def _build_report_payload():
+    # جلب إجمالي أوردرات ومبيعات اليوم لكل فريق من جدول التجميع اليومي
+    totals_by_team = daily_team_totals(get_db_connection())
+
+    # Get simplified Facebook Ads data, within the report's time budget
+    facebook_data = get_facebook_ads_data(Budget(REPORT_BUDGET))
+    
+    # Update facebook_data with actual orders and sales from DB
+    for team_name, data in facebook_data.items():
+        totals = totals_by_team.get(team_name, {})
+        data['orders'] = totals.get('orders', 0)
+        data['sales'] = totals.get('sales', 0)
+        if team_name != 'Follow-up' and data['spend'] is not None:
+            data['held'] = data['spend'] / data['orders'] if data['orders'] > 0 else 0
+            data['roas'] = data['sales'] / data['spend'] if data['spend'] > 0 else 0
+
+    # تنسيق التقرير
+    report_text = format_detailed_report(facebook_data)
+
+    # عمر أقدم رقم صرف في التقرير بالثواني (None لو مفيش صرف اتجاب)
+    spend_ages = [data['spend_age'] for data in facebook_data.values() if 'spend_age' in data]
+    
+    payload = {
+        "success": True,
+        "report": report_text,
+        "spend_age_seconds": round(max(spend_ages)) if spend_ages else None,
+        "stale_teams": [team for team, data in facebook_data.items() if data.get('spend_stale')],
+        "unavailable_teams": [team for team, data in facebook_data.items() if data['spend'] is None],
+        "api_error": None
+    }
+    # report_flight بيحفظه تحت report:اليوم، وده نفس المفتاح اللي بنرجعله لو حصل خطأ
+    return payload
+
 @app.route('/api/generate_report', methods=['GET'])
 def generate_report():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # جلب إجمالي الأوردرات لكل فريق
-        cursor.execute('SELECT team, SUM(order_count) FROM orders GROUP BY team ORDER BY team')
-        orders_by_team = dict(cursor.fetchall())
-        
-        conn.close()
-
-        # Get simplified Facebook Ads data
-        facebook_data = get_facebook_ads_data()
-        
-        # Update facebook_data with actual orders from DB
-        for team in facebook_data:
-            facebook_data[team]["orders"] = orders_by_team.get(team, 0)
-
-        # Calculate sales and held based on orders and dummy spend
-        for team_name, data in facebook_data.items():
-            # Assuming an average sale value per order for simplification
-            # This needs to be adjusted based on actual business logic
-            if team_name != 'Follow-up':
-                data['sales'] = data['orders'] * 100 # Example: 100 JOD per order
-                data['held'] = data['spend'] / data['orders'] if data['orders'] > 0 else 0
-                data['roas'] = data['sales'] / data['spend'] if data['spend'] > 0 else 0
-            else:
-                data['sales'] = data['orders'] * 80 # Example: 80 JOD per order for follow-up
-
-        # تنسيق التقرير
-        report_text = format_detailed_report(facebook_data)
-        
-        return jsonify({
-            "success": True,
-            "report": report_text,
-            "api_error": None
-        }), 200
+        # الطلبات المتزامنة لنفس اليوم بتستنى حساب واحد بدل ما كل واحد يحسب التقرير لوحده
+        payload = report_flight.do(f"report:{report_day()}", build_report_payload)
+        return jsonify(payload), 200
     except Exception as e:
+        # لو حصل خطأ نرجع آخر تقرير ناجح لنفس اليوم لو موجود، مع توضيح إنه قديم
+        try:
+            snapshot = shared_cache.get(f"report:{report_day()}")
+        except Exception:
+            snapshot = None
+        if snapshot is not None:
+            payload, stored_at = snapshot
+            payload["stale"] = True
+            payload["snapshot_age_seconds"] = round(time.time() - stored_at)
+            payload["api_error"] = str(e)
+            return jsonify(payload), 200
         return jsonify({"success": False, "error": f"حدث خطأ: {str(e)}"}), 500
 
-def parse_orders(order_text):
-    parsed_orders = []
-    # Split the input text into potential order blocks based on common separators
-    # This regex looks for 'الاسم :' or multiple newlines as separators
-    order_blocks = re.split(r'(?:الاسم :|\n\s*\n)+', order_text)
-
-    for order_block in order_blocks:
-        order_block = order_block.strip()
-        if not order_block:
-            continue
-
-        # Extract 'الاسم' (Name)
-        name_match = re.search(r'الاسم :\s*(.+?)(?:\n|$)', order_block)
-        customer_name = name_match.group(1).strip() if name_match else "Unknown Customer"
-
-        # Extract 'المبلغ' (Amount)
-        # This regex now correctly handles 'ج' or 'م.ش' and optional '+' for multiple amounts
-        amount_match = re.search(r'المبلغ :\s*([\d.,]+(?:\s*ج|م.ش)?)(?:\s*\+\s*([\d.,]+(?:\s*ج|م.ش)?))?', order_block)
-        amount = 0.0
-        if amount_match:
-            amount_str_part1 = amount_match.group(1).replace('ج', '').replace('م.ش', '').replace(' ', '').replace(',', '')
-            try:
-                amount = float(amount_str_part1)
-                if amount_match.group(2):
-                    amount_str_part2 = amount_match.group(2).replace('ج', '').replace('م.ش', '').replace(' ', '').replace(',', '')
-                    amount += float(amount_str_part2)
-            except ValueError:
-                print(f"Could not parse amount from: {amount_str_part1}")
-
-        if amount > 0:
-            parsed_orders.append({"customer_name": customer_name, "price": amount})
-        else:
-            print(f"Skipping order for {customer_name} due to invalid or missing amount.")
-
-    return parsed_orders
-
 def format_detailed_report(data):
     """تنسيق التقرير المفصل حسب المثال المعطى"""
     cairo_tz = pytz.timezone('Africa/Cairo')
@@ -275,8 +486,17 @@ def format_detailed_report(data):
         else:
             report += f"تيم ({team})\n"
         
-        if team != 'Follow-up':
+        if team != 'Follow-up' and team_data['spend'] is None:
+            report += f"الصرف :/ {UNAVAILABLE}\n"
+            report += f"عدد الاوردرات / {team_data['orders']}\n"
+            report += f"التكلفة : / {UNAVAILABLE}\n"
+            report += f"المبيعات (غير شاملة الشحن) :/ {team_data['sales']:,} ج\n"
+            report += f"ROAS :/ {UNAVAILABLE}\n"
+            report += "ــــــــــــــــــــــــــــــــــــــــــــ\n"
+        elif team != 'Follow-up':
             report += f"الصرف :/ {team_data['spend']:,} ج\n"
+            if team_data.get('spend_stale'):
+                report += f"(الصرف ده آخر رقم متاح من {round(team_data['spend_age'] / 60)} دقيقة)\n"
             report += f"عدد الاوردرات / {team_data['orders']}\n"
             report += f"التكلفة : / {team_data['held']:.2f} ج\n"
             report += f"المبيعات (غير شاملة الشحن) :/ {team_data['sales']:,} ج\n"
@@ -287,41 +507,29 @@ def format_detailed_report(data):
             report += f"المبيعات (غير شاملة الشحن) :/ {team_data['sales']:,} ج\n"
 
     
-    # إجماليات A + B
-    a_data = data['A']
-    b_data = data['B']
-    
-    ab_spend = a_data['spend'] + b_data['spend']
-    ab_orders = a_data['orders'] + b_data['orders']
-    ab_sales = a_data['sales'] + b_data['sales']
-    ab_roas = ab_sales / ab_spend if ab_spend > 0 else 0
-    ab_cost_per_order = ab_spend / ab_orders if ab_orders > 0 else 0
-    
-    report += "\nــــــــــــــــــــــــــــــــــــــــــــ\n"
-    report += "اجماليات (A) + (B)\n"
-    report += f"توتال الصرف الاوردرات ( إجمالي ) :/ {ab_spend:,} ج\n"
-    report += f"إجمالي عام اوردات :/ {ab_orders}\n"
-    report += f"التكلفة / {ab_cost_per_order:.2f} ج\n"
-    report += f"إجمالي المبيعات (A+B) :/ {ab_sales:,} ج\n"
-    report += f"ROAS (A+B) :/ {ab_roas:.2f}\n\n"
-    
-    # إجماليات C + C1
-    c_data = data['C']
-    c1_data = data['C1']
-
-    cc1_spend = c_data['spend'] + c1_data['spend']
-    cc1_orders = c_data['orders'] + c1_data['orders']
-    cc1_sales = c_data['sales'] + c1_data['sales']
-    cc1_roas = cc1_sales / cc1_spend if cc1_spend > 0 else 0
-    cc1_cost_per_order = cc1_spend / cc1_orders if cc1_orders > 0 else 0
-
-    report += "ــــــــــــــــــــــــــــــــــــــــــــ\n"
-    report += "اجماليات (C) + (C1)\n"
-    report += f"توتال الصرف الاوردرات ( إجمالي ) :/ {cc1_spend:,} ج\n"
-    report += f"إجمالي عام اوردات :/ {cc1_orders}\n"
-    report += f"التكلفة / {cc1_cost_per_order:.2f} ج\n"
-    report += f"إجمالي المبيعات (C+C1) :/ {cc1_sales:,} ج\n"
-    report += f"ROAS (C+C1) :/ {cc1_roas:.2f}\n\n"
+    # إجماليات A + B و C + C1 (الصرف غير متاح لو صرف أي تيم في المجموعة مش متاح)
+    for label, group in (("(A) + (B)", ("A", "B")), ("(C) + (C1)", ("C", "C1"))):
+        group_spend = None if any(data[team]['spend'] is None for team in group) else sum(data[team]['spend'] for team in group)
+        group_orders = sum(data[team]['orders'] for team in group)
+        group_sales = sum(data[team]['sales'] for team in group)
+        short = label.replace("(", "").replace(")", "").replace(" ", "")
+
+        report += "\nــــــــــــــــــــــــــــــــــــــــــــ\n" if group[0] == "A" else "ــــــــــــــــــــــــــــــــــــــــــــ\n"
+        report += f"اجماليات {label}\n"
+        if group_spend is None:
+            report += f"توتال الصرف الاوردرات ( إجمالي ) :/ {UNAVAILABLE}\n"
+            report += f"إجمالي عام اوردات :/ {group_orders}\n"
+            report += f"التكلفة / {UNAVAILABLE}\n"
+            report += f"إجمالي المبيعات ({short}) :/ {group_sales:,} ج\n"
+            report += f"ROAS ({short}) :/ {UNAVAILABLE}\n\n"
+            continue
+        group_roas = group_sales / group_spend if group_spend > 0 else 0
+        group_cost_per_order = group_spend / group_orders if group_orders > 0 else 0
+        report += f"توتال الصرف الاوردرات ( إجمالي ) :/ {group_spend:,} ج\n"
+        report += f"إجمالي عام اوردات :/ {group_orders}\n"
+        report += f"التكلفة / {group_cost_per_order:.2f} ج\n"
+        report += f"إجمالي المبيعات ({short}) :/ {group_sales:,} ج\n"
+        report += f"ROAS ({short}) :/ {group_roas:.2f}\n\n"
 
     # إجماليات عامة
     total_spend = sum(team_data['spend'] for team_data in data.values() if team_data['spend'] is not None)
@@ -329,19 +537,23 @@ def format_detailed_report(data):
     total_sales = sum(team_data['sales'] for team_data in data.values() if team_data['sales'] is not None)
     total_roas = total_sales / total_spend if total_spend > 0 else 0
     total_cost_per_order = total_spend / total_orders if total_orders > 0 else 0
+    missing = [team for team in teams if data[team]['spend'] is None]
     
     report += "ــــــــــــــــــــــــــــــــــــــــــــ\n"
     report += "اجماليات عامة\n"
-    report += f"إجمالي الصرف الكلي :/ {total_spend:,} ج\n"
+    if missing:
+        # الإجمالي هنا من غير صرف التيمات اللي مش متاح
+        report += f"إجمالي الصرف الكلي :/ {total_spend:,} ج (من غير {', '.join(missing)})\n"
+    else:
+        report += f"إجمالي الصرف الكلي :/ {total_spend:,} ج\n"
     report += f"إجمالي الأوردرات الكلي :/ {total_orders}\n"
-    report += f"متوسط التكلفة الكلي :/ {total_cost_per_order:.2f} ج\n"
+    report += f"متوسط التكلفة الكلي :/ {UNAVAILABLE if missing else f'{total_cost_per_order:.2f} ج'}\n"
     report += f"إجمالي المبيعات الكلي :/ {total_sales:,} ج\n"
-    report += f"ROAS الكلي :/ {total_roas:.2f}\n"
+    report += f"ROAS الكلي :/ {UNAVAILABLE if missing else f'{total_roas:.2f}'}\n"
     
     return report
 
 if __name__ == "__main__":
-    init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
 
 
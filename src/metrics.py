@@ -0,0 +1,265 @@
+"""
+Counters and latency histograms for the app's stages, served as Prometheus text.
+
+Every module records into the process-wide `metrics` object. Recording only
+touches memory; once attach(db) was called, a background thread writes this
+process's totals to the metric_snapshots table (migration 8) every
+METRICS_FLUSH_INTERVAL seconds. /metrics adds up the rows of every gunicorn
+worker, so a scrape sees the whole app whichever worker answers it. Rows of
+workers that are gone are added into a permanent "retired" row, so the
+exported counters never go down.
+"""
+import contextvars
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Rows of workers that stopped flushing are folded into the retired row after this long.
+METRICS_RETENTION = float(os.environ.get('METRICS_RETENTION', 24 * 3600))
+
+# Seconds; wide enough for a sub-millisecond DB read and a slow Graph API call.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DESCRIPTIONS = {
+    'order_parse_seconds': 'Time to parse one order text.',
+    'order_parse_seconds_per_kb': 'Parse time per KB of text, for texts of 1 KB or more.',
+    'order_parse_bytes_total': 'Characters of order text parsed.',
+    'orders_parsed_total': 'Orders with a usable amount found by the parser.',
+    'order_records_skipped_total': 'Order-like records skipped for having no usable amount.',
+    'db_connect_seconds': 'Time to open and configure a SQLite connection.',
+    'db_insert_seconds': 'Time to insert one batch of orders.',
+    'db_aggregate_seconds': 'Time to read the daily per-team totals.',
+    'facebook_fetch_seconds': 'Time of one Graph API spend fetch, per account or batch.',
+    'facebook_fetch_total': 'Graph API spend fetches by outcome.',
+    'spend_cache_lookups_total': 'Spend cache lookups by result (fresh, stale, miss, fallback).',
+    'llm_cache_lookups_total': 'LLM answer cache lookups by result (hit, miss).',
+    'llm_calls_total': 'LLM completions by outcome.',
+    'llm_call_seconds': 'Time of one LLM completion.',
+    'llm_blocks_total': 'Blocks sent to the LLM.',
+    'report_build_seconds': 'Time to build the full report.',
+}
+
+
+# Totals of the histograms observed during one request, see Metrics.collect_stages().
+# Pool threads see the request's dict when their task runs in a copy of its context.
+_stages = contextvars.ContextVar('metric_stages', default=None)
+
+# The row holding the totals of every worker that stopped flushing.
+RETIRED_WORKER = 'retired'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _merge(snapshots, buckets):
+    """The snapshots' counters and histograms added up, as one snapshot."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for key, value in snapshot['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, counts in snapshot['histograms'].items():
+            if len(counts) != len(buckets) + 2:
+                continue  # written with other buckets by an older worker
+            total = histograms.setdefault(key, [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+    return {'counters': counters, 'histograms': histograms}
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.db = None
+        # "name|label key" -> value / [bucket counts..., +Inf count, sum]
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._flusher_started = False
+
+    @staticmethod
+    def _key(name, labels):
+        return json.dumps([name, _label_key(labels)])
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        stages = _stages.get()
+        key = self._key(name, labels)
+        with self._lock:
+            if stages is not None:
+                stages[name] = stages.get(name, 0.0) + value
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with-block in histogram name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def collect_stages(self):
+        """
+        Yield a dict that gets {histogram name: total seconds} observed in the
+        with-block, including by tasks handed to pools with submit_in_context().
+        """
+        stages = {}
+        token = _stages.set(stages)
+        try:
+            yield stages
+        finally:
+            _stages.reset(token)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: list(counts) for key, counts in self._histograms.items()},
+            }
+
+    def attach(self, db):
+        """Share this process's metrics with the other workers through db."""
+        self.db = db
+        self._start_flusher()
+        # A forked worker starts counting from zero and needs its own flusher.
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._counters.clear()
+        self._histograms.clear()
+        self._flusher_started = False
+        self._worker = None
+        if self.db is not None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher_started:
+            return
+        self._flusher_started = True
+        self._worker = f"{socket.gethostname()}:{os.getpid()}:{time.time():.0f}"
+        threading.Thread(target=self._flush_loop, daemon=True, name='metrics').start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing metrics: {e}")
+
+    def flush(self):
+        if self.db is None or self._worker is None:
+            return
+        now = time.time()
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO metric_snapshots (worker, payload, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (worker) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at',
+                (self._worker, json.dumps(self.snapshot()), now),
+            )
+            # The upsert above took the write lock, so no other worker folds the same rows.
+            expired = conn.execute(
+                'SELECT worker, payload FROM metric_snapshots WHERE updated_at < ? AND worker != ?',
+                (now - METRICS_RETENTION, RETIRED_WORKER),
+            ).fetchall()
+            if not expired:
+                return
+            retired = conn.execute(
+                'SELECT payload FROM metric_snapshots WHERE worker = ?', (RETIRED_WORKER,)
+            ).fetchone()
+            payloads = [json.loads(payload) for _, payload in expired]
+            if retired is not None:
+                payloads.append(json.loads(retired[0]))
+            conn.execute(
+                'INSERT INTO metric_snapshots (worker, payload, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (worker) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at',
+                (RETIRED_WORKER, json.dumps(_merge(payloads, self.buckets)), now),
+            )
+            conn.executemany('DELETE FROM metric_snapshots WHERE worker = ?', [(worker,) for worker, _ in expired])
+
+    def _collect(self):
+        if self.db is None:
+            return [self.snapshot()]
+        self.flush()
+        rows = self.db.connection().execute('SELECT payload FROM metric_snapshots').fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def render(self):
+        """Every worker's metrics, summed, in the Prometheus text format."""
+        merged = _merge(self._collect(), self.buckets)
+        counters = merged['counters']
+        histograms = merged['histograms']
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for key in sorted(counters):
+            name, labels = json.loads(key)
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(counters[key])}")
+        for key in sorted(histograms):
+            name, labels = json.loads(key)
+            counts = histograms[key]
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, le=_format_value(bound))} {cumulative}")
+            cumulative += counts[len(self.buckets)]
+            lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def submit_in_context(executor, fn, *args):
+    """executor.submit(fn, *args), run in a copy of the caller's context so its stage timings reach the caller's request."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# Shared by every module in the process.
+metrics = Metrics()
@@ -0,0 +1,159 @@
+"""
+Incremental reader for the per-team order files (orders/<team>.txt).
+
+Each file gets a checkpoint with the bytes already read, the totals of the
+complete orders in them and the unfinished record at the end. A report then
+only parses what was appended since the previous one. A file that shrank,
+was replaced (new inode) or rewritten from the start is read again in full.
+
+append_team_orders() is the writing side: it skips orders already in the
+file, recognised by the fingerprint of the pasted order (see
+Order.fingerprint), so re-pasting a chat doesn't count its orders twice.
+"""
+import codecs
+import fcntl
+import hashlib
+import json
+import os
+
+from src.order_parser import OrderStream
+
+CHECKPOINT_FILE = '.report_checkpoint.json'
+# Bytes from the start of a file hashed to notice it was rewritten in place.
+HEAD_BYTES = 256
+
+
+def fingerprints_path(orders_dir, team):
+    # Not a .txt file, so team_file_totals() doesn't read it as orders.
+    return os.path.join(orders_dir, f'.{team}.fingerprints')
+
+
+def append_team_orders(orders_dir, team, orders):
+    """
+    Append the orders to orders/<team>.txt, skipping any whose fingerprint
+    was saved to the file before, and return the orders that were written.
+    """
+    os.makedirs(orders_dir, exist_ok=True)
+    with open(fingerprints_path(orders_dir, team), 'a+', encoding='utf-8') as seen_file:
+        # Saves from other workers wait here, so both files stay in step.
+        fcntl.flock(seen_file, fcntl.LOCK_EX)
+        seen_file.seek(0)
+        seen = set(seen_file.read().split())
+        stored = []
+        for order in orders:
+            fingerprint = order.fingerprint
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                stored.append(order)
+        if stored:
+            with open(os.path.join(orders_dir, f'{team}.txt'), 'a', encoding='utf-8') as f:
+                for order in stored:
+                    f.write(f"الاسم: {order.name or 'غير محدد'}\n")
+                    f.write(f"المبلغ: {order.amount_text}\n")
+                    f.write(f"الايچينت: {order.agent or 'غير محدد'}\n")
+                    f.write("---\n")
+            seen_file.write(''.join(f"{order.fingerprint}\n" for order in stored))
+    return stored
+
+
+def _head_digest(f, length):
+    f.seek(0)
+    return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def load_checkpoints(orders_dir):
+    try:
+        with open(os.path.join(orders_dir, CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoints(orders_dir, checkpoints):
+    path = os.path.join(orders_dir, CHECKPOINT_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def tail_file(file_path, checkpoint=None):
+    """
+    Bring checkpoint up to date with file_path and return the new checkpoint:
+    {'inode', 'offset', 'head', 'orders', 'sales', 'pending'}.
+    """
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if checkpoint is not None:
+            head_length = min(HEAD_BYTES, checkpoint['offset'])
+            if (
+                checkpoint['inode'] != stat.st_ino
+                or stat.st_size < checkpoint['offset']
+                or _head_digest(f, head_length) != checkpoint['head']
+            ):
+                print(f"{file_path} was truncated or replaced, reading it again")
+                checkpoint = None
+        if checkpoint is None:
+            checkpoint = {'inode': stat.st_ino, 'offset': 0, 'head': _head_digest(f, 0),
+                          'orders': 0, 'sales': 0.0, 'pending': ''}
+
+        f.seek(checkpoint['offset'])
+        data = f.read()
+
+    # A writer may be half way through a character; leave its bytes for next time.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = decoder.decode(data)
+    consumed = len(data) - len(decoder.getstate()[0])
+
+    stream = OrderStream(checkpoint['pending'])
+    orders = stream.feed(text)
+    offset = checkpoint['offset'] + consumed
+    if checkpoint['offset'] < HEAD_BYTES:
+        with open(file_path, 'rb') as f:
+            head = _head_digest(f, min(HEAD_BYTES, offset))
+    else:
+        head = checkpoint['head']
+    return {
+        'inode': checkpoint['inode'],
+        'offset': offset,
+        'head': head,
+        'orders': checkpoint['orders'] + len(orders),
+        'sales': checkpoint['sales'] + sum(order.price for order in orders),
+        'pending': stream.pending,
+    }
+
+
+def checkpoint_totals(checkpoint):
+    """Order count and sales for a checkpoint, counting its unfinished last record too."""
+    pending = OrderStream(checkpoint['pending']).peek()
+    return {
+        'orders': checkpoint['orders'] + len(pending),
+        'sales': checkpoint['sales'] + sum(order.price for order in pending),
+    }
+
+
+def team_file_totals(orders_dir):
+    """
+    Return {file name: {'orders', 'sales'}} for every .txt file in orders_dir,
+    reading only what changed since the last call and saving the checkpoints.
+    """
+    if not os.path.exists(orders_dir):
+        return {}
+    previous = load_checkpoints(orders_dir)
+    checkpoints = {}
+    totals = {}
+    for name in os.listdir(orders_dir):
+        if not name.endswith('.txt'):
+            continue
+        try:
+            checkpoints[name] = tail_file(os.path.join(orders_dir, name), previous.get(name))
+        except OSError as e:
+            print(f"Error reading {name}: {e}")
+            continue
+        totals[name] = checkpoint_totals(checkpoints[name])
+    if checkpoints != previous:
+        try:
+            save_checkpoints(orders_dir, checkpoints)
+        except OSError as e:
+            print(f"Error saving order file checkpoints: {e}")
+    return totals
@@ -0,0 +1,94 @@
+"""
+Streaming import of large order texts, such as full WhatsApp chat exports.
+
+The text is decoded and parsed in fixed-size chunks and orders are inserted
+in batches, so memory use does not grow with the size of the upload.
+"""
+import codecs
+import time
+
+from src.order_parser import OrderStream, record_parse
+from src.order_store import insert_orders
+
+CHUNK_SIZE = 64 * 1024
+INSERT_BATCH = 500
+# Only the first few rejected blocks are returned; the rest are just counted.
+MAX_REJECTED = 50
+
+
+def iter_text_chunks(binary_stream, chunk_size=CHUNK_SIZE):
+    """Decode a UTF-8 byte stream (with or without a BOM) chunk by chunk."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    while True:
+        data = binary_stream.read(chunk_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            # Exports made on Windows use CRLF line endings.
+            yield text.replace('\r', '')
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text.replace('\r', '')
+
+
+def import_orders(conn, team, chunks, progress=None, known=()):
+    """
+    Parse and store the orders in chunks (an iterable of str) for one team.
+    known is passed on to insert_orders().
+
+    Returns {'blocks', 'order_count', 'total_sales', 'duplicates_skipped',
+    'rejected_count', 'rejected'}, where blocks counts every order-like record
+    found, duplicates_skipped the orders already saved (the same day, or in known), and
+    rejected lists the first MAX_REJECTED records that had no usable amount. progress, if given,
+    is called with the running summary after every chunk.
+    """
+    summary = {'blocks': 0, 'order_count': 0, 'total_sales': 0.0, 'duplicates_skipped': 0,
+               'rejected_count': 0, 'rejected': []}
+    stream = OrderStream()
+    batch = []
+
+    def flush():
+        if batch:
+            stored = insert_orders(conn, team, batch, known=known)
+            summary['order_count'] += len(stored)
+            summary['total_sales'] += sum(order.price for order in stored)
+            summary['duplicates_skipped'] += len(batch) - len(stored)
+            batch.clear()
+
+    def handle(records):
+        for record in records:
+            summary['blocks'] += 1
+            if record.is_valid:
+                batch.append(record)
+                continue
+            summary['rejected_count'] += 1
+            if len(summary['rejected']) < MAX_REJECTED:
+                summary['rejected'].append(record.to_dict())
+        if len(batch) >= INSERT_BATCH:
+            flush()
+
+    # Parse time only, without the inserts, so the parser metrics compare with parse_orders().
+    parse_seconds = 0.0
+    size = 0
+    for chunk in chunks:
+        start = time.perf_counter()
+        records = stream.feed_records(chunk)
+        parse_seconds += time.perf_counter() - start
+        size += len(chunk)
+        handle(records)
+        if progress is not None:
+            progress(summary)
+    start = time.perf_counter()
+    records = stream.close_records()
+    parse_seconds += time.perf_counter() - start
+    handle(records)
+    flush()
+    record_parse(size, parse_seconds, summary['blocks'] - summary['rejected_count'], summary['rejected_count'])
+    return summary
+
+
+def iter_string_chunks(text, chunk_size=CHUNK_SIZE):
+    """Slice an already loaded text into the chunks import_orders() expects."""
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
@@ -0,0 +1,295 @@
+"""
+Order parsing with the regex parser first and an LLM only where it is unsure.
+
+The pasted text is cut into blocks at WhatsApp message headers and record
+starts. Each block is parsed locally and given a confidence score. Only blocks
+scoring under LLM_CONFIDENCE_THRESHOLD go to the model, up to LLM_BATCH_SIZE
+of them in one completion. Answers are cached by a hash of the block's
+normalized text, so a block pasted again costs nothing.
+
+The client is anything with OpenAI's chat.completions.create(); StubLLMClient
+answers locally for tests and benchmarks (ORDER_LLM_CLIENT=stub).
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from src.arabic_text import normalize
+from src.circuit_breaker import llm_circuit
+from src.metrics import metrics
+from src.order_parser import iter_records_at, message_starts, parse_orders, strip_header
+
+LLM_MODEL = os.environ.get('ORDER_LLM_MODEL', 'gpt-4o')
+# Blocks the regex parser scores below this are sent to the model.
+LLM_CONFIDENCE_THRESHOLD = float(os.environ.get('ORDER_LLM_CONFIDENCE_THRESHOLD', 0.6))
+# Blocks sent in one completion.
+LLM_BATCH_SIZE = int(os.environ.get('ORDER_LLM_BATCH_SIZE', 20))
+# Answers kept in each worker's cache.
+LLM_CACHE_SIZE = int(os.environ.get('ORDER_LLM_CACHE_SIZE', 5000))
+# Changing the prompt changes the cache keys, so old answers are not reused.
+PROMPT_VERSION = 1
+
+SYSTEM_PROMPT = (
+    "You are an order parsing assistant for Egyptian WhatsApp order messages. "
+    "The user sends a JSON object {\"blocks\": [{\"id\": int, \"text\": str}]}. "
+    "For each block, extract the total amount of its orders (including shipping) and the number of orders. "
+    "Respond only with a JSON object like: "
+    "{\"results\": [{\"id\": int, \"total_amount\": float, \"order_count\": int}]}, "
+    "one result per block. If a block has no order, return 0 for both."
+)
+
+# A block with no labelled fields still looks like an order if it has a phone
+# number, or an amount word next to a number.
+_PHONE_RE = re.compile(r'(?<!\d)01\d{9}(?!\d)')
+_AMOUNT_WORD_RE = re.compile(r'جنيه|ج\.م|مبلغ|سعر')
+_PRICE_RE = re.compile(r'\d{2,}')
+
+
+@dataclass(slots=True)
+class Block:
+    text: str
+    total_amount: float = 0.0
+    order_count: int = 0
+    confidence: float = 1.0
+    source: str = 'regex'
+
+    @property
+    def digest(self):
+        """Hash of the block's normalized text without its message header."""
+        body = ' '.join(normalize(strip_header(self.text)).split())
+        return hashlib.sha1(f"{PROMPT_VERSION}|{body}".encode('utf-8')).hexdigest()
+
+
+def record_confidence(record):
+    """How sure the regex parser is about one record, from 0 to 1."""
+    if record.amount_text is None:
+        # Labelled fields but no labelled amount: the price is probably on a free-form line.
+        return 0.3
+    if record.price <= 0:
+        # An amount the regexes could not read, e.g. written out in words.
+        return 0.2
+    confidence = 1.0
+    if record.name is None:
+        confidence -= 0.15
+    if len(re.findall(r'\d+', record.amount_text)) > 2:
+        # Several prices in one amount line; the price/shipping split is a guess.
+        confidence -= 0.15
+    return confidence
+
+
+def split_blocks(text):
+    """Cut text into blocks at message headers and record starts, and parse each one locally."""
+    records = list(iter_records_at(text))
+    starts = sorted({0, *message_starts(text), *(start for start, _ in records)})
+    starts.append(len(text))
+
+    blocks = []
+    records_at = {start: [] for start in starts}
+    for start, record in records:
+        records_at[start].append(record)
+    for begin, end in zip(starts, starts[1:]):
+        block = Block(text[begin:end])
+        block_records = records_at[begin]
+        if block_records:
+            valid = [record for record in block_records if record.is_valid]
+            block.total_amount = sum(record.total for record in valid)
+            block.order_count = len(valid)
+            block.confidence = min(record_confidence(record) for record in block_records)
+        elif not block.text.strip():
+            continue
+        else:
+            body = normalize(strip_header(block.text))
+            if _PHONE_RE.search(body) or (_AMOUNT_WORD_RE.search(body) and _PRICE_RE.search(body)):
+                block.confidence = 0.3
+        blocks.append(block)
+    return blocks
+
+
+class StubLLMClient:
+    """
+    Local stand-in for the OpenAI client. Answers each block with the regex
+    parser's result after an optional delay, so code paths and batch sizes can
+    be exercised without network access or tokens.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.loads(messages[-1]['content'])
+        results = []
+        for block in payload['blocks']:
+            orders = parse_orders(block['text'])
+            results.append({
+                'id': block['id'],
+                'total_amount': sum(order.total for order in orders),
+                'order_count': len(orders),
+            })
+        content = json.dumps({'results': results})
+        message = type('Message', (), {'content': content})()
+        choice = type('Choice', (), {'message': message})()
+        return type('Completion', (), {'choices': [choice]})()
+
+
+def default_client():
+    """The client named by ORDER_LLM_CLIENT: "openai" (default) or "stub"."""
+    if os.environ.get('ORDER_LLM_CLIENT', 'openai') == 'stub':
+        return StubLLMClient()
+    from openai import OpenAI
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=os.environ.get("OPENAI_API_BASE"))
+
+
+class LLMOrderParser:
+    """
+    parse(text) -> {"total_amount", "order_count", "blocks", "llm_blocks", "cached_blocks"}.
+
+    The client is created on first use unless one is given. When shared is a
+    SharedCache, answers are also stored there for the other workers. While
+    breaker has the model's circuit open, every block keeps its regex result.
+    """
+
+    def __init__(self, client=None, model=LLM_MODEL, threshold=LLM_CONFIDENCE_THRESHOLD,
+                 batch_size=LLM_BATCH_SIZE, cache_size=LLM_CACHE_SIZE, shared=None, breaker=llm_circuit):
+        self._client = client
+        self.breaker = breaker
+        self.model = model
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.shared = shared
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = default_client()
+        return self._client
+
+    def _cache_get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                return value
+        if self.shared is not None:
+            entry = self.shared.get(f"llm:{key}")
+            if entry is not None:
+                value = tuple(entry[0])
+                self._cache_put(key, value, share=False)
+                return value
+        return None
+
+    def _cache_put(self, key, value, share=True):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if share and self.shared is not None:
+            self.shared.set(f"llm:{key}", list(value))
+
+    def complete_batch(self, blocks, timeout=None):
+        """
+        Ask the model about blocks in one completion. Returns {index in blocks:
+        (total_amount, order_count)} for the blocks it answered. timeout is
+        passed on to the client as the limit for this one call.
+        """
+        payload = {'blocks': [{'id': i, 'text': block.text} for i, block in enumerate(blocks)]}
+        options = {} if timeout is None else {'timeout': timeout}
+        metrics.inc('llm_blocks_total', len(blocks))
+        start = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+                ],
+                response_format={"type": "json_object"},
+                **options,
+            )
+            data = json.loads(response.choices[0].message.content)
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.failure(self.model)
+            metrics.inc('llm_calls_total', outcome='error')
+            metrics.observe('llm_call_seconds', time.perf_counter() - start)
+            raise
+        if self.breaker is not None:
+            self.breaker.success(self.model)
+        metrics.inc('llm_calls_total', outcome='ok')
+        metrics.observe('llm_call_seconds', time.perf_counter() - start)
+        answers = {}
+        for result in data.get('results', []):
+            try:
+                index = int(result['id'])
+                if 0 <= index < len(blocks):
+                    answers[index] = (float(result.get('total_amount', 0) or 0), int(result.get('order_count', 0) or 0))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return answers
+
+    def uncertain_blocks(self, blocks):
+        """Fill blocks from the cache where possible; return the ones still needing the model."""
+        pending = []
+        for block in blocks:
+            if block.confidence >= self.threshold:
+                continue
+            cached = self._cache_get(f"{self.model}:{block.digest}")
+            metrics.inc('llm_cache_lookups_total', result='hit' if cached is not None else 'miss')
+            if cached is not None:
+                block.total_amount, block.order_count = cached
+                block.source = 'cache'
+            else:
+                pending.append(block)
+        return pending
+
+    def apply_answers(self, blocks, answers):
+        """Store the model's answers for blocks (as returned by complete_batch) and cache them."""
+        for index, answer in answers.items():
+            block = blocks[index]
+            block.total_amount, block.order_count = answer
+            block.source = 'llm'
+            self._cache_put(f"{self.model}:{block.digest}", answer)
+
+    def batches(self, blocks):
+        """blocks in groups of batch_size, or none at all while the model's circuit is open."""
+        if not blocks:
+            return []
+        if self.breaker is not None and not self.breaker.allow(self.model):
+            print(f"LLM circuit open, using the regex result for {len(blocks)} blocks")
+            return []
+        return [blocks[start:start + self.batch_size] for start in range(0, len(blocks), self.batch_size)]
+
+    def parse(self, text):
+        blocks = split_blocks(text or '')
+        for batch in self.batches(self.uncertain_blocks(blocks)):
+            try:
+                self.apply_answers(batch, self.complete_batch(batch))
+            except Exception as e:
+                # The regex results stand for this batch and the ones after it.
+                print(f"Error parsing with ChatGPT: {e}")
+                break
+        return summarize(blocks)
+
+
+def summarize(blocks):
+    return {
+        'total_amount': sum(block.total_amount for block in blocks),
+        'order_count': sum(block.order_count for block in blocks),
+        'blocks': len(blocks),
+        'llm_blocks': sum(1 for block in blocks if block.source == 'llm'),
+        'cached_blocks': sum(1 for block in blocks if block.source == 'cache'),
+    }
@@ -0,0 +1,327 @@
+"""
+Single-pass parser for the WhatsApp order format used by every team:
+
+    [‏17‏/7‏/2025، 12:37:42 ص] ~ روان محمود: الاسم : عوض سعد الحداد
+    رقم التليفون : 01068483812
+    المحافظه : البحيرة
+    المبلغ : 1890+ 75م.ش
+    الايچينت : روان
+
+Orders may also be pasted without WhatsApp headers, or separated by lines of
+"=====" / "---" as in the saved team files. All patterns are compiled once at
+import time and the text is walked once with finditer: one regex finds every
+field line, separator and message header, including a field that follows the
+header on the same line, so the Python loop only runs once per match.
+"""
+import hashlib
+import re
+import time
+from dataclasses import dataclass
+
+from src.arabic_text import IGNORABLE, fold_alternation, normalize
+from src.metrics import metrics
+
+# Field labels, in the normalized spelling (see src/arabic_text.py), and the
+# Order attribute they fill. The pattern accepts every spelling that folds to
+# a label (الأسم, الإيچينت, المحافظة, stray tatweel...).
+FIELD_LABELS = {
+    'الاسم': 'name',
+    'اسم': 'name',
+    'المبلغ': 'amount',
+    'مبلغ': 'amount',
+    'الايجينت': 'agent',
+    'ايجينت': 'agent',
+    'الايجنت': 'agent',
+    'رقم التليفون': 'phone',
+    'رقم الهاتف': 'phone',
+    'رقم الموبايل': 'phone',
+    'المحافظه': 'governorate',
+    'الاوردر': 'product',
+}
+
+EDITED_MARKERS = ('<تم تعديل هذه الرسالة>', '<This message was edited>')
+
+_MARKS = '[' + IGNORABLE + ']*'
+_WS = r'[ \t\u00a0\u202f' + IGNORABLE + ']'
+_LABELS = fold_alternation(FIELD_LABELS)
+_FIELD = r'(?P<label>' + _LABELS + r')' + _WS + r'*[:：]' + _WS + r'*(?P<value>[^\n]*)'
+
+# "17/7/2025، 12:37:42 ص", "17/07/2025, 11:27 PM", "7/17, 11:27 PM"
+# \d also matches Arabic-Indic digits.
+_TIMESTAMP = (
+    r'\d{1,2}' + _MARKS + r'[/.]' + _MARKS + r'\d{1,2}(?:' + _MARKS + r'[/.]' + _MARKS + r'\d{2,4})?[\u060c,]?' + _WS + r'*'
+    r'\d{1,2}:\d{2}(?::\d{2})?' + _WS + r'*(?:[AaPp]\.?[Mm]\.?|[صم])?'
+)
+# The sender name ends at the first colon, unless it is really the first field label.
+_SENDER = r'(?!(?:' + _LABELS + r')' + _WS + r'*[:：])[^:\n]{1,80}:'
+WHATSAPP_HEADER = (
+    r'(?:\[' + _MARKS + _TIMESTAMP + _MARKS + r'\]' + _WS + r'*~?|' + _TIMESTAMP + _WS + r'*-)'
+    + _WS + r'*(?:' + _SENDER + r')?'
+)
+
+# One match per interesting line: a field, a separator, or a message header
+# with the field on its line, if any (hlabel/hvalue). Anchoring on a literal
+# newline lets the regex engine skip between lines quickly. The header is
+# atomic so a line without a field doesn't backtrack through it; it matches
+# the same text as _HEADER_RE. Matching headers here rather than with a
+# second call per candidate line keeps the work in C.
+_HEADER_FIELD = _FIELD.replace('?P<label>', '?P<hlabel>').replace('?P<value>', '?P<hvalue>')
+_LINE_RE = re.compile(
+    r'\n' + _WS + r'*+(?:' + _FIELD + r'|(?P<sep>[=_-]{3,})|'
+    r'(?P<header>(?>' + WHATSAPP_HEADER + r'))' + _WS + r'*+(?:' + _HEADER_FIELD + r')?)'
+)
+_HEADER_HINT = r'(?P<header>\[|\d{1,2}' + _MARKS + r'[/.]' + _MARKS + r'\d)'
+_HEADER_RE = re.compile(WHATSAPP_HEADER + _WS + r'*')
+_HEADER_HINT_RE = re.compile(r'\n' + _WS + r'*' + _HEADER_HINT)
+_NUMBER_RE = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+
+@dataclass(slots=True)
+class Order:
+    name: str | None = None
+    price: float = 0.0
+    shipping: float = 0.0
+    agent: str | None = None
+    phone: str | None = None
+    governorate: str | None = None
+    product: str | None = None
+    amount_text: str | None = None
+
+    @property
+    def total(self):
+        """Price including shipping."""
+        return self.price + self.shipping
+
+    @property
+    def is_valid(self):
+        return self.price > 0
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of the normalized name, phone, amount and product, so the same
+        order pasted twice (e.g. in overlapping chat chunks) can be recognised.
+        """
+        key = '|'.join((
+            _fingerprint_text(self.name),
+            ''.join(ch for ch in self.phone or '' if ch.isdigit()),
+            f"{self.price:g}+{self.shipping:g}",
+            _fingerprint_text(self.product),
+        ))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'price': self.price,
+            'shipping': self.shipping,
+            'agent': self.agent,
+            'phone': self.phone,
+            'governorate': self.governorate,
+            'product': self.product,
+            'amount_text': self.amount_text,
+        }
+
+
+def parse_amount(amount_text):
+    """
+    Split an amount like "1890+ 75م.ش", "1190 + 65" or "1890 + 1600 + 75" into
+    (price, shipping). The last of several numbers is the shipping fee; a single
+    number is the price on its own.
+    """
+    numbers = _NUMBER_RE.findall(amount_text)
+    if ',' in amount_text:
+        numbers = [number.replace(',', '') for number in numbers]
+    if len(numbers) == 2:
+        return float(numbers[0]), float(numbers[1])
+    if len(numbers) == 1:
+        return float(numbers[0]), 0.0
+    if not numbers:
+        return 0.0, 0.0
+    return sum(map(float, numbers[:-1])), float(numbers[-1])
+
+
+def _fingerprint_text(value):
+    return ' '.join(normalize(value or '').split()).casefold()
+
+
+_VALUE_STRIP = ' \t\u00a0\u202f' + IGNORABLE
+
+
+def _drop_edited_markers(value):
+    for marker in EDITED_MARKERS:
+        value = value.replace(marker, '')
+    return value
+
+
+# Raw label spellings seen so far, mapped to their field; a handful per chat.
+_LABEL_FIELDS = dict(FIELD_LABELS)
+
+
+def _label_field(label):
+    field = _LABEL_FIELDS.get(label)
+    if field is None:
+        field = _LABEL_FIELDS[label] = FIELD_LABELS[' '.join(normalize(label).split())]
+    return field
+
+
+def iter_records(text):
+    """
+    Yield every order-like record in text, including ones without a usable
+    amount. A record ends at a WhatsApp message header, a separator line, or a
+    second name field.
+    """
+    for _, record in _iter_records(text):
+        yield record
+
+
+def iter_records_at(text):
+    """Like iter_records(), but yield (offset of the record's first line, record)."""
+    return _iter_records(text)
+
+
+def strip_header(text):
+    """text without the WhatsApp message header it starts with, if any."""
+    header = _HEADER_RE.match(text)
+    return text[header.end():] if header else text
+
+
+def _iter_records(text):
+    # Yields (start, record), where start is the offset in text of the line
+    # that opened the record. This loop runs once per field line, so values
+    # are cleaned inline instead of through helper calls.
+    text = '\n' + text
+    current = None
+    start = 0
+    label_fields = _LABEL_FIELDS
+    for match in _LINE_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'value':
+            label, value = match.group('label', 'value')
+        else:
+            # A message header or separator ends the record.
+            if current is not None:
+                yield start, current
+                current = None
+            if kind != 'hvalue':
+                continue
+            # The first field of a message sits on the header line itself.
+            label, value = match.group('hlabel', 'hvalue')
+
+        field = label_fields.get(label) or _label_field(label)
+        if current is None:
+            current = Order()
+            # The match begins at the newline added in front of the line, which
+            # is where the line itself begins in the caller's text.
+            start = match.start()
+        elif field == 'name' and (current.name is not None or current.amount_text is not None):
+            yield start, current
+            current = Order()
+            start = match.start()
+
+        if '<' in value:
+            value = _drop_edited_markers(value)
+        value = value.strip(_VALUE_STRIP)
+        if field == 'amount':
+            if current.amount_text is None:
+                current.amount_text = value = normalize(value)
+                current.price, current.shipping = parse_amount(value)
+        elif field == 'name':
+            if current.name is None:
+                current.name = value
+        elif field == 'agent':
+            if current.agent is None:
+                current.agent = value
+        elif field == 'phone':
+            if current.phone is None:
+                current.phone = normalize(value)
+        elif field == 'governorate':
+            if current.governorate is None:
+                current.governorate = value
+        elif current.product is None:
+            current.product = value
+
+    if current is not None:
+        yield start, current
+
+
+def message_starts(text, pos=0):
+    """Yield the offsets of lines after pos that start a new WhatsApp message."""
+    for match in _HEADER_HINT_RE.finditer(text, pos):
+        if _HEADER_RE.match(text, match.start('header')):
+            yield match.start() + 1
+
+
+def parse_orders(text):
+    """Return the orders in text that have a positive price."""
+    if not text:
+        return []
+    start = time.perf_counter()
+    records = list(iter_records(text))
+    orders = [order for order in records if order.is_valid]
+    record_parse(len(text), time.perf_counter() - start, len(orders), len(records) - len(orders))
+    return orders
+
+
+def record_parse(size, seconds, parsed, skipped):
+    """Add one parse of size characters to the parser metrics."""
+    metrics.observe('order_parse_seconds', seconds)
+    if size >= 1024:
+        metrics.observe('order_parse_seconds_per_kb', seconds * 1024 / size)
+    metrics.inc('order_parse_bytes_total', size)
+    metrics.inc('orders_parsed_total', parsed)
+    metrics.inc('order_records_skipped_total', skipped)
+
+
+class OrderStream:
+    """
+    Parse text that arrives in pieces, e.g. lines appended to a team file.
+
+    feed() returns the orders known to be complete. The last record is held
+    back in pending while nothing has ended it yet, since its remaining fields
+    may still be on their way; once a message header follows it, it is
+    returned and pending keeps only the text from the last header on. peek()
+    shows what pending would parse to if the text ended here. The *_records
+    variants return every record, including ones without a usable amount.
+    """
+
+    def __init__(self, pending=''):
+        self.pending = pending
+
+    def feed_records(self, chunk):
+        text = self.pending + chunk
+        complete = []
+        last = None
+        last_start = 0
+        for start, record in _iter_records(text):
+            if last is not None:
+                complete.append(last)
+            last, last_start = record, start
+        if last is None:
+            # Nothing order-like yet; only a partial last line can still become one.
+            last_start = text.rfind('\n') + 1
+        else:
+            # A later message header ends the last record, and only the text
+            # from the last header on can still grow into a new one.
+            header_start = None
+            for header_start in message_starts(text, last_start):
+                pass
+            if header_start is not None:
+                complete.append(last)
+                last_start = header_start
+        self.pending = text[last_start:]
+        return complete
+
+    def feed(self, chunk):
+        return [order for order in self.feed_records(chunk) if order.is_valid]
+
+    def peek(self):
+        return parse_orders(self.pending)
+
+    def close_records(self):
+        records = list(iter_records(self.pending))
+        self.pending = ''
+        return records
+
+    def close(self):
+        return [order for order in self.close_records() if order.is_valid]
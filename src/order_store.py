@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytz
+
+from src.metrics import metrics
+
+CAIRO_TZ = pytz.timezone('Africa/Cairo')
+
+# Team keys used by the report, and the spellings the front ends send for them.
+TEAMS = ['A', 'B', 'C', 'C1', 'Follow-up']
+TEAM_ALIASES = {
+    'فولو أب': 'Follow-up',
+    'فولو اب': 'Follow-up',
+    'follow-up': 'Follow-up',
+    'followup': 'Follow-up',
+}
+
+
+def canonical_team(team):
+    """Map "Team A", "A", "فولو أب"... to the key used in the report ("A", "Follow-up")."""
+    team = (team or '').strip()
+    if team.lower().startswith('team '):
+        team = team[5:].strip()
+    return TEAM_ALIASES.get(team.lower(), TEAM_ALIASES.get(team, team))
+
+
+def report_day(now=None):
+    """The Cairo calendar day an order or report belongs to, as YYYY-MM-DD."""
+    now = now or datetime.now(CAIRO_TZ)
+    return now.astimezone(CAIRO_TZ).strftime('%Y-%m-%d')
+
+
+def insert_orders(conn, team, orders, now=None, known=()):
+    """
+    Store one row per parsed order and return the orders that were actually
+    stored. An order whose fingerprint the team already saved the same day is
+    skipped by the unique index, so re-pasted orders are not counted twice.
+    Orders whose fingerprint is in known were stored before, on any day (see
+    PasteCheckpoint.previous), and are skipped too.
+    The daily_team_totals rollup is kept up to date by a trigger, so this is
+    the only write needed.
+    """
+    team = canonical_team(team)
+    now = now or datetime.now(CAIRO_TZ)
+    day = report_day(now)
+    created_at = now.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+    stored = []
+    with metrics.timer('db_insert_seconds'), conn:
+        for order in orders:
+            if known and order.fingerprint in known:
+                continue
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO order_lines '
+                '(team, customer, price, shipping, agent, order_day, created_at, fingerprint) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    team,
+                    order.name,
+                    order.price,
+                    order.shipping,
+                    order.agent,
+                    day,
+                    created_at,
+                    order.fingerprint,
+                ),
+            )
+            if cursor.rowcount == 1:
+                stored.append(order)
+    return stored
+
+
+def daily_team_totals(conn, day=None):
+    """Order count and sales per team for one day, read from the rollup (one row per team)."""
+    with metrics.timer('db_aggregate_seconds'):
+        cursor = conn.execute(
+            'SELECT team, order_count, sales, shipping FROM daily_team_totals WHERE day = ?',
+            (day or report_day(),),
+        )
+        return {
+            team: {'orders': order_count, 'sales': sales, 'shipping': shipping}
+            for team, order_count, sales, shipping in cursor.fetchall()
+        }
+
+
+def clear_orders(conn):
+    """Delete every stored order together with its rollup rows and paste checkpoints."""
+    with conn:
+        conn.execute('DELETE FROM daily_team_totals')
+        conn.execute('DELETE FROM order_lines')
+        conn.execute('DELETE FROM orders')
+        conn.execute('DELETE FROM paste_boundaries')
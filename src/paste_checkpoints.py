@@ -0,0 +1,179 @@
+"""
+Remembers which part of a team's chat paste was already imported.
+
+Team leads keep pasting the same growing WhatsApp chat. For each team the
+start offset of every message in the last paste is stored together with the
+SHA-1 of the text before it (table paste_boundaries, migration 6), plus one
+row for the end of the paste (paste_end, migration 11). A new paste is hashed
+message by message against those digests and the matching prefix is skipped.
+
+A message followed by a matching boundary is unchanged and is not parsed
+again. The last message of the previous paste is only skipped when the new
+paste continues with a new message after it; if text was added to it (it was
+cut off, or its last lines came later) the tail starts at that message
+instead.
+
+Each boundary also keeps the fingerprints of the orders in the message that
+ends there (migration 15). Orders stored from messages that are parsed again
+are known: they aren't stored a second time, even on another day, and the
+ones the new paste no longer has (an amount was edited, a message deleted)
+are removed by save(), so an edit replaces the original order.
+"""
+import hashlib
+from bisect import bisect_right
+
+from src.order_parser import iter_records_at, message_starts
+from src.order_store import canonical_team
+
+
+class PasteCheckpoint:
+    """
+    Compare text with the team's stored boundaries. tail is the part still
+    to be parsed; store its orders with known=previous (see
+    order_store.insert_orders) and call save() once they are stored.
+    """
+
+    def __init__(self, conn, team, text):
+        self.conn = conn
+        self.team = canonical_team(team)
+        self.text = text
+        # The last matching message start; save() continues from there.
+        self.offset = 0
+        self.seq = -1
+        self._hash = hashlib.sha1()
+        # Where tail starts: offset, or the end of the previous paste when
+        # its last message is known to be complete.
+        self._tail_start = 0
+        self._skipped = 0
+        # Fingerprints of the message between offset and the tail when it isn't parsed again.
+        self._kept = ''
+        # Fingerprints of the orders stored from the earlier messages that tail parses again.
+        self.previous = set()
+        # Orders removed by save() because the new paste no longer has them.
+        self.superseded = 0
+
+        # Usual case: the paste only grew, so the whole previous paste matches in one hash.
+        last = conn.execute(
+            'SELECT seq, char_offset, digest, paste_end, fingerprints FROM paste_boundaries WHERE team = ? '
+            'ORDER BY seq DESC LIMIT 2',
+            (self.team,),
+        ).fetchall()
+        if not last:
+            return
+        end = last[0]
+        if end[3] and end[1] <= len(text):
+            # The row before the end one is the start of the paste's last message.
+            start = last[1] if len(last) > 1 else None
+            offset = start[1] if start else 0
+            digest = hashlib.sha1(text[:offset].encode('utf-8'))
+            whole = digest.copy()
+            whole.update(text[offset:end[1]].encode('utf-8'))
+            if whole.hexdigest() == end[2]:
+                if start is not None:
+                    self.seq, self.offset = start[0], start[1]
+                self._hash = digest
+                self._skip_to_end(end[1], end[4])
+                return
+
+        rows = conn.execute(
+            'SELECT seq, char_offset, digest, paste_end, fingerprints FROM paste_boundaries '
+            'WHERE team = ? ORDER BY seq',
+            (self.team,),
+        ).fetchall()
+        digest = hashlib.sha1()
+        pos = 0
+        for seq, char_offset, expected, paste_end, fingerprints in rows:
+            if char_offset > len(text):
+                break
+            digest.update(text[pos:char_offset].encode('utf-8'))
+            pos = char_offset
+            if digest.hexdigest() != expected:
+                break
+            if paste_end:
+                self._skip_to_end(char_offset, fingerprints)
+                return
+            self.offset, self.seq = char_offset, seq
+            self._hash = digest.copy()
+        self._tail_start = self.offset
+        self._skipped = self.seq + 1
+        self.previous = {
+            fingerprint
+            for (fingerprints,) in conn.execute(
+                'SELECT fingerprints FROM paste_boundaries WHERE team = ? AND seq > ?', (self.team, self.seq)
+            )
+            for fingerprint in fingerprints.split()
+        }
+
+    def _skip_to_end(self, end, fingerprints):
+        # The previous paste matched in full. Its last message is complete if
+        # only blank space separates its end from the next message (or the end
+        # of the new text); otherwise text was added to it and it is parsed again.
+        # From end - 1, so a header right at end (after a final newline) is found.
+        next_start = next(message_starts(self.text, max(end - 1, 0)), len(self.text))
+        if self.text[end:next_start].strip():
+            self._tail_start = self.offset
+            self._skipped = self.seq + 1
+            self.previous = set(fingerprints.split())
+        else:
+            self._tail_start = end
+            self._skipped = self.seq + 2
+            self._kept = fingerprints
+
+    @property
+    def tail(self):
+        return self.text[self._tail_start:]
+
+    @property
+    def skipped_messages(self):
+        """Messages before tail that were already imported from an earlier paste."""
+        return self._skipped
+
+    def _message_fingerprints(self, ends):
+        # Fingerprints of tail's orders, grouped by the boundary that ends their message.
+        fingerprints = [[] for _ in ends]
+        for start, record in iter_records_at(self.tail):
+            if record.is_valid:
+                fingerprints[bisect_right(ends, self._tail_start + start)].append(record.fingerprint)
+        if self._tail_start > self.offset:
+            fingerprints[0] = self._kept.split()
+        return [' '.join(group) for group in fingerprints]
+
+    def save(self):
+        """
+        Store the boundaries of every message in text, and its end, for the
+        next paste, and remove the orders of re-parsed messages that text no
+        longer has.
+        """
+        ends = [*message_starts(self.text, self.offset), len(self.text)]
+        fingerprints = self._message_fingerprints(ends)
+        digest = self._hash.copy()
+        pos = self.offset
+        rows = []
+        for index, (end, message_fingerprints) in enumerate(zip(ends, fingerprints)):
+            digest.update(self.text[pos:end].encode('utf-8'))
+            pos = end
+            paste_end = int(index == len(ends) - 1)
+            rows.append((self.team, self.seq + 1 + index, end, digest.hexdigest(), paste_end, message_fingerprints))
+
+        gone = self.previous.difference(*(group.split() for group in fingerprints))
+        if gone:
+            # An order that is also in an unchanged earlier message stays.
+            for (kept,) in self.conn.execute(
+                'SELECT fingerprints FROM paste_boundaries WHERE team = ? AND seq <= ?', (self.team, self.seq)
+            ):
+                gone.difference_update(kept.split())
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM paste_boundaries WHERE team = ? AND seq > ?', (self.team, self.seq)
+            )
+            self.conn.executemany(
+                'INSERT INTO paste_boundaries (team, seq, char_offset, digest, paste_end, fingerprints) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+            self.superseded = sum(
+                self.conn.execute(
+                    'DELETE FROM order_lines WHERE team = ? AND fingerprint = ?', (self.team, fingerprint)
+                ).rowcount
+                for fingerprint in gone
+            )
@@ -0,0 +1,228 @@
+"""
+Request profiling for finding where slow requests spend their time.
+
+ProfilingMiddleware wraps the Flask WSGI app. A PROFILE_SAMPLE_RATE share of
+requests runs under cProfile (one at a time per process). Setting
+PROFILE_SLOW_SECONDS turns on a background thread that samples the Python
+stack of every request in flight every PROFILE_STACK_INTERVAL seconds; the
+samples are kept only if the request took longer than that. It is off by
+default, since it wakes up for every request. Either kind is stored with the
+route, payload size, status and the stage timings recorded through
+metrics.observe() during the request (parse, SQLite, Facebook, LLM),
+including those from the Facebook and LLM pool threads.
+
+Profiles go into the request_profiles table (migration 9), so every worker's
+profiles can be downloaded from any worker; only the newest
+PROFILE_RING_SIZE are kept. Timing ends when the app returns its response,
+so long streaming routes are skipped altogether.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from src.metrics import metrics
+
+# Share of requests profiled with cProfile (0 turns it off).
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+# Requests slower than this keep their stack samples; 0, the default, turns sampling off.
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 0))
+PROFILE_STACK_INTERVAL = float(os.environ.get('PROFILE_STACK_INTERVAL', 0.01))
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', 50))
+# Deeper frames are cut off; enough for Flask plus the app's own code.
+PROFILE_MAX_DEPTH = 64
+
+# SSE and long-poll are slow on purpose, and static files aren't worth it.
+PROFILE_SKIP_PREFIXES = ('/api/live/stream', '/api/live/updates', '/static/', '/metrics', '/admin/')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame):
+    """The stack of frame as 'outer;...;inner', the folded format flame graph tools read."""
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of the watched threads in a background thread."""
+
+    def __init__(self, interval=PROFILE_STACK_INTERVAL):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def watch(self, ident):
+        self._ensure_thread()
+        samples = Counter()
+        with self._lock:
+            self._watched[ident] = samples
+        return samples
+
+    def unwatch(self, ident):
+        with self._lock:
+            self._watched.pop(ident, None)
+
+    def _ensure_thread(self):
+        # Threads don't survive fork(), so each gunicorn worker starts its own sampler.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._watched = {}
+        threading.Thread(target=self._run, daemon=True, name='stack-sampler').start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in watched:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+
+class _LoadedStats:
+    """Lets pstats.Stats read a profile that was stored as marshalled stats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_text(blob, limit=40):
+    """A stored cProfile profile as pstats text, sorted by cumulative time."""
+    out = io.StringIO()
+    stats = pstats.Stats(_LoadedStats(marshal.loads(blob)), stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, db, url_map=None, sample_rate=PROFILE_SAMPLE_RATE,
+                 slow_seconds=PROFILE_SLOW_SECONDS, ring_size=PROFILE_RING_SIZE):
+        self.app = app
+        self.db = db
+        self.url_map = url_map
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.ring_size = ring_size
+        self.sampler = StackSampler()
+        # Only one cProfile may run at a time in a process.
+        self._profiler_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate and self._profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        sampling = self.slow_seconds > 0
+        if path.startswith(PROFILE_SKIP_PREFIXES) or not (profiler or sampling):
+            if profiler is not None:
+                self._profiler_lock.release()
+            return self.app(environ, start_response)
+
+        status = []
+
+        def capture(status_line, headers, exc_info=None):
+            status.append(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        ident = threading.get_ident()
+        samples = self.sampler.watch(ident) if sampling else None
+        start = time.perf_counter()
+        try:
+            with metrics.collect_stages() as stages:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    return self.app(environ, capture)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            seconds = time.perf_counter() - start
+            if samples is not None:
+                self.sampler.unwatch(ident)
+            if profiler is not None:
+                self._profiler_lock.release()
+            slow = sampling and seconds >= self.slow_seconds
+            if profiler is not None or slow:
+                try:
+                    self._record(environ, status[0] if status else None, seconds, stages,
+                                 'slow' if slow else 'sampled', profiler, samples)
+                except Exception as e:
+                    print(f"Error saving request profile: {e}")
+
+    def _route(self, environ):
+        if self.url_map is not None:
+            try:
+                rule, _ = self.url_map.bind_to_environ(environ).match(return_rule=True)
+                return rule.rule
+            except Exception:
+                pass
+        return environ.get('PATH_INFO', '')
+
+    def _record(self, environ, status, seconds, stages, reason, profiler, samples):
+        if profiler is not None:
+            profiler.create_stats()
+            kind, blob = 'cprofile', marshal.dumps(profiler.stats)
+        else:
+            kind = 'stacks'
+            blob = ''.join(f"{stack} {count}\n" for stack, count in samples.most_common()).encode()
+        try:
+            payload_bytes = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            payload_bytes = 0
+        conn = self.db.connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO request_profiles (created_at, method, route, path, status, payload_bytes, '
+                'seconds, reason, kind, stages, profile) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), environ.get('REQUEST_METHOD', ''), self._route(environ),
+                 environ.get('PATH_INFO', ''), status, payload_bytes, seconds, reason, kind,
+                 json.dumps(stages), blob),
+            )
+            conn.execute('DELETE FROM request_profiles WHERE id <= ?', (cursor.lastrowid - self.ring_size,))
+        if reason == 'slow':
+            print(f"Slow request {environ.get('REQUEST_METHOD', '')} {environ.get('PATH_INFO', '')}: {seconds:.2f}s, profile saved")
+
+    def recent(self):
+        """The stored profiles, newest first, without their data."""
+        rows = self.db.connection().execute(
+            'SELECT id, created_at, method, route, path, status, payload_bytes, seconds, reason, kind, stages '
+            'FROM request_profiles ORDER BY id DESC'
+        ).fetchall()
+        return [
+            {'id': row[0], 'created_at': row[1], 'method': row[2], 'route': row[3], 'path': row[4],
+             'status': row[5], 'payload_bytes': row[6], 'seconds': row[7], 'reason': row[8],
+             'kind': row[9], 'stages': json.loads(row[10])}
+            for row in rows
+        ]
+
+    def load(self, profile_id):
+        """(kind, data) of a stored profile, or None if it was dropped from the ring."""
+        row = self.db.connection().execute(
+            'SELECT kind, profile FROM request_profiles WHERE id = ?', (profile_id,)
+        ).fetchone()
+        return None if row is None else (row[0], bytes(row[1]))
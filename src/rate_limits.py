@@ -0,0 +1,155 @@
+"""
+Graph API rate-limit usage per ad account, read from response headers.
+
+Facebook reports how close an app is to its limits in the
+X-Business-Use-Case-Usage, X-Ad-Account-Usage, X-FB-Ads-Insights-Throttle
+and X-App-Usage headers, as percentages of the allowed calls/CPU/time. The
+highest of these is kept as the account's usage. Above RATE_LIMIT_SLOW_PCT
+spend refreshes for the account are spaced out; at RATE_LIMIT_STOP_PCT, or
+after a throttling error, the account is not called again until Facebook's
+estimated time to regain access (or RATE_LIMIT_BACKOFF) has passed. During
+that time reports use the last cached spend.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+RATE_LIMIT_SLOW_PCT = float(os.environ.get('RATE_LIMIT_SLOW_PCT', 75))
+RATE_LIMIT_STOP_PCT = float(os.environ.get('RATE_LIMIT_STOP_PCT', 95))
+# Seconds an account is left alone after a throttling error that gave no regain time.
+RATE_LIMIT_BACKOFF = float(os.environ.get('RATE_LIMIT_BACKOFF', 300))
+# Readings older than this are forgotten; Facebook's usage windows roll over within an hour.
+RATE_LIMIT_READING_TTL = float(os.environ.get('RATE_LIMIT_READING_TTL', 900))
+# At the stop threshold the spend cache TTL is stretched this many times.
+RATE_LIMIT_MAX_SLOWDOWN = float(os.environ.get('RATE_LIMIT_MAX_SLOWDOWN', 6))
+
+# Graph API error codes for rate limiting: app, user, page, custom and Ads API limits.
+THROTTLE_ERROR_CODES = {4, 17, 32, 613, 80000, 80003, 80004, 80014}
+
+_ACCOUNT_RE = re.compile(r'/(act_\d+)')
+
+
+def _header_json(headers, name):
+    value = headers.get(name)
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def parse_usage_headers(headers):
+    """
+    Return (usage percent, seconds until access is regained) from a response's
+    headers, or None if they carry no usage information. headers is a mapping
+    or a Graph API batch-style list of {"name": ..., "value": ...}.
+    """
+    if isinstance(headers, list):
+        headers = {header.get('name', ''): header.get('value') for header in headers}
+    headers = {str(name).lower(): value for name, value in headers.items()}
+
+    readings = []
+    regain = 0.0
+
+    business = _header_json(headers, 'x-business-use-case-usage')
+    if isinstance(business, dict):
+        for entries in business.values():
+            for entry in entries if isinstance(entries, list) else []:
+                readings.extend(float(entry.get(field, 0) or 0) for field in ('call_count', 'total_cputime', 'total_time'))
+                regain = max(regain, float(entry.get('estimated_time_to_regain_access', 0) or 0) * 60)
+
+    account = _header_json(headers, 'x-ad-account-usage')
+    if isinstance(account, dict):
+        pct = float(account.get('acc_id_util_pct', 0) or 0)
+        readings.append(pct)
+        if pct >= 100:
+            regain = max(regain, float(account.get('reset_time_duration', 0) or 0))
+
+    insights = _header_json(headers, 'x-fb-ads-insights-throttle')
+    if isinstance(insights, dict):
+        readings.extend(float(insights.get(field, 0) or 0) for field in ('app_id_util_pct', 'acc_id_util_pct'))
+
+    app = _header_json(headers, 'x-app-usage')
+    if isinstance(app, dict):
+        readings.extend(float(app.get(field, 0) or 0) for field in ('call_count', 'total_cputime', 'total_time'))
+
+    if not readings and not regain:
+        return None
+    return max(readings, default=0.0), regain
+
+
+def is_throttle_error(error):
+    """True for a FacebookRequestError caused by rate limiting."""
+    code = getattr(error, 'api_error_code', None)
+    return callable(code) and code() in THROTTLE_ERROR_CODES
+
+
+class UsageModel:
+    """Latest rate-limit usage and back-off deadline of each ad account."""
+
+    def __init__(self):
+        self._usage = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def record(self, account_id, headers):
+        """Update account_id's usage from a response's headers."""
+        parsed = parse_usage_headers(headers)
+        if parsed is None:
+            return
+        pct, regain = parsed
+        now = time.time()
+        with self._lock:
+            self._usage[account_id] = (pct, now)
+            if regain or pct >= RATE_LIMIT_STOP_PCT:
+                self._blocked_until[account_id] = max(
+                    self._blocked_until.get(account_id, 0), now + (regain or RATE_LIMIT_BACKOFF)
+                )
+        if pct >= RATE_LIMIT_SLOW_PCT:
+            print(f"Graph API usage for {account_id} at {pct:.0f}%")
+
+    def record_response(self, response, *args, **kwargs):
+        """requests response hook: record usage for the ad account in the URL."""
+        match = _ACCOUNT_RE.search(response.request.path_url or '')
+        if match:
+            self.record(match.group(1), response.headers)
+
+    def record_throttled(self, account_id, retry_after=None):
+        """Leave account_id alone for a while after Facebook refused a call."""
+        with self._lock:
+            self._blocked_until[account_id] = time.time() + (retry_after or RATE_LIMIT_BACKOFF)
+        print(f"Graph API throttled {account_id}, backing off")
+
+    def usage(self, account_id):
+        """Last known usage percent, or 0 if unknown or too old."""
+        with self._lock:
+            reading = self._usage.get(account_id)
+        if reading is None or time.time() - reading[1] > RATE_LIMIT_READING_TTL:
+            return 0.0
+        return reading[0]
+
+    def blocked_for(self, account_id):
+        """Seconds until account_id may be called again (0 if it may be called now)."""
+        with self._lock:
+            until = self._blocked_until.get(account_id, 0)
+        return max(0.0, until - time.time())
+
+    def ttl_factor(self, account_id):
+        """How many times longer than usual cached spend for account_id should be kept."""
+        pct = self.usage(account_id)
+        if pct <= RATE_LIMIT_SLOW_PCT:
+            return 1.0
+        share = min(1.0, (pct - RATE_LIMIT_SLOW_PCT) / max(1.0, RATE_LIMIT_STOP_PCT - RATE_LIMIT_SLOW_PCT))
+        return 1.0 + share * (RATE_LIMIT_MAX_SLOWDOWN - 1.0)
+
+    def clear(self):
+        with self._lock:
+            self._usage.clear()
+            self._blocked_until.clear()
+
+
+# Shared by the API pool's response hook, the fetchers and the spend cache.
+usage_model = UsageModel()
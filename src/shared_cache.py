@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+
+class SharedCache:
+    """
+    JSON key/value cache stored in the app's SQLite file (tables from migration 3),
+    so every gunicorn worker on the dyno sees the same entries.
+
+    Refresh locks make sure only one worker recomputes a key at a time: a lock
+    is a row in cache_refresh_locks that expires on its own if its holder dies.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _owner():
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def get(self, key):
+        """Return (value, stored_at) for key, or None if it was never stored."""
+        row = self.db.connection().execute(
+            'SELECT value, stored_at FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at=None):
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO cache_entries (key, value, stored_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, stored_at = excluded.stored_at',
+                (key, json.dumps(value, ensure_ascii=False), stored_at or time.time()),
+            )
+
+    def delete(self, key):
+        conn = self.db.connection()
+        with conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def acquire(self, key, timeout):
+        """
+        Try to become the worker refreshing key. Returns False straight away if
+        another worker holds an unexpired lock; the lock lapses after timeout
+        seconds in case its holder never releases it.
+        """
+        now = time.time()
+        conn = self.db.connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO cache_refresh_locks (key, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE cache_refresh_locks.expires_at < ?',
+                (key, self._owner(), now + timeout, now),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                'DELETE FROM cache_refresh_locks WHERE key = ? AND owner = ?',
+                (key, self._owner()),
+            )
+
+    def is_locked(self, key):
+        row = self.db.connection().execute(
+            'SELECT 1 FROM cache_refresh_locks WHERE key = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def wait_for(self, key, newer_than, timeout, interval=0.2):
+        """
+        Poll until key has an entry stored after newer_than (a time.time() value),
+        as written by the worker holding its refresh lock. Returns (value,
+        stored_at), or None if the lock was released without a new entry or
+        nothing arrived within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # Check the lock first: its holder stores the entry before releasing it.
+            locked = self.is_locked(key)
+            entry = self.get(key)
+            if entry is not None and entry[1] > newer_than:
+                return entry
+            if not locked or time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
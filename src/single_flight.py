@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+# How long a caller waits for another worker's computation before running it itself.
+FLIGHT_TIMEOUT = float(os.environ.get('REPORT_FLIGHT_TIMEOUT', 30))
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: while fn is running for a key, other
+    callers with the same key wait and get the same result (or exception)
+    instead of running fn again.
+
+    With shared set to a SharedCache the coalescing also spans gunicorn
+    workers: one worker runs fn under the key's refresh lock and stores the
+    result, which must be JSON serialisable, for the others to pick up. The
+    result is stored under key itself and stays there, so it doubles as the
+    last good result for callers that want one (e.g. after fn fails).
+    """
+
+    def __init__(self, shared=None, timeout=FLIGHT_TIMEOUT):
+        self.shared = shared
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn):
+        if self.shared is None:
+            return fn()
+
+        started = time.time()
+        if not self.shared.acquire(key, self.timeout):
+            entry = self.shared.wait_for(key, started, self.timeout)
+            if entry is not None:
+                return entry[0]
+            # The other worker failed or is stuck; compute it here instead.
+            return fn()
+        try:
+            result = fn()
+            self.shared.set(key, result)
+            return result
+        finally:
+            self.shared.release(key)
@@ -0,0 +1,228 @@
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import metrics
+
+# Spend younger than SPEND_CACHE_TTL seconds is served as is. Older spend is
+# still served straight away while one background refresh runs, up to
+# SPEND_CACHE_MAX_STALE seconds; past that a report waits for fresh numbers.
+SPEND_CACHE_TTL = float(os.environ.get('SPEND_CACHE_TTL', 300))
+SPEND_CACHE_MAX_STALE = float(os.environ.get('SPEND_CACHE_MAX_STALE', 3600))
+# How long a worker may hold the refresh lock for an account before others give up waiting.
+SPEND_CACHE_LOCK_TIMEOUT = float(os.environ.get('SPEND_CACHE_LOCK_TIMEOUT', 30))
+# Background refreshes run on this many threads per process; more stale hits queue up.
+SPEND_CACHE_REFRESH_WORKERS = int(os.environ.get('SPEND_CACHE_REFRESH_WORKERS', 2))
+
+_refresh_executor = None
+_refresh_executor_pid = None
+_refresh_executor_lock = threading.Lock()
+
+
+def _get_refresh_executor():
+    # One pool for every cache in the process; threads don't survive fork(),
+    # so each gunicorn worker starts its own.
+    global _refresh_executor, _refresh_executor_pid
+    with _refresh_executor_lock:
+        if _refresh_executor is None or _refresh_executor_pid != os.getpid():
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=max(1, SPEND_CACHE_REFRESH_WORKERS), thread_name_prefix='spend-refresh'
+            )
+            _refresh_executor_pid = os.getpid()
+        return _refresh_executor
+
+
+class SpendCache:
+    """
+    Cache of ad account spend keyed by (account_id, since, until), with
+    stale-while-revalidate refreshes.
+
+    Entries live in process memory. When shared is set to a SharedCache they
+    are also written there, so other gunicorn workers reuse them, and only the
+    worker holding an account's refresh lock calls Facebook for it.
+
+    throttle, when set, is a rate_limits.UsageModel: accounts close to their
+    rate limit are refreshed less often, and an account that can't be fetched
+    (throttled or failing) is served from its last entry however old.
+
+    on_update, when set, is called as on_update(accounts, {team: spend}) with
+    the teams whose spend changed after each fetch, including background refreshes.
+    """
+
+    def __init__(self, ttl=SPEND_CACHE_TTL, max_stale=SPEND_CACHE_MAX_STALE,
+                 shared=None, lock_timeout=SPEND_CACHE_LOCK_TIMEOUT, throttle=None):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.shared = shared
+        self.lock_timeout = lock_timeout
+        self.throttle = throttle
+        self.on_update = None
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shared_key(account_id, since, until):
+        return f"spend:{account_id}:{since}:{until}"
+
+    def get_many(self, accounts, since, until, fetch, timeout=None):
+        """
+        Return ({team: spend}, {team: age in seconds}) for accounts, which maps a
+        team to (account_id, access_token).
+
+        fetch(accounts, since, until) -> {team: spend} is called synchronously
+        for teams with no usable entry, and on the refresh pool for teams
+        whose entry is stale. Teams fetch() leaves out are missing from the result,
+        unless throttle is set and an older entry can stand in for them.
+
+        timeout, if given, caps how long this call may wait for those
+        synchronous fetches; it is passed on to fetch() as deadline.
+        """
+        with self._lock:
+            entries = {
+                team: self._entries.get((account_id, since, until))
+                for team, (account_id, _) in accounts.items()
+            }
+
+        now = time.time()
+        if self.shared is not None:
+            # Another worker may already have fetched what this one is missing.
+            for team, entry in entries.items():
+                if entry is None or now - entry[1] > self.ttl:
+                    shared_entry = self.shared.get(self._shared_key(accounts[team][0], since, until))
+                    if shared_entry is not None and (entry is None or shared_entry[1] > entry[1]):
+                        entries[team] = shared_entry
+                        with self._lock:
+                            self._entries[(accounts[team][0], since, until)] = shared_entry
+
+        spend_by_team = {}
+        ages = {}
+        missing = {}
+        stale = {}
+        with self._lock:
+            for team, entry in entries.items():
+                account_id, access_token = accounts[team]
+                age = now - entry[1] if entry else None
+                ttl = self.ttl
+                if self.throttle is not None:
+                    if entry is not None and self.throttle.blocked_for(account_id):
+                        # Rate limited: keep serving what we have, however old.
+                        spend_by_team[team] = entry[0]
+                        ages[team] = age
+                        continue
+                    ttl *= self.throttle.ttl_factor(account_id)
+                if entry is None or age > max(self.max_stale, ttl):
+                    missing[team] = (account_id, access_token)
+                    continue
+                spend_by_team[team] = entry[0]
+                ages[team] = age
+                key = (account_id, since, until)
+                if age > ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    stale[team] = (account_id, access_token)
+
+        served = len(spend_by_team)
+        if stale:
+            # _refreshing keeps an account from being queued again until its refresh ends.
+            _get_refresh_executor().submit(self._refresh, stale, since, until, fetch)
+        metrics.inc('spend_cache_lookups_total', len(stale), result='stale')
+        metrics.inc('spend_cache_lookups_total', served - len(stale), result='fresh')
+        metrics.inc('spend_cache_lookups_total', len(missing), result='miss')
+
+        if missing:
+            fetched = self._fetch(missing, since, until, fetch, wait=True, timeout=timeout)
+            for team, (spend, fetched_at) in fetched.items():
+                spend_by_team[team] = spend
+                ages[team] = max(0.0, time.time() - fetched_at)
+            if self.throttle is not None:
+                # Fall back to the last known spend rather than leaving the team out.
+                for team in missing.keys() - fetched.keys():
+                    if entries[team] is not None:
+                        spend_by_team[team] = entries[team][0]
+                        ages[team] = time.time() - entries[team][1]
+                        metrics.inc('spend_cache_lookups_total', result='fallback')
+
+        return spend_by_team, ages
+
+    def _fetch(self, accounts, since, until, fetch, wait, timeout=None):
+        """
+        Fetch spend for the accounts this worker gets the refresh lock for.
+        With wait=True, accounts another worker is refreshing are read from the
+        shared cache once that worker stores them; otherwise they are skipped.
+        Returns {team: (spend, fetched_at)}.
+        """
+        if timeout is not None:
+            fetch = functools.partial(fetch, deadline=timeout)
+        if self.shared is None:
+            return self._store(accounts, since, until, fetch(accounts, since, until))
+
+        started = time.time()
+        mine = {}
+        others = {}
+        for team, (account_id, access_token) in accounts.items():
+            key = self._shared_key(account_id, since, until)
+            if self.shared.acquire(key, self.lock_timeout):
+                mine[team] = (account_id, access_token)
+            else:
+                others[team] = (account_id, access_token)
+
+        entries = {}
+        try:
+            if mine:
+                entries.update(self._store(mine, since, until, fetch(mine, since, until)))
+        finally:
+            for account_id, _ in mine.values():
+                self.shared.release(self._shared_key(account_id, since, until))
+
+        if wait:
+            limit = self.lock_timeout if timeout is None else min(self.lock_timeout, timeout)
+            for team, (account_id, _) in others.items():
+                remaining = limit - (time.time() - started)
+                entry = self.shared.wait_for(
+                    self._shared_key(account_id, since, until), started - self.max_stale, max(0.0, remaining)
+                )
+                if entry is None:
+                    print(f"Gave up waiting for another worker to fetch spend for {team} ({account_id})")
+                    continue
+                entries[team] = entry
+                with self._lock:
+                    self._entries[(account_id, since, until)] = entry
+        return entries
+
+    def _store(self, accounts, since, until, fetched):
+        fetched_at = time.time()
+        entries = {}
+        changed = {}
+        with self._lock:
+            for team, spend in fetched.items():
+                key = (accounts[team][0], since, until)
+                previous = self._entries.get(key)
+                if previous is None or previous[0] != spend:
+                    changed[team] = spend
+                entries[team] = (spend, fetched_at)
+                self._entries[key] = entries[team]
+        if self.shared is not None:
+            for team, entry in entries.items():
+                self.shared.set(self._shared_key(accounts[team][0], since, until), entry[0], stored_at=fetched_at)
+        if changed and self.on_update is not None:
+            try:
+                self.on_update(accounts, changed)
+            except Exception as e:
+                print(f"Error publishing spend update: {e}")
+        return entries
+
+    def _refresh(self, accounts, since, until, fetch):
+        try:
+            self._fetch(accounts, since, until, fetch, wait=False)
+        except Exception as e:
+            print(f"Error refreshing cached spend: {e}")
+        finally:
+            with self._lock:
+                for account_id, _ in accounts.values():
+                    self._refreshing.discard((account_id, since, until))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
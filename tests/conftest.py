@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# src.main opens its database on import; keep it away from the app's own file.
+os.environ.setdefault('ORDERS_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='orders-test-'), 'orders.db'))
+
+from src.db import ConnectionManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = ConnectionManager(str(tmp_path / 'orders.db'))
+    yield manager
+    manager.close_all()
+
+
+@pytest.fixture
+def conn(db):
+    return db.connection()
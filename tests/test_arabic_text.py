@@ -0,0 +1,35 @@
+import re
+
+from src.arabic_text import fold_alternation, normalize
+from src.order_parser import iter_records
+
+
+def test_normalize_folds_spelling_variants_marks_and_digits():
+    assert normalize('الأسم') == 'الاسم'
+    assert normalize('الإيچينت') == 'الايجينت'
+    assert normalize('المحافظة') == 'المحافظه'
+    assert normalize('مصطفى') == 'مصطفي'
+    assert normalize('المبـــلغ') == 'المبلغ'
+    assert normalize('‏17‏/7‏/2025') == '17/7/2025'
+    assert normalize('١٬٢٥٠٫٥ + ٧٥') == '1,250.5 + 75'
+    assert normalize('۱۲۳') == '123'
+    assert normalize('رقم التليفون：') == 'رقم التليفون:'
+
+
+def test_normalize_returns_text_without_variants_as_is():
+    for text in ('01068483812', '1890+ 75م.ش', 'محمد سعد'):
+        assert normalize(text) is text
+
+
+def test_fold_alternation_matches_every_spelling_of_a_word():
+    pattern = re.compile('(?:' + fold_alternation(['الاسم', 'اسم', 'الايجنت']) + r')\Z')
+    for spelling in ('الاسم', 'الأسم', 'الإسم', 'الاســم', 'اسم', 'أسم', 'الإيچنت', 'الايجنت'):
+        assert pattern.match(spelling), spelling
+    for other in ('الاسماء', 'سم', 'الا سم', 'الايجينت'):
+        assert not pattern.match(other), other
+
+
+def test_orders_with_arabic_indic_digits_are_parsed():
+    (order,) = iter_records('الأسم : منى سعد\nالمبلـغ : ١٬٢٥٠ + ٧٠ شحن\nالإيچينت : ندى\n')
+    assert (order.name, order.price, order.shipping, order.agent) == ('منى سعد', 1250.0, 70.0, 'ندى')
+    assert order.amount_text == '1,250 + 70 شحن'
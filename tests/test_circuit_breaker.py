@@ -0,0 +1,75 @@
+import pytest
+
+from src import circuit_breaker
+from src.circuit_breaker import Budget, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failures=3, cooldown=60)
+    for _ in range(2):
+        breaker.failure('act_1')
+    assert breaker.allow('act_1')
+    breaker.failure('act_1')
+    assert breaker.is_open('act_1')
+    assert not breaker.allow('act_1')
+    assert breaker.allow('act_2')
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('test', failures=2, cooldown=60)
+    breaker.failure('act_1')
+    breaker.success('act_1')
+    breaker.failure('act_1')
+    assert not breaker.is_open('act_1')
+
+
+def test_one_trial_call_after_cooldown(clock):
+    breaker = CircuitBreaker('test', failures=1, cooldown=60)
+    breaker.failure('act_1')
+    clock.now += 59
+    assert not breaker.allow('act_1')
+    clock.now += 1
+    assert breaker.allow('act_1')
+    # Other callers wait while the trial is running.
+    assert not breaker.allow('act_1')
+    breaker.success('act_1')
+    assert not breaker.is_open('act_1')
+    assert breaker.allow('act_1')
+
+
+def test_failed_trial_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker('test', failures=1, cooldown=60)
+    breaker.failure('act_1')
+    clock.now += 60
+    assert breaker.allow('act_1')
+    breaker.failure('act_1')
+    clock.now += 30
+    assert not breaker.allow('act_1')
+    clock.now += 30
+    assert breaker.allow('act_1')
+
+
+def test_budget_cuts_call_timeouts(clock):
+    budget = Budget(10)
+    assert budget.timeout(4) == 4
+    clock.now += 8
+    assert budget.timeout(4) == 2
+    assert not budget.expired
+    clock.now += 3
+    assert budget.timeout(4) == 0
+    assert budget.expired
@@ -0,0 +1,61 @@
+import os
+
+import src.config as config
+from src.config import ConfigFile, get_config, parse_pairs
+
+
+def write(path, text, mtime_ns):
+    path.write_text(text, encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_file_is_read_again_only_when_its_mtime_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CONFIG_STAT_INTERVAL', 0)
+    path = tmp_path / 'ad_account_ids.txt'
+    write(path, 'Team A: act_1\n', 1_000_000_000)
+    reads = []
+    file = ConfigFile(str(path), lambda text: reads.append(text) or parse_pairs(text), {})
+    assert file.get() == {'Team A': 'act_1'}
+    assert file.get() == {'Team A': 'act_1'}
+    assert len(reads) == 1
+
+    write(path, 'Team A: act_2\n', 2_000_000_000)
+    assert file.get() == {'Team A': 'act_2'}
+    assert len(reads) == 2
+
+    path.unlink()
+    assert file.get() == {}
+
+
+def test_file_is_not_stat_ed_within_the_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CONFIG_STAT_INTERVAL', 3600)
+    path = tmp_path / 'facebook_access_token.txt'
+    write(path, 'old\n', 1_000_000_000)
+    file = ConfigFile(str(path), str.strip)
+    assert file.get() == 'old'
+    write(path, 'new\n', 2_000_000_000)
+    assert file.get() == 'old'
+
+
+def test_bad_file_keeps_the_last_good_value(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CONFIG_STAT_INTERVAL', 0)
+    path = tmp_path / 'team_businesses.txt'
+    write(path, '1', 1_000_000_000)
+    file = ConfigFile(str(path), int)
+    assert file.get() == 1
+    write(path, 'x', 2_000_000_000)
+    assert file.get() == 1
+    write(path, '3', 3_000_000_000)
+    assert file.get() == 3
+
+
+def test_registry_is_shared_and_maps_teams_to_their_business_token(tmp_path):
+    write(tmp_path / 'ad_account_ids.txt', 'Team A: act_1\nTeam C1: act_2\n', 1_000_000_000)
+    write(tmp_path / 'facebook_access_tokens.txt', 'Business2: token-2\n', 1_000_000_000)
+    write(tmp_path / 'facebook_access_token.txt', 'token-1\n', 1_000_000_000)
+    registry = get_config(str(tmp_path))
+    assert get_config(str(tmp_path / '.')) is registry
+    assert registry.team_accounts(['Team A', 'C1', 'Team B']) == {
+        'Team A': ('act_1', 'token-1'),
+        'C1': ('act_2', 'token-2'),
+    }
@@ -0,0 +1,104 @@
+import gc
+import sqlite3
+import threading
+
+from src.db import MIGRATIONS, ConnectionManager
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def test_fresh_database_reaches_latest_version(conn):
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'orders', 'order_lines', 'daily_team_totals', 'cache_entries', 'import_jobs',
+            'paste_boundaries', 'metric_snapshots'} <= tables
+    assert 'fingerprint' in columns(conn, 'order_lines')
+    assert 'duplicates_skipped' in columns(conn, 'import_jobs')
+    assert 'paste_end' in columns(conn, 'paste_boundaries')
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_order_lines_team_day_fingerprint' in indexes
+    assert 'idx_order_lines_day_fingerprint' not in indexes
+
+
+def test_migration_versions_are_increasing():
+    versions = [version for version, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_migrate_is_safe_to_repeat(tmp_path):
+    path = str(tmp_path / 'orders.db')
+    first = ConnectionManager(path)
+    first.migrate()
+    first.close_all()
+    # A second process (or a restart) runs migrate() on the migrated file.
+    second = ConnectionManager(path)
+    second.migrate()
+    second.migrate()
+    conn = second.connection()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]
+    second.close_all()
+
+
+def test_old_database_is_upgraded(tmp_path):
+    path = str(tmp_path / 'orders.db')
+    raw = sqlite3.connect(path)
+    raw.executescript(MIGRATIONS[0][1])
+    raw.execute("INSERT INTO orders (team, order_count) VALUES ('A', 3)")
+    raw.execute('PRAGMA user_version = 1')
+    raw.commit()
+    raw.close()
+
+    manager = ConnectionManager(path)
+    conn = manager.connection()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]
+    assert conn.execute('SELECT team, order_count FROM orders').fetchall() == [('A', 3)]
+    manager.close_all()
+
+
+def test_connection_is_closed_when_its_thread_exits(db):
+    db.connection()
+
+    def use():
+        db.connection().execute('SELECT 1')
+
+    threads = [threading.Thread(target=use) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+    assert len(db._connections) == 1
+
+
+def test_each_thread_keeps_its_own_connection(db):
+    conn = db.connection()
+    assert db.connection() is conn
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_legacy_order_counts_are_backfilled(tmp_path):
+    path = str(tmp_path / 'orders.db')
+    raw = sqlite3.connect(path)
+    raw.executescript(MIGRATIONS[0][1])
+    raw.executemany('INSERT INTO orders (team, order_count, timestamp) VALUES (?, ?, ?)', [
+        ('Team A', 3, '2025-07-17 10:00:00'),
+        # 22:30 UTC is already the next day in Cairo (UTC+3 in July).
+        ('A', 2, '2025-07-17 22:30:00'),
+        ('فولو أب', 1, '2025-01-05 09:00:00'),
+    ])
+    raw.execute('PRAGMA user_version = 1')
+    raw.commit()
+    raw.close()
+
+    manager = ConnectionManager(path)
+    conn = manager.connection()
+    totals = conn.execute('SELECT day, team, order_count, sales FROM daily_team_totals ORDER BY day, team').fetchall()
+    assert totals == [('2025-01-05', 'Follow-up', 1, 0.0), ('2025-07-17', 'A', 3, 0.0), ('2025-07-18', 'A', 2, 0.0)]
+    assert conn.execute('SELECT COUNT(*) FROM order_lines').fetchone()[0] == 6
+    manager.close_all()
@@ -0,0 +1,69 @@
+import json
+
+from src.graph_replay import GraphReplay, request_key
+
+INSIGHTS = ('https://graph.facebook.com/v19.0/act_1/insights?fields=spend'
+            '&time_range=%7B%22since%22%3A%222025-07-17%22%2C%22until%22%3A%222025-07-19%22%7D')
+
+
+def pages(replay, url):
+    """Every page's body, following the 'after' cursor the way the SDK does."""
+    bodies = []
+    after = None
+    while True:
+        status, _, body = replay.answer(request_key('GET', url + (f'&after={after}' if after else '')))
+        assert status == 200
+        bodies.append(body)
+        if 'next' not in body.get('paging', {}):
+            return bodies
+        after = body['paging']['cursors']['after']
+
+
+def spend(bodies):
+    return round(sum(float(row['spend']) for body in bodies for row in body['data']), 2)
+
+
+def test_made_up_insights_are_split_into_pages(tmp_path):
+    single = GraphReplay(path=str(tmp_path / 'none.json'))
+    paged = GraphReplay(path=str(tmp_path / 'none.json'), pages=3)
+    whole = pages(single, INSIGHTS)
+    assert len(whole) == 1 and len(whole[0]['data']) == 3
+    split = pages(paged, INSIGHTS)
+    assert [len(body['data']) for body in split] == [1, 1, 1]
+    assert spend(split) == spend(whole)
+
+
+def test_single_day_still_goes_through_paging(tmp_path):
+    url = INSIGHTS.replace('2025-07-19', '2025-07-17')
+    replay = GraphReplay(path=str(tmp_path / 'none.json'), pages=2)
+    first = replay.answer(request_key('GET', url))[2]
+    assert len(first['data']) == 1
+    assert first['paging']['next']
+    assert replay.answer(request_key('GET', url + '&after=1'))[2]['data'] == []
+
+
+def test_later_pages_of_a_recording(tmp_path):
+    path = tmp_path / 'recorded.json'
+    rows = [{'spend': '1.00'}, {'spend': '2.00'}, {'spend': '3.50'}]
+    path.write_text(json.dumps({request_key('GET', INSIGHTS): {'status': 200, 'headers': {}, 'body': {'data': rows}}}))
+    replay = GraphReplay(path=str(path), pages=2)
+    bodies = pages(replay, INSIGHTS)
+    assert [body['data'] for body in bodies] == [rows[:2], rows[2:]]
+
+
+def test_unrecorded_key_is_reported_once(tmp_path, capsys):
+    replay = GraphReplay(path=str(tmp_path / 'none.json'))
+    key = request_key('GET', 'https://graph.facebook.com/v19.0/me/adaccounts')
+    for _ in range(5):
+        assert replay.answer(key)[0] == 400
+    assert capsys.readouterr().out.count('nothing recorded') == 1
+
+
+def test_faults_are_the_same_for_the_same_seed(tmp_path):
+    def statuses():
+        replay = GraphReplay(path=str(tmp_path / 'none.json'), error_rate=0.3, throttle_rate=0.2)
+        return [replay.answer(request_key('GET', INSIGHTS))[0] for _ in range(50)]
+
+    first = statuses()
+    assert first == statuses()
+    assert {200, 400, 500} <= set(first)
@@ -0,0 +1,71 @@
+import time
+
+from benchmarks.whatsapp_export import generate_export
+from src import main
+from src.import_jobs import STALE_JOB_ERROR, ImportJobs
+
+
+def wait_until_finished(jobs, job_id):
+    deadline = time.monotonic() + 5
+    while True:
+        job = jobs.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.02)
+
+
+def test_job_imports_in_the_background_and_reports_its_counts(db):
+    done = []
+    jobs = ImportJobs(db, on_done=done.append)
+    text, expected = generate_export(200, seed=6)
+    job_id = jobs.submit('A', text)
+    assert jobs.get(job_id)['status'] in ('queued', 'running', 'done')
+
+    job = wait_until_finished(jobs, job_id)
+    assert job['status'] == 'done' and job['error'] is None
+    assert job['orders_saved'] == len(expected)
+    assert job['total_sales'] == sum(order.price for order in expected)
+    assert job['blocks_parsed'] == len(expected) + job['rejected_count']
+    assert all(block['price'] == 0 for block in job['rejected'])
+    assert done == ['A']
+
+
+def test_pasting_the_same_chat_again_saves_nothing_new(db):
+    done = []
+    jobs = ImportJobs(db, on_done=done.append)
+    text, expected = generate_export(100, seed=7)
+    wait_until_finished(jobs, jobs.submit('B', text))
+    job = wait_until_finished(jobs, jobs.submit('B', text))
+    assert job['status'] == 'done'
+    assert job['orders_saved'] == 0
+    assert done == ['B']
+
+
+def test_job_whose_worker_died_is_marked_failed(db):
+    jobs = ImportJobs(db)
+    conn = db.connection()
+    long_ago = time.time() - 3600
+    with conn:
+        conn.execute(
+            "INSERT INTO import_jobs (id, team, status, created_at, updated_at) VALUES ('lost', 'A', 'running', ?, ?)",
+            (long_ago, long_ago),
+        )
+    job = jobs.get('lost')
+    assert job['status'] == 'failed'
+    assert job['error'] == STALE_JOB_ERROR
+    assert jobs.get('missing') is None
+
+
+def test_routes_queue_a_job_and_report_its_status():
+    client = main.app.test_client()
+    text = ("[17/07/2025, 10:00:00] روان: الاسم : يوسف النجار\n"
+            "المبلغ : 1450 + 70\n"
+            "الايچينت : روان\n")
+    response = client.post('/api/import_jobs', json={'team': 'Team C', 'orders': text})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    job = wait_until_finished(main.import_jobs, job_id)
+    assert client.get(f'/api/import_jobs/{job_id}').get_json()['orders_saved'] == job['orders_saved'] == 1
+    assert client.get('/api/import_jobs/unknown').status_code == 404
+    assert client.post('/api/import_jobs', json={'team': 'Team Z', 'orders': text}).status_code == 400
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from src import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, 'LIVE_STREAM_DURATION', 0.2)
+    return main.app.test_client()
+
+
+def test_stream_starts_with_a_snapshot(client):
+    main.live_updates.publish('A', {'orders': 3})
+    body = client.get('/api/live/stream').get_data(as_text=True)
+    assert 'event: snapshot' in body
+    assert '"A": {"orders": 3}' in body
+
+
+def test_stream_resumes_after_last_event_id(client, monkeypatch):
+    # Long enough for the worker's poller (LIVE_POLL_INTERVAL) to see the event.
+    monkeypatch.setattr(main, 'LIVE_STREAM_DURATION', 2)
+    _, last_id = main.live_updates.snapshot()
+    main.live_updates.publish('B', {'sales': 950.0})
+    body = client.get('/api/live/stream', headers={'Last-Event-ID': str(last_id)}).get_data(as_text=True)
+    assert 'event: snapshot' not in body
+    assert f"id: {last_id + 1}\nevent: team" in body
+
+
+@pytest.mark.parametrize('last_id', ['abc', '-1', '1.5'])
+def test_stream_rejects_a_bad_resume_id(client, last_id):
+    assert client.get('/api/live/stream', headers={'Last-Event-ID': last_id}).status_code == 400
+    assert client.get(f'/api/live/stream?after={last_id}').status_code == 400
+
+
+def test_full_stream_slots_send_the_fallback_event(client, monkeypatch):
+    monkeypatch.setattr(main, 'live_stream_slots', threading.BoundedSemaphore(1))
+    main.live_stream_slots.acquire()
+    body = client.get('/api/live/stream').get_data(as_text=True)
+    assert body == 'event: fallback\ndata: {}\n\n'
+
+
+def test_poll_returns_new_events(client):
+    _, last_id = main.live_updates.snapshot()
+    main.live_updates.publish('C', {'orders': 1})
+    data = client.get(f'/api/live/updates?after={last_id}&timeout=5').get_json()
+    assert [event['team'] for event in data['events']] == ['C']
+    assert data['last_id'] == last_id + 1
+
+
+def test_poll_times_out_with_no_events(client):
+    _, last_id = main.live_updates.snapshot()
+    data = client.get(f'/api/live/updates?after={last_id}&timeout=0').get_json()
+    assert data == {'events': [], 'last_id': last_id}
+
+
+@pytest.mark.parametrize('query', ['after=abc', 'after=-1', 'timeout=x', 'timeout=-1', 'timeout=nan', 'timeout=inf'])
+def test_poll_rejects_bad_arguments(client, query):
+    assert client.get(f'/api/live/updates?{query}').status_code == 400
+
+
+def test_full_poll_slots_answer_503(client, monkeypatch):
+    monkeypatch.setattr(main, 'live_poll_slots', threading.BoundedSemaphore(1))
+    main.live_poll_slots.acquire()
+    response = client.get('/api/live/updates?timeout=0')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(main.LIVE_POLL_RETRY_AFTER)
@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+from src.db import ConnectionManager
+from src.llm_queue import LLMQueue
+from src.order_llm import LLMOrderParser
+
+# Labelled fields but no amount: the regex parser is unsure and asks the model.
+UNCLEAR = "الاسم : محمد سعد\nرقم التليفون : 01012345678\nالف وتسعمية\n"
+
+
+class GatedClient:
+    """Answers every block with one 1500 order once release is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, **kwargs):
+        self.release.wait(5)
+        blocks = json.loads(messages[-1]['content'])['blocks']
+        content = json.dumps({'results': [{'id': b['id'], 'total_amount': 1500, 'order_count': 1} for b in blocks]})
+        message = type('Message', (), {'content': content})()
+        return type('Completion', (), {'choices': [type('Choice', (), {'message': message})()]})()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_answers_within_the_deadline_are_used(db):
+    client = GatedClient()
+    client.release.set()
+    queue = LLMQueue(LLMOrderParser(client=client, breaker=None), db, deadline=5)
+    result = queue.parse(UNCLEAR)
+    assert (result['total_amount'], result['order_count'], result['llm_blocks']) == (1500, 1, 1)
+    assert result['pending_blocks'] == 0
+    assert result['parse_id'] is None
+
+
+def test_late_answers_are_readable_from_another_worker(db):
+    client = GatedClient()
+    queue = LLMQueue(LLMOrderParser(client=client, breaker=None), db, deadline=0.05)
+    result = queue.parse(UNCLEAR)
+    assert result['pending_blocks'] == 1
+    assert result['total_amount'] == 0
+
+    # Another gunicorn worker: its own queue and connections on the same file.
+    other_db = ConnectionManager(db.db_path)
+    other = LLMQueue(LLMOrderParser(client=GatedClient(), breaker=None), other_db)
+    try:
+        pending = other.get(result['parse_id'])
+        assert pending['pending_blocks'] == 1 and not pending['final']
+
+        client.release.set()
+        wait_for(lambda: other.get(result['parse_id'])['final'])
+        final = other.get(result['parse_id'])
+        assert (final['total_amount'], final['order_count'], final['pending_blocks']) == (1500, 1, 0)
+    finally:
+        other_db.close_all()
+
+
+def test_full_queue_keeps_the_regex_result(db):
+    queue = LLMQueue(LLMOrderParser(client=GatedClient(), breaker=None), db, queue_size=0)
+    result = queue.parse(UNCLEAR)
+    assert result['pending_blocks'] == 1
+    assert result['parse_id'] is None
+
+
+def test_unknown_parse_id(db):
+    queue = LLMQueue(LLMOrderParser(client=GatedClient(), breaker=None), db)
+    assert queue.get('missing') is None
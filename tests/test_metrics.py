@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import RETIRED_WORKER, Metrics, submit_in_context
+
+
+def worker(db, name):
+    """A Metrics flushing to db as one gunicorn worker, without the background flusher."""
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.db = db
+    metrics._worker = name
+    return metrics
+
+
+def sample(text, line):
+    """The value of one sample line of the Prometheus text."""
+    for row in text.splitlines():
+        if row.startswith(line + ' '):
+            return float(row.rsplit(' ', 1)[1])
+    raise AssertionError(f"{line} not in:\n{text}")
+
+
+def test_render_counters_and_cumulative_histograms():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.inc('facebook_fetch_total', outcome='ok')
+    metrics.inc('facebook_fetch_total', 2, outcome='ok')
+    metrics.inc('facebook_fetch_total', outcome='error')
+    for seconds in (0.05, 0.5, 3):
+        metrics.observe('report_build_seconds', seconds)
+    text = metrics.render()
+    assert '# HELP report_build_seconds Time to build the full report.' in text
+    assert '# TYPE facebook_fetch_total counter' in text
+    assert sample(text, 'facebook_fetch_total{outcome="ok"}') == 3
+    assert sample(text, 'facebook_fetch_total{outcome="error"}') == 1
+    assert sample(text, 'report_build_seconds_bucket{le="0.1"}') == 1
+    assert sample(text, 'report_build_seconds_bucket{le="1"}') == 2
+    assert sample(text, 'report_build_seconds_bucket{le="+Inf"}') == 3
+    assert sample(text, 'report_build_seconds_count') == 3
+    assert sample(text, 'report_build_seconds_sum') == 3.55
+
+
+def test_every_worker_s_metrics_are_added_up(db):
+    first, second = worker(db, 'host:1'), worker(db, 'host:2')
+    first.inc('orders_parsed_total', 5)
+    first.observe('db_insert_seconds', 0.05)
+    second.inc('orders_parsed_total', 7)
+    second.observe('db_insert_seconds', 2)
+    # The other worker's numbers arrive with its next flush.
+    second.flush()
+    for metrics in (first, second):
+        text = metrics.render()
+        assert sample(text, 'orders_parsed_total') == 12
+        assert sample(text, 'db_insert_seconds_bucket{le="0.1"}') == 1
+        assert sample(text, 'db_insert_seconds_count') == 2
+
+
+def test_rows_of_gone_workers_are_kept_in_the_retired_row(db):
+    conn = db.connection()
+    for name, count in (('host:1', 5), ('host:2', 7)):
+        gone = worker(db, name)
+        gone.inc('orders_parsed_total', count)
+        gone.flush()
+        with conn:
+            conn.execute('UPDATE metric_snapshots SET updated_at = 0 WHERE worker = ?', (name,))
+        live = worker(db, 'host:3')
+        live.inc('orders_parsed_total')
+        assert sample(live.render(), 'orders_parsed_total') == 1 + (5 if name == 'host:1' else 12)
+
+    workers = {row[0] for row in conn.execute('SELECT worker FROM metric_snapshots')}
+    assert workers == {RETIRED_WORKER, 'host:3'}
+
+
+def test_histograms_with_other_buckets_are_left_out(db):
+    old = Metrics(buckets=(1,))
+    old.db, old._worker = db, 'host:old'
+    old.observe('db_insert_seconds', 0.5)
+    old.flush()
+    current = worker(db, 'host:new')
+    current.observe('db_insert_seconds', 0.5)
+    assert sample(current.render(), 'db_insert_seconds_count') == 1
+
+
+def test_stages_include_pool_tasks_run_in_the_request_s_context():
+    metrics = Metrics()
+    with ThreadPoolExecutor(1) as pool, metrics.collect_stages() as stages:
+        metrics.observe('db_aggregate_seconds', 0.25)
+        submit_in_context(pool, metrics.observe, 'facebook_fetch_seconds', 1.5).result()
+        pool.submit(metrics.observe, 'facebook_fetch_seconds', 9).result()
+    assert stages == {'db_aggregate_seconds': 0.25, 'facebook_fetch_seconds': 1.5}
@@ -0,0 +1,28 @@
+from src.order_files import append_team_orders, fingerprints_path, team_file_totals
+from src.order_parser import Order
+
+
+def order(name, price=1190.0, shipping=65.0):
+    return Order(name=name, price=price, shipping=shipping, agent='روان',
+                 amount_text=f"{price:g} + {shipping:g}")
+
+
+def test_saved_orders_are_not_appended_again(tmp_path):
+    orders_dir = str(tmp_path)
+    first = append_team_orders(orders_dir, 'A', [order('محمد سعد'), order('مي حسين', 950.0, 70.0)])
+    assert len(first) == 2
+    again = append_team_orders(orders_dir, 'A', [order('محمد سعد'), order('هبة عادل', 1890.0, 75.0)])
+    assert [o.name for o in again] == ['هبة عادل']
+    assert team_file_totals(orders_dir) == {'A.txt': {'orders': 3, 'sales': 4030.0}}
+
+
+def test_duplicates_within_one_save_are_skipped(tmp_path):
+    stored = append_team_orders(str(tmp_path), 'A', [order('محمد سعد'), order('محمد سعد')])
+    assert len(stored) == 1
+    with open(fingerprints_path(str(tmp_path), 'A'), encoding='utf-8') as f:
+        assert len(f.read().split()) == 1
+
+
+def test_teams_are_deduplicated_separately(tmp_path):
+    append_team_orders(str(tmp_path), 'A', [order('محمد سعد')])
+    assert len(append_team_orders(str(tmp_path), 'B', [order('محمد سعد')])) == 1
@@ -0,0 +1,57 @@
+import io
+
+from benchmarks.whatsapp_export import generate_export
+from src import main
+from src.order_import import import_orders, iter_string_chunks, iter_text_chunks
+from src.order_parser import parse_orders
+
+ORDER = ("[17/07/2025, 10:00:00] روان: الاسم : محمد سعد\n"
+         "المبلغ : 1190 + 65\n"
+         "الايچينت : روان\n")
+NO_AMOUNT = ("[17/07/2025, 10:02:00] ندى: الاسم : منى فتحي\n"
+             "المبلغ : لسه هيتأكد\n")
+
+
+def test_text_chunks_decode_across_chunk_boundaries():
+    data = ('\ufeff' + ORDER.replace('\n', '\r\n')).encode('utf-8')
+    # 5 bytes at a time splits every two-byte Arabic letter somewhere.
+    assert ''.join(iter_text_chunks(io.BytesIO(data), chunk_size=5)) == ORDER
+
+
+def test_import_in_small_chunks_finds_every_order(conn):
+    text, expected = generate_export(400, seed=5)
+    summary = import_orders(conn, 'A', iter_string_chunks(text, 97))
+    assert summary['order_count'] == len(expected) == len(parse_orders(text))
+    assert summary['total_sales'] == sum(order.price for order in expected)
+    assert summary['rejected_count'] == summary['blocks'] - len(expected) > 0
+    stored = conn.execute("SELECT COUNT(*) FROM order_lines WHERE team = 'A'").fetchone()[0]
+    assert stored == len(expected)
+
+    again = import_orders(conn, 'A', iter_string_chunks(text))
+    assert again['order_count'] == 0
+    assert again['duplicates_skipped'] == len(expected)
+
+
+def test_upload_counts_orders_per_team_and_returns_rejected_blocks():
+    client = main.app.test_client()
+    response = client.post('/api/upload_orders', data={
+        'Team B': (io.BytesIO((ORDER + NO_AMOUNT).encode('utf-8')), 'chat.txt'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['orders_saved'] == 1
+    assert data['teams']['B']['order_count'] == 1
+    assert data['teams']['B']['total_sales'] == 1190
+    assert [(block['team'], block['name']) for block in data['rejected']] == [('B', 'منى فتحي')]
+
+
+def test_upload_takes_a_raw_body_and_rejects_an_unknown_team():
+    client = main.app.test_client()
+    text = ORDER.replace('محمد سعد', 'عمر جاد')
+    response = client.post('/api/upload_orders?team=C1', data=text.encode('utf-8'), content_type='text/plain')
+    assert response.status_code == 200
+    assert response.get_json()['teams'] == {'C1': {
+        'blocks': 1, 'order_count': 1, 'total_sales': 1190.0, 'duplicates_skipped': 0, 'rejected_count': 0,
+    }}
+    response = client.post('/api/upload_orders?team=Z', data=text.encode('utf-8'), content_type='text/plain')
+    assert response.status_code == 400
@@ -0,0 +1,90 @@
+import json
+
+from src.order_llm import LLMOrderParser, StubLLMClient, split_blocks
+
+REGULAR = ("[17/07/2025, 10:00:00] روان: الاسم : محمد سعد\n"
+           "المبلغ : 1190 + 65\n"
+           "الايچينت : روان\n")
+CHATTER = "[17/07/2025, 10:01:00] ندى: تمام يا فندم\n"
+
+
+def free_form(minute, phone='01012345678'):
+    return f"[17/07/2025, 10:{minute:02d}:00] شهد: عايزة علبتين ب 1190 جنيه والشحن 65 رقمها {phone}\n"
+
+
+class AnsweringClient(StubLLMClient):
+    """Answers every block with one order of 1255, and records the batches it was sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        blocks = json.loads(messages[-1]['content'])['blocks']
+        self.batches.append([block['text'] for block in blocks])
+        content = json.dumps({'results': [{'id': block['id'], 'total_amount': 1255, 'order_count': 1}
+                                          for block in blocks]})
+        message = type('Message', (), {'content': content})()
+        return type('Completion', (), {'choices': [type('Choice', (), {'message': message})()]})()
+
+
+def parser(client, **options):
+    return LLMOrderParser(client=client, breaker=None, **options)
+
+
+def test_blocks_are_split_at_headers_and_scored():
+    split_guess_text = "الاسم : منى\nالمبلغ : ١٬٢٥٠ + ٧٠ + ٥٥\n"
+    blocks = split_blocks(REGULAR + CHATTER + free_form(2) + split_guess_text)
+    assert [block.text for block in blocks] == [REGULAR, CHATTER, free_form(2), split_guess_text]
+    regular, chatter, unlabelled, split_guess = blocks
+    assert (regular.total_amount, regular.order_count, regular.confidence) == (1255, 1, 1.0)
+    assert (chatter.order_count, chatter.confidence) == (0, 1.0)
+    assert (unlabelled.order_count, unlabelled.confidence) == (0, 0.3)
+    # Three numbers in the amount: the price/shipping split is a guess.
+    assert split_guess.order_count == 1 and split_guess.confidence < 1.0
+
+
+def test_regular_text_makes_no_model_calls():
+    client = AnsweringClient()
+    result = parser(client).parse(REGULAR + CHATTER + REGULAR.replace('محمد سعد', 'عمر جاد'))
+    assert client.calls == 0
+    assert result == {'total_amount': 2510.0, 'order_count': 2, 'blocks': 3, 'llm_blocks': 0, 'cached_blocks': 0}
+
+
+def test_only_uncertain_blocks_go_to_the_model_in_batches():
+    client = AnsweringClient()
+    text = REGULAR + ''.join(free_form(minute, f'0101234567{minute}') for minute in range(2, 7))
+    result = parser(client, batch_size=2).parse(text)
+    assert [len(batch) for batch in client.batches] == [2, 2, 1]
+    assert REGULAR not in ''.join(text for batch in client.batches for text in batch)
+    assert result['llm_blocks'] == 5
+    assert result['order_count'] == 6
+    assert result['total_amount'] == 6 * 1255
+
+
+def test_threshold_decides_which_blocks_are_uncertain():
+    client = AnsweringClient()
+    result = parser(client, threshold=0.2).parse(REGULAR + free_form(2))
+    assert client.calls == 0
+    assert result['order_count'] == 1
+
+
+def test_answers_are_cached_by_block_text_without_its_header():
+    client = AnsweringClient()
+    llm = parser(client)
+    assert llm.parse(free_form(2))['llm_blocks'] == 1
+    # The same message pasted again, exported with another timestamp.
+    again = llm.parse(CHATTER + free_form(9))
+    assert client.calls == 1
+    assert again['cached_blocks'] == 1 and again['llm_blocks'] == 0
+    assert again['total_amount'] == 1255
+
+
+def test_cache_keeps_the_most_recent_answers():
+    client = AnsweringClient()
+    llm = parser(client, cache_size=1)
+    llm.parse(free_form(2, '01011111111'))
+    llm.parse(free_form(3, '01022222222'))
+    llm.parse(free_form(4, '01011111111'))
+    assert client.calls == 3
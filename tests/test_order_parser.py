@@ -0,0 +1,56 @@
+from benchmarks.whatsapp_export import generate_export
+from src.order_parser import OrderStream, iter_records
+
+
+def stream_records(text, size):
+    stream = OrderStream()
+    records = []
+    for start in range(0, len(text), size):
+        records.extend(stream.feed_records(text[start:start + size]))
+    records.extend(stream.close_records())
+    return records
+
+
+def test_chunked_stream_matches_whole_text():
+    text, _ = generate_export(300, seed=3)
+    expected = [record.to_dict() for record in iter_records(text)]
+    for size in (1, 7, 64, 1000, len(text)):
+        assert [record.to_dict() for record in stream_records(text, size)] == expected
+
+
+def test_stream_finds_generated_orders():
+    text, expected = generate_export(300, seed=4)
+    stream = OrderStream()
+    orders = stream.feed(text) + stream.close()
+    assert sorted((o.name, o.price, o.shipping) for o in orders) == sorted(o.key for o in expected)
+
+
+def test_pending_keeps_only_text_after_the_last_header():
+    order = ("[17/07/2025, 10:00:00] روان: الاسم : محمد سعد\n"
+             "المبلغ : 1190 + 65\n"
+             "الايچينت : روان\n")
+    chatter = "[17/07/2025, 10:01:00] ندى: تمام يا فندم\n"
+    stream = OrderStream()
+    assert stream.feed(order) == []
+    orders = stream.feed(chatter * 50)
+    assert [o.name for o in orders] == ['محمد سعد']
+    assert stream.pending == chatter
+    assert stream.close() == []
+
+
+def test_headers_end_records_and_may_carry_the_first_field():
+    text = ("الاسم : منى سعد\n"
+            "[17/07/2025, 10:00:00] ندى: تمام\n"
+            "المبلغ : 950\n"
+            "[ملاحظة] العميلة هتستلم بكرة\n"
+            "17/07/2025, 10:05 PM - الاسم : هبة فتحي\n"
+            "المبلغ : 1190 + 65 <This message was edited>\n"
+            "[‏17‏/7‏/2025، 10:06:00 م] ~ روان: الأسم : عمر جاد\n"
+            "[اضافة] المبلغ : ١٢٥٠ + ٧٠\n")
+    records = [(record.name, record.amount_text) for record in iter_records(text)]
+    assert records == [
+        ('منى سعد', None),
+        (None, '950'),
+        ('هبة فتحي', '1190 + 65'),
+        ('عمر جاد', None),
+    ]
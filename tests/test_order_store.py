@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from src.order_parser import Order
+from src.order_store import CAIRO_TZ, daily_team_totals, insert_orders
+
+DAY_1 = CAIRO_TZ.localize(datetime(2025, 7, 17, 12, 0))
+DAY_2 = CAIRO_TZ.localize(datetime(2025, 7, 18, 12, 0))
+
+
+def order(name='محمد سعد', price=1190.0, shipping=65.0):
+    return Order(name=name, price=price, shipping=shipping, agent='روان', phone='01012345678')
+
+
+def test_same_order_is_stored_once_a_day(conn):
+    assert insert_orders(conn, 'A', [order(), order('مي حسين', 950.0, 70.0)], now=DAY_1) != []
+    assert insert_orders(conn, 'A', [order()], now=DAY_1) == []
+    assert daily_team_totals(conn, '2025-07-17') == {'A': {'orders': 2, 'sales': 2140.0, 'shipping': 135.0}}
+
+
+def test_fingerprint_ignores_spacing_and_case(conn):
+    insert_orders(conn, 'A', [order('محمد  سعد')], now=DAY_1)
+    assert insert_orders(conn, 'A', [order(' محمد سعد ')], now=DAY_1) == []
+
+
+def test_same_order_on_another_day_is_stored(conn):
+    insert_orders(conn, 'A', [order()], now=DAY_1)
+    assert len(insert_orders(conn, 'A', [order()], now=DAY_2)) == 1
+    assert daily_team_totals(conn, '2025-07-18') == {'A': {'orders': 1, 'sales': 1190.0, 'shipping': 65.0}}
+
+
+def test_teams_are_deduplicated_separately(conn):
+    insert_orders(conn, 'A', [order()], now=DAY_1)
+    assert len(insert_orders(conn, 'B', [order()], now=DAY_1)) == 1
+    assert daily_team_totals(conn, '2025-07-17') == {
+        'A': {'orders': 1, 'sales': 1190.0, 'shipping': 65.0},
+        'B': {'orders': 1, 'sales': 1190.0, 'shipping': 65.0},
+    }
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+from src.order_parser import parse_orders
+from src.order_store import CAIRO_TZ, daily_team_totals, insert_orders
+from src.paste_checkpoints import PasteCheckpoint
+
+DAY_1 = CAIRO_TZ.localize(datetime(2025, 7, 17, 20, 0))
+DAY_2 = CAIRO_TZ.localize(datetime(2025, 7, 18, 11, 0))
+
+
+def message(time, name, amount, agent='روان'):
+    return (f"[17/07/2025, {time}] {agent}: الاسم : {name}\n"
+            f"رقم التليفون : 01012345678\n"
+            f"المبلغ : {amount}\n"
+            f"الايچينت : {agent}\n")
+
+
+def paste(conn, text, now):
+    # What /api/save_orders does with a paste.
+    checkpoint = PasteCheckpoint(conn, 'A', text)
+    stored = insert_orders(conn, 'A', parse_orders(checkpoint.tail), now=now, known=checkpoint.previous)
+    checkpoint.save()
+    return checkpoint, stored
+
+
+def test_first_paste_is_parsed_in_full(conn):
+    text = message('10:00:00', 'محمد سعد', '1190 + 65') + message('10:05:00', 'مي حسين', '950 + 70')
+    checkpoint, stored = paste(conn, text, DAY_1)
+    assert checkpoint.tail == text
+    assert checkpoint.skipped_messages == 0
+    assert [order.name for order in stored] == ['محمد سعد', 'مي حسين']
+
+
+def test_repaste_on_next_day_counts_only_new_orders(conn):
+    day_1 = message('10:00:00', 'محمد سعد', '1190 + 65') + message('10:05:00', 'مي حسين', '950 + 70')
+    paste(conn, day_1, DAY_1)
+
+    day_2 = day_1 + message('11:00:00', 'هبة عادل', '1890 + 75')
+    checkpoint, stored = paste(conn, day_2, DAY_2)
+
+    assert checkpoint.skipped_messages == 2
+    assert [order.name for order in stored] == ['هبة عادل']
+    assert daily_team_totals(conn, '2025-07-18') == {'A': {'orders': 1, 'sales': 1890.0, 'shipping': 75.0}}
+
+
+def test_same_paste_again_parses_nothing(conn):
+    text = message('10:00:00', 'محمد سعد', '1190 + 65')
+    paste(conn, text, DAY_1)
+    checkpoint, stored = paste(conn, text, DAY_2)
+    assert checkpoint.tail == ''
+    assert stored == []
+
+
+def test_last_message_is_parsed_again_when_it_grew(conn):
+    full = message('10:00:00', 'محمد سعد', '1190 + 65') + message('10:05:00', 'مي حسين', '950 + 70')
+    # The first paste was cut off before the second order's amount.
+    cut = full[:full.index('المبلغ : 950')]
+    paste(conn, cut, DAY_1)
+
+    checkpoint, stored = paste(conn, full, DAY_1)
+    assert checkpoint.skipped_messages == 1
+    assert checkpoint.tail.startswith('[17/07/2025, 10:05:00]')
+    assert [order.name for order in stored] == ['مي حسين']
+
+
+def test_edited_message_replaces_its_order(conn):
+    first = message('10:00:00', 'محمد سعد', '1190 + 65')
+    second = message('10:05:00', 'مي حسين', '950 + 70')
+    third = message('10:10:00', 'هبة عادل', '1890 + 75')
+    paste(conn, first + second + third, DAY_1)
+
+    edited = first + second.replace('950 + 70', '1250 + 70') + third
+    checkpoint, stored = paste(conn, edited, DAY_1)
+    assert checkpoint.skipped_messages == 1
+    # The corrected order is stored, the unchanged one after it is kept as it was.
+    assert [(order.name, order.price) for order in stored] == [('مي حسين', 1250.0)]
+    assert checkpoint.superseded == 1
+    assert daily_team_totals(conn, '2025-07-17') == {'A': {'orders': 3, 'sales': 4330.0, 'shipping': 210.0}}
+
+
+def test_edit_pasted_on_the_next_day(conn):
+    first = message('10:00:00', 'محمد سعد', '1190 + 65')
+    second = message('10:05:00', 'مي حسين', '950 + 70')
+    third = message('10:10:00', 'هبة عادل', '1890 + 75')
+    paste(conn, first + second + third, DAY_1)
+
+    edited = first + second.replace('950 + 70', '1250 + 70') + third
+    checkpoint, stored = paste(conn, edited, DAY_2)
+    # The unchanged order after the edit isn't counted again on day 2.
+    assert [order.name for order in stored] == ['مي حسين']
+    assert daily_team_totals(conn, '2025-07-17') == {'A': {'orders': 2, 'sales': 3080.0, 'shipping': 140.0}}
+    assert daily_team_totals(conn, '2025-07-18') == {'A': {'orders': 1, 'sales': 1250.0, 'shipping': 70.0}}
+
+
+def test_deleted_message_removes_its_order(conn):
+    first = message('10:00:00', 'محمد سعد', '1190 + 65')
+    second = message('10:05:00', 'مي حسين', '950 + 70')
+    third = message('10:10:00', 'هبة عادل', '1890 + 75')
+    paste(conn, first + second + third, DAY_1)
+
+    checkpoint, stored = paste(conn, first + third, DAY_1)
+    assert stored == []
+    assert checkpoint.superseded == 1
+    assert daily_team_totals(conn, '2025-07-17') == {'A': {'orders': 2, 'sales': 3080.0, 'shipping': 140.0}}
+
+
+def test_edit_keeps_an_order_repeated_earlier_in_the_chat(conn):
+    first = message('10:00:00', 'محمد سعد', '1190 + 65')
+    # The agent sent the same order again, then corrected the copy.
+    repeat = message('10:05:00', 'محمد سعد', '1190 + 65')
+    paste(conn, first + repeat, DAY_1)
+
+    checkpoint, _ = paste(conn, first + repeat.replace('1190 + 65', '1250 + 65'), DAY_1)
+    assert checkpoint.superseded == 0
+    assert daily_team_totals(conn, '2025-07-17')['A']['orders'] == 2
+
+
+def test_checkpoints_are_per_team(conn):
+    text = message('10:00:00', 'محمد سعد', '1190 + 65')
+    paste(conn, text, DAY_1)
+    assert PasteCheckpoint(conn, 'Team B', text).tail == text
+    assert PasteCheckpoint(conn, 'Team A', text).tail == ''
@@ -0,0 +1,87 @@
+import time
+
+from flask import Flask
+
+from src import main
+from src.metrics import metrics
+from src.profiling import ProfilingMiddleware, profile_text
+
+
+def make_app(db, **options):
+    app = Flask(__name__)
+
+    @app.route('/orders/<team>', methods=['POST'])
+    def save_team_orders(team):
+        metrics.observe('db_insert_seconds', 0.125)
+        return 'saved'
+
+    @app.route('/slow')
+    def slow_report():
+        deadline = time.monotonic() + 0.15
+        while time.monotonic() < deadline:
+            pass
+        return 'done'
+
+    @app.route('/api/live/updates')
+    def live_updates():
+        return 'events'
+
+    profiler = ProfilingMiddleware(app.wsgi_app, db, url_map=app.url_map, **options)
+    app.wsgi_app = profiler
+    return app, profiler
+
+
+def test_sampled_request_is_stored_with_route_payload_and_stages(db):
+    app, profiler = make_app(db, sample_rate=1, slow_seconds=0)
+    response = app.test_client().post('/orders/A', data='x' * 300)
+    assert response.status_code == 200
+    (profile,) = profiler.recent()
+    assert profile['route'] == '/orders/<team>' and profile['path'] == '/orders/A'
+    assert (profile['method'], profile['status'], profile['payload_bytes']) == ('POST', '200', 300)
+    assert (profile['reason'], profile['kind']) == ('sampled', 'cprofile')
+    assert profile['stages'] == {'db_insert_seconds': 0.125}
+    kind, data = profiler.load(profile['id'])
+    assert kind == 'cprofile'
+    assert 'save_team_orders' in profile_text(data, limit=None)
+
+
+def test_slow_requests_keep_their_stack_samples(db):
+    app, profiler = make_app(db, sample_rate=0, slow_seconds=0.1)
+    client = app.test_client()
+    client.post('/orders/A')
+    client.get('/slow')
+    (profile,) = profiler.recent()
+    assert (profile['route'], profile['reason'], profile['kind']) == ('/slow', 'slow', 'stacks')
+    assert profile['seconds'] >= 0.1
+    kind, data = profiler.load(profile['id'])
+    stacks = data.decode().splitlines()
+    assert any('test_profiling.py:slow_report' in line for line in stacks)
+
+
+def test_long_polls_are_never_profiled(db):
+    app, profiler = make_app(db, sample_rate=1, slow_seconds=0.001)
+    app.test_client().get('/api/live/updates')
+    assert profiler.recent() == []
+
+
+def test_only_the_newest_profiles_are_kept(db):
+    app, profiler = make_app(db, sample_rate=1, ring_size=2)
+    client = app.test_client()
+    for team in ('A', 'B', 'C'):
+        client.post(f'/orders/{team}')
+    assert [profile['path'] for profile in profiler.recent()] == ['/orders/C', '/orders/B']
+
+
+def test_admin_endpoints_need_the_token(monkeypatch):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(main.profiler, 'sample_rate', 1)
+    client = main.app.test_client()
+    client.get('/api/live/snapshot')
+    assert client.get('/admin/profiles').status_code == 403
+    assert client.get('/admin/profiles', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+    profiles = client.get('/admin/profiles', headers={'X-Admin-Token': 'secret'}).get_json()['profiles']
+    assert profiles[0]['route'] == '/api/live/snapshot'
+    text = client.get(f"/admin/profiles/{profiles[0]['id']}?format=text&token=secret")
+    assert text.status_code == 200 and 'live_snapshot' in text.get_data(as_text=True)
+    assert client.get('/admin/profiles/999999?token=secret').status_code == 404
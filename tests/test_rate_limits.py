@@ -0,0 +1,105 @@
+import json
+import time
+
+import pytest
+
+from src import rate_limits
+from src.rate_limits import UsageModel, is_throttle_error, parse_usage_headers
+from src.spend_cache import SpendCache
+
+
+def business_usage(call_count, regain_minutes=0):
+    return json.dumps({'act_1': [{
+        'type': 'ads_insights', 'call_count': call_count, 'total_cputime': 10, 'total_time': 12,
+        'estimated_time_to_regain_access': regain_minutes,
+    }]})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def test_usage_is_the_highest_reading_of_every_header():
+    assert parse_usage_headers({'X-Business-Use-Case-Usage': business_usage(40)}) == (40.0, 0.0)
+    assert parse_usage_headers({
+        'x-app-usage': json.dumps({'call_count': 5, 'total_cputime': 61, 'total_time': 3}),
+        'x-fb-ads-insights-throttle': json.dumps({'app_id_util_pct': 20, 'acc_id_util_pct': 30}),
+    }) == (61.0, 0.0)
+    # Graph API batch responses list their headers.
+    assert parse_usage_headers([{'name': 'X-Ad-Account-Usage', 'value': json.dumps(
+        {'acc_id_util_pct': 100, 'reset_time_duration': 120})}]) == (100.0, 120.0)
+    assert parse_usage_headers({'X-Business-Use-Case-Usage': business_usage(100, regain_minutes=5)}) == (100.0, 300.0)
+
+
+def test_headers_without_usage_are_ignored():
+    assert parse_usage_headers({}) is None
+    assert parse_usage_headers({'Content-Type': 'application/json'}) is None
+    assert parse_usage_headers({'X-App-Usage': 'not json'}) is None
+
+
+def test_refreshes_slow_down_as_usage_grows(clock):
+    model = UsageModel()
+    model.record('act_1', {'X-Business-Use-Case-Usage': business_usage(50)})
+    assert model.ttl_factor('act_1') == 1.0
+    assert model.blocked_for('act_1') == 0
+
+    model.record('act_1', {'X-Business-Use-Case-Usage': business_usage(85)})
+    assert 1.0 < model.ttl_factor('act_1') < rate_limits.RATE_LIMIT_MAX_SLOWDOWN
+    model.record('act_1', {'X-Business-Use-Case-Usage': business_usage(95)})
+    assert model.ttl_factor('act_1') == rate_limits.RATE_LIMIT_MAX_SLOWDOWN
+    assert model.blocked_for('act_1') == rate_limits.RATE_LIMIT_BACKOFF
+
+    # Old readings are forgotten.
+    clock[0] += rate_limits.RATE_LIMIT_READING_TTL + 1
+    assert model.usage('act_1') == 0.0
+    assert model.ttl_factor('act_1') == 1.0
+    assert model.usage('act_2') == 0.0
+
+
+def test_account_is_left_alone_until_access_is_regained(clock):
+    model = UsageModel()
+    model.record('act_1', {'X-Business-Use-Case-Usage': business_usage(100, regain_minutes=10)})
+    assert model.blocked_for('act_1') == 600
+    clock[0] += 599
+    assert model.blocked_for('act_1') == 1
+    clock[0] += 1
+    assert model.blocked_for('act_1') == 0
+
+    model.record_throttled('act_2', retry_after=30)
+    assert model.blocked_for('act_2') == 30
+
+
+def test_throttle_errors_are_recognised_by_code():
+    class GraphError(Exception):
+        def __init__(self, code):
+            self.code = code
+
+        def api_error_code(self):
+            return self.code
+
+    assert is_throttle_error(GraphError(17))
+    assert is_throttle_error(GraphError(80004))
+    assert not is_throttle_error(GraphError(190))
+    assert not is_throttle_error(ValueError('timeout'))
+
+
+def test_throttled_account_keeps_its_last_spend(clock):
+    model = UsageModel()
+    cache = SpendCache(ttl=60, max_stale=120, throttle=model)
+    calls = []
+
+    def fetch(accounts, since, until, deadline=None):
+        calls.append(set(accounts))
+        return {team: 100.0 for team in accounts}
+
+    accounts = {'A': ('act_1', 'token')}
+    assert cache.get_many(accounts, '2025-07-17', '2025-07-17', fetch)[0] == {'A': 100.0}
+    model.record_throttled('act_1', retry_after=3600)
+    clock[0] += 1000
+    spend, ages = cache.get_many(accounts, '2025-07-17', '2025-07-17', fetch)
+    assert spend == {'A': 100.0}
+    assert ages == {'A': 1000.0}
+    assert calls == [{'A'}]
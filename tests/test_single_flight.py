@@ -0,0 +1,109 @@
+import threading
+import time
+
+from src.shared_cache import SharedCache
+from src.single_flight import SingleFlight
+
+
+class Report:
+    """A report computation that blocks until released and counts its runs."""
+
+    def __init__(self, result='report'):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(2)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def run_in_threads(count, fn):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight()
+    report = Report({'total': 10})
+    threads, results, errors = run_in_threads(10, lambda: flight.do('2025-07-17', report))
+    assert report.started.wait(2)
+    # Let the other callers reach the wait before the leader finishes.
+    time.sleep(0.05)
+    report.release.set()
+    for thread in threads:
+        thread.join(2)
+    assert report.calls == 1
+    assert results == [{'total': 10}] * 10 and errors == [None] * 10
+
+    # A later call runs again.
+    assert flight.do('2025-07-17', lambda: 'fresh') == 'fresh'
+
+
+def test_waiters_get_the_leader_s_error():
+    flight = SingleFlight()
+    report = Report(ValueError('Facebook down'))
+    threads, results, errors = run_in_threads(3, lambda: flight.do('key', report))
+    assert report.started.wait(2)
+    time.sleep(0.05)
+    report.release.set()
+    for thread in threads:
+        thread.join(2)
+    assert report.calls == 1
+    assert [str(error) for error in errors] == ['Facebook down'] * 3
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+
+
+def test_other_worker_s_result_is_picked_up_from_the_shared_cache(db):
+    shared = SharedCache(db)
+    flight = SingleFlight(shared=shared, timeout=2)
+    # Another worker holds the key's refresh lock (a different owner than the flight's thread).
+    assert shared.acquire('report', 5)
+    report = Report()
+    threads, results, _ = run_in_threads(1, lambda: flight.do('report', report))
+    time.sleep(0.1)
+    shared.set('report', {'total': 7})
+    shared.release('report')
+    threads[0].join(2)
+    assert results == [{'total': 7}]
+    assert report.calls == 0
+
+
+def test_computes_itself_when_the_other_worker_gives_up(db):
+    shared = SharedCache(db)
+    flight = SingleFlight(shared=shared, timeout=2)
+    assert shared.acquire('report', 5)
+    threads, results, _ = run_in_threads(1, lambda: flight.do('report', lambda: {'total': 3}))
+    time.sleep(0.1)
+    shared.release('report')
+    threads[0].join(2)
+    assert results == [{'total': 3}]
+
+
+def test_leader_stores_its_result_for_other_workers(db):
+    shared = SharedCache(db)
+    flight = SingleFlight(shared=shared)
+    assert flight.do('report', lambda: {'total': 5}) == {'total': 5}
+    assert shared.get('report')[0] == {'total': 5}
+    assert not shared.is_locked('report')
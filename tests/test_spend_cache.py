@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from src import spend_cache
+from src.spend_cache import SpendCache
+
+ACCOUNTS = {'A': ('act_1', 'token')}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(spend_cache.time, 'time', clock)
+    return clock
+
+
+class Fetch:
+    def __init__(self):
+        self.calls = 0
+        self.spend = 100.0
+
+    def __call__(self, accounts, since, until, deadline=None):
+        self.calls += 1
+        return {team: self.spend for team in accounts}
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_fresh_entry_is_served_without_fetching(clock):
+    cache = SpendCache(ttl=10, max_stale=100)
+    fetch = Fetch()
+    assert cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch) == ({'A': 100.0}, {'A': 0.0})
+    clock.now += 5
+    assert cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch) == ({'A': 100.0}, {'A': 5.0})
+    assert fetch.calls == 1
+
+
+def test_stale_entry_is_served_while_refreshing(clock):
+    cache = SpendCache(ttl=10, max_stale=100)
+    fetch = Fetch()
+    cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    clock.now += 50
+    fetch.spend = 150.0
+    spend, ages = cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    assert spend == {'A': 100.0}
+    assert ages == {'A': 50.0}
+    wait_for(lambda: fetch.calls == 2 and not cache._refreshing)
+    assert cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)[0] == {'A': 150.0}
+    assert fetch.calls == 2
+
+
+def test_too_old_entry_is_fetched_again(clock):
+    cache = SpendCache(ttl=10, max_stale=100)
+    fetch = Fetch()
+    cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    clock.now += 101
+    fetch.spend = 150.0
+    assert cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch) == ({'A': 150.0}, {'A': 0.0})
+    assert fetch.calls == 2
+
+
+def test_ttl_zero_always_fetches(clock):
+    cache = SpendCache(ttl=0, max_stale=0)
+    fetch = Fetch()
+    cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    clock.now += 1
+    cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    assert fetch.calls == 2
+
+
+def test_refreshes_run_on_the_shared_pool_once_per_account(clock):
+    cache = SpendCache(ttl=10, max_stale=100)
+    fetch = Fetch()
+    cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', fetch)
+    release = threading.Event()
+    threads = []
+
+    def slow_fetch(accounts, since, until, deadline=None):
+        threads.append(threading.current_thread().name)
+        release.wait(2)
+        return fetch(accounts, since, until)
+
+    clock.now += 50
+    before = threading.active_count()
+    for _ in range(20):
+        cache.get_many(ACCOUNTS, '2025-07-17', '2025-07-17', slow_fetch)
+    assert threading.active_count() - before <= spend_cache.SPEND_CACHE_REFRESH_WORKERS
+    release.set()
+    wait_for(lambda: not cache._refreshing)
+    assert len(threads) == 1
+    assert threads[0].startswith('spend-refresh')